@@ -0,0 +1,798 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import subprocess
+import tarfile
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from fractions import Fraction
+from functools import partial
+from typing import (IO, Dict, Iterable, List, NamedTuple, Optional, Sequence,
+                    Set, Tuple, Type, Union)
+
+import lmdb
+import numpy as np
+
+
+AUDIO_EXTENSIONS = ['aif', 'aiff', 'wav', 'opus', 'mp3', 'aac', 'flac', 'ogg']
+ARCHIVE_EXTENSIONS = ['.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tar.xz', '.zip']
+
+# archive members are addressed as archive_path::member_name
+MEMBER_SEPARATOR = '::'
+
+
+def is_archive(path: str) -> bool:
+    return os.path.isfile(path) and path.lower().endswith(
+        tuple(ARCHIVE_EXTENSIONS))
+
+
+def split_member(path: str) -> Tuple[str, Optional[str]]:
+    if MEMBER_SEPARATOR not in path:
+        return path, None
+    archive, member = path.split(MEMBER_SEPARATOR, 1)
+    return archive, member
+
+
+_archives = {}
+_archives_pid = None
+
+
+def open_archive(
+        archive: str) -> Tuple[Union[tarfile.TarFile, zipfile.ZipFile], Dict]:
+    """
+    Opens an archive once per process, along with an index of its members.
+    """
+    global _archives, _archives_pid
+    if _archives_pid != os.getpid():
+        _archives, _archives_pid = {}, os.getpid()
+    if archive not in _archives:
+        if archive.lower().endswith('.zip'):
+            handle = zipfile.ZipFile(archive)
+            members = {
+                m.filename: m
+                for m in handle.infolist() if not m.is_dir()
+            }
+        else:
+            handle = tarfile.open(archive, 'r:*')
+            members = {m.name: m for m in handle.getmembers() if m.isfile()}
+        _archives[archive] = handle, members
+    return _archives[archive]
+
+
+def list_archive(archive: str, extensions: Sequence[str]) -> List[str]:
+    extensions = {f'.{ext.lower().lstrip(".")}' for ext in extensions}
+    _, members = open_archive(archive)
+    return [
+        f'{archive}{MEMBER_SEPARATOR}{name}' for name in members
+        if os.path.splitext(name)[1].lower() in extensions
+    ]
+
+
+def open_member(path: str) -> IO[bytes]:
+    """
+    Opens an archive member as a (seekable) file object, without extracting
+    it.
+    """
+    archive, member = split_member(path)
+    handle, members = open_archive(archive)
+    if isinstance(handle, zipfile.ZipFile):
+        return handle.open(members[member])
+    return handle.extractfile(members[member])
+
+
+def get_signature(path: str) -> Dict:
+    """
+    Size and modification time (in ns) of a file or of an archive member.
+    """
+    archive, member = split_member(path)
+    if member is None:
+        stat = os.stat(path)
+        return {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+    _, members = open_archive(archive)
+    info = members[member]
+    if isinstance(info, zipfile.ZipInfo):
+        mtime = time.mktime(info.date_time + (0, 0, -1))
+        return {'size': info.file_size, 'mtime': int(mtime * 1e9)}
+    return {'size': info.size, 'mtime': int(info.mtime * 1e9)}
+
+
+def open_input(path: str) -> Union[str, IO[bytes]]:
+    return open_member(path) if MEMBER_SEPARATOR in path else path
+
+
+def feed_process(process: subprocess.Popen, data: IO[bytes]) -> threading.Thread:
+    """
+    Streams a file object to the standard input of a process.
+    """
+
+    def feed():
+        try:
+            shutil.copyfileobj(data, process.stdin)
+        except (BrokenPipeError, ValueError, OSError):
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+
+    thread = threading.Thread(target=feed, daemon=True)
+    thread.start()
+    return thread
+
+
+def _scan_directory(path: str, extensions: Set[str],
+                    archives: bool) -> Tuple[List[str], List[str]]:
+    files, directories = [], []
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return files, directories
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                directories.append(entry.path)
+                continue
+            name = entry.name.lower()
+            if os.path.splitext(name)[1] in extensions or (
+                    archives and name.endswith(tuple(ARCHIVE_EXTENSIONS))):
+                if entry.is_file():
+                    files.append(entry.path)
+        except OSError:
+            continue
+    return files, directories
+
+
+def _walk_directory(path: str, extensions: Set[str],
+                    archives: bool) -> List[str]:
+    found, pending = [], [path]
+    while pending:
+        files, directories = _scan_directory(pending.pop(), extensions,
+                                             archives)
+        found.extend(files)
+        pending.extend(directories)
+    return found
+
+
+def find_audio_files(paths: Sequence[str],
+                     extensions: Sequence[str] = AUDIO_EXTENSIONS,
+                     archives: bool = True,
+                     num_workers: int = 16) -> List[str]:
+    """
+    Lists the audio files found in the given files and directories, walking
+    each tree once and matching extensions case-insensitively. Top-level
+    subdirectories are walked concurrently, which mostly pays off on network
+    filesystems. Archives are expanded to their members when archives is
+    set.
+    """
+    extensions = {f'.{ext.lower().lstrip(".")}' for ext in extensions}
+    found = []
+    with ThreadPoolExecutor(num_workers) as executor:
+        for path in map(str, paths):
+            if os.path.isfile(path):
+                matches = os.path.splitext(path.lower())[1] in extensions or (
+                    archives and is_archive(path))
+                files, directories = [path] if matches else [], []
+            else:
+                files, directories = _scan_directory(path, extensions,
+                                                     archives)
+            for sub_files in executor.map(
+                    partial(_walk_directory,
+                            extensions=extensions,
+                            archives=archives), directories):
+                files.extend(sub_files)
+            members = executor.map(
+                partial(list_archive, extensions=extensions),
+                [os.path.abspath(f) for f in files if is_archive(f)])
+            files = [f for f in files if not is_archive(f)]
+            found.extend(sorted(files) + sorted(sum(members, [])))
+    return found
+
+
+def get_cache_dir(name: str) -> str:
+    root = os.environ.get('RAVE_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache',
+                                       'rave'))
+    return os.path.join(root, name)
+
+
+class AudioInfo(NamedTuple):
+    duration: float
+    channels: int
+    sr: int
+    codec: str
+
+
+def probe_audio(path: str) -> AudioInfo:
+    """
+    Retrieves duration, channel count, native sampling rate and codec of the
+    first audio stream with a single ffprobe call (or libsndfile when ffprobe
+    is not available). Archive members are piped to ffprobe.
+    """
+    data = None
+    if MEMBER_SEPARATOR in path:
+        with open_member(path) as f:
+            data = f.read()
+    try:
+        process = subprocess.run(
+            [
+                'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+                '-show_entries',
+                'format=duration:stream=channels,sample_rate,codec_name,duration',
+                '-of', 'json', path if data is None else 'pipe:0'
+            ],
+            input=data,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        return _probe_soundfile(path)
+    if process.returncode:
+        raise RuntimeError(f'could not probe {path}')
+    try:
+        info = json.loads(process.stdout.decode())
+        stream = info['streams'][0]
+        duration = info.get('format', {}).get('duration',
+                                              stream.get('duration'))
+        return AudioInfo(float(duration), int(stream['channels']),
+                         int(stream['sample_rate']), stream['codec_name'])
+    except (KeyError, IndexError, TypeError, ValueError):
+        raise RuntimeError(f'could not probe {path}')
+
+
+def _probe_soundfile(path: str) -> AudioInfo:
+    import soundfile as sf
+    if MEMBER_SEPARATOR in path:
+        with open_member(path) as f:
+            with sf.SoundFile(f) as sound:
+                return AudioInfo(sound.frames / sound.samplerate,
+                                 sound.channels, sound.samplerate,
+                                 sound.subtype.lower())
+    info = sf.info(path)
+    return AudioInfo(float(info.duration), int(info.channels),
+                     int(info.samplerate), info.subtype.lower())
+
+
+class ProbeCache(object):
+    """
+    Persistent cache of probe_audio results, keyed by (path, size, mtime).
+    Stored in an LMDB environment so that it can be shared between
+    preprocessing workers, datasets and the GUI.
+    """
+
+    def __init__(self,
+                 path: Optional[str] = None,
+                 map_size: int = 256 * 1024**2) -> None:
+        self.path = path or get_cache_dir('probe')
+        self.map_size = map_size
+        self._env = None
+        self._pid = None
+
+    @property
+    def env(self) -> Optional[lmdb.Environment]:
+        # lmdb environments must not be shared across forked processes
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                self._env = lmdb.open(self.path, map_size=self.map_size)
+            except (OSError, lmdb.Error):
+                self._env = None
+        return self._env
+
+    def __getstate__(self):
+        return {'path': self.path, 'map_size': self.map_size}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    @staticmethod
+    def _signature(path: str) -> Dict:
+        return get_signature(path)
+
+    @staticmethod
+    def _key(path: str) -> bytes:
+        archive, member = split_member(path)
+        path = os.path.abspath(archive)
+        if member is not None:
+            path += MEMBER_SEPARATOR + member
+        return path.encode()
+
+    def get(self, path: str) -> Optional[AudioInfo]:
+        if self.env is None:
+            return None
+        with self.env.begin() as txn:
+            entry = txn.get(self._key(path))
+        if entry is None:
+            return None
+        entry = json.loads(entry.decode())
+        if entry['signature'] != self._signature(path):
+            return None
+        return AudioInfo(**entry['info'])
+
+    def put(self, path: str, info: AudioInfo) -> None:
+        if self.env is None:
+            return
+        entry = {'signature': self._signature(path), 'info': info._asdict()}
+        try:
+            with self.env.begin(write=True) as txn:
+                txn.put(
+                    self._key(path),
+                    json.dumps(entry).encode(),
+                )
+        except lmdb.MapFullError:
+            pass
+
+    def probe(self, path: str) -> AudioInfo:
+        info = self.get(path)
+        if info is None:
+            info = probe_audio(path)
+            self.put(path, info)
+        return info
+
+
+_probe_cache = None
+
+
+def get_probe_cache() -> ProbeCache:
+    global _probe_cache
+    if _probe_cache is None:
+        _probe_cache = ProbeCache()
+    return _probe_cache
+
+
+def probe(path: str) -> AudioInfo:
+    return get_probe_cache().probe(path)
+
+
+def get_channel_map(input_channels: int, channels: int) -> Sequence[int]:
+    """
+    Returns the input channel to read for every output channel. Files with
+    fewer channels than requested are tiled (e.g. mono -> [0, 0]).
+    """
+    channel_map = range(channels)
+    if input_channels < channels:
+        channel_map = (math.ceil(channels / input_channels) *
+                       list(range(input_channels)))[:channels]
+    return list(channel_map)
+
+
+def float_to_int16(x: np.ndarray) -> np.ndarray:
+    x = np.clip(x, -1, 1)
+    return np.floor(x * (2**15 - 1)).astype(np.int16)
+
+
+def resample_poly(x: np.ndarray, orig_sr: int, target_sr: int) -> np.ndarray:
+    if orig_sr == target_sr:
+        return x
+    from scipy.signal import resample_poly as _resample_poly
+    ratio = Fraction(target_sr, orig_sr)
+    return _resample_poly(x, ratio.numerator, ratio.denominator, axis=-1)
+
+
+class AudioDecoder(object):
+    """
+    Decodes and resamples an audio file in a single pass, yielding int16
+    blocks of shape (input_channels, block_size). Only the last block may be
+    shorter than block_size.
+    """
+
+    def decode(self, path: str, sr: int,
+               block_size: int) -> Iterable[np.ndarray]:
+        raise NotImplementedError
+
+    def read(self, path: str, sr: int, start: int,
+             n_samples: int) -> np.ndarray:
+        """
+        Decodes n_samples (fewer at the end of the file) from sample start
+        on, as int16 of shape (input_channels, n_samples). Decoders able to
+        seek override it, this one decodes the file from its beginning.
+        """
+        blocks, position = [], 0
+        decoded = self.decode(path, sr, max(n_samples, 2**16))
+        for block in decoded:
+            stop = position + block.shape[-1]
+            if stop > start:
+                blocks.append(block[:, max(start - position, 0):start +
+                                    n_samples - position])
+            position = stop
+            if position >= start + n_samples:
+                break
+        decoded.close()
+        if not blocks:
+            return np.zeros((probe(path).channels, 0), dtype=np.int16)
+        return np.concatenate(blocks, -1)
+
+
+class FFmpegDecoder(AudioDecoder):
+    """
+    Streams interleaved s16le samples out of a single ffmpeg process.
+    Archive members are piped to its standard input.
+    """
+
+    def decode(self, path: str, sr: int,
+               block_size: int) -> Iterable[np.ndarray]:
+        input_channels = probe(path).channels
+        data = open_input(path)
+        process = subprocess.Popen(
+            [
+                'ffmpeg', '-hide_banner', '-loglevel', 'panic', '-i',
+                path if isinstance(data, str) else 'pipe:0', '-ar',
+                str(sr), '-f', 's16le', '-'
+            ],
+            stdin=None if isinstance(data, str) else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        if not isinstance(data, str):
+            feed_process(process, data)
+        n_bytes = block_size * input_channels * 2
+        try:
+            block = process.stdout.read(n_bytes)
+            while block:
+                block = np.frombuffer(block, dtype=np.int16)
+                block = block[:len(block) - len(block) % input_channels]
+                yield block.reshape(-1, input_channels).T
+                block = process.stdout.read(n_bytes)
+        finally:
+            process.stdout.close()
+            process.kill()
+            process.wait()
+            if not isinstance(data, str):
+                data.close()
+
+    def read(self, path: str, sr: int, start: int,
+             n_samples: int) -> np.ndarray:
+        input_channels = probe(path).channels
+        data = open_input(path)
+        # seeks in the input when possible, archive members are piped
+        seek = ['-ss', f'{start / sr:.6f}']
+        process = subprocess.Popen(
+            ['ffmpeg', '-hide_banner', '-loglevel', 'panic'] +
+            (seek if isinstance(data, str) else []) +
+            ['-i', path if isinstance(data, str) else 'pipe:0'] +
+            ([] if isinstance(data, str) else seek) + [
+                '-ar',
+                str(sr), '-t', f'{n_samples / sr:.6f}', '-f', 's16le', '-'
+            ],
+            stdin=None if isinstance(data, str) else subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        if not isinstance(data, str):
+            feed_process(process, data)
+        try:
+            x = process.stdout.read()
+        finally:
+            process.stdout.close()
+            process.wait()
+            if not isinstance(data, str):
+                data.close()
+        x = np.frombuffer(x, dtype=np.int16)
+        x = x[:len(x) - len(x) % input_channels]
+        return x.reshape(-1, input_channels).T[:, :n_samples]
+
+
+class SoundfileDecoder(AudioDecoder):
+    """
+    Decodes through libsndfile. Files already at the target rate are
+    streamed block by block, other files are loaded once and resampled.
+    """
+
+    def decode(self, path: str, sr: int,
+               block_size: int) -> Iterable[np.ndarray]:
+        import soundfile as sf
+        data = open_input(path)
+        try:
+            with sf.SoundFile(data) as f:
+                file_sr = f.samplerate
+                if file_sr == sr:
+                    for block in f.blocks(blocksize=block_size,
+                                          dtype='int16',
+                                          always_2d=True):
+                        yield block.T
+                    return
+                x = f.read(dtype='float32', always_2d=True).T
+        finally:
+            if not isinstance(data, str):
+                data.close()
+        x = float_to_int16(resample_poly(x, file_sr, sr))
+        for i in range(0, x.shape[-1], block_size):
+            yield x[:, i:i + block_size]
+
+    def read(self, path: str, sr: int, start: int,
+             n_samples: int, margin: int = 1024) -> np.ndarray:
+        import soundfile as sf
+        data = open_input(path)
+        try:
+            with sf.SoundFile(data) as f:
+                file_sr = f.samplerate
+                if file_sr == sr:
+                    f.seek(min(start, f.frames))
+                    return f.read(n_samples, dtype='int16', always_2d=True).T
+                # reads the matching native samples plus a margin covering
+                # the resampling filter, starting on a sample aligned with
+                # the output grid so that reads match whole file decoding
+                ratio = Fraction(sr, file_sr)
+                up, down = ratio.numerator, ratio.denominator
+                first = max(start * down // up - margin, 0) // down * down
+                last = min((start + n_samples) * down // up + margin,
+                           f.frames)
+                f.seek(min(first, f.frames))
+                x = f.read(max(last - first, 0),
+                           dtype='float32',
+                           always_2d=True).T
+        finally:
+            if not isinstance(data, str):
+                data.close()
+        offset = start - first * up // down
+        x = resample_poly(x, file_sr, sr)[:, offset:offset + n_samples]
+        return float_to_int16(x)
+
+
+class TorchaudioDecoder(AudioDecoder):
+    """
+    Decodes with torchaudio.load and resamples with torchaudio.
+    """
+
+    def decode(self, path: str, sr: int,
+               block_size: int) -> Iterable[np.ndarray]:
+        import torchaudio
+
+        from .resampler import resample
+        data = open_input(path)
+        x, file_sr = torchaudio.load(data)
+        if not isinstance(data, str):
+            data.close()
+        if file_sr != sr:
+            x = resample(x, file_sr, sr)
+        x = float_to_int16(x.numpy())
+        for i in range(0, x.shape[-1], block_size):
+            yield x[:, i:i + block_size]
+
+
+class AutoDecoder(AudioDecoder):
+    """
+    Decodes through libsndfile the files it can read, which seeks within
+    the current process, and through ffmpeg the others. Random reads of
+    lazy datasets would otherwise start an ffmpeg process each.
+    """
+
+    def __init__(self) -> None:
+        self.soundfile = SoundfileDecoder()
+        self.ffmpeg = FFmpegDecoder()
+        self._unsupported = set()
+
+    def decode(self, path: str, sr: int,
+               block_size: int) -> Iterable[np.ndarray]:
+        if path not in self._unsupported:
+            started = False
+            try:
+                for block in self.soundfile.decode(path, sr, block_size):
+                    started = True
+                    yield block
+                return
+            except (ImportError, RuntimeError):
+                if started:
+                    raise
+                self._unsupported.add(path)
+        yield from self.ffmpeg.decode(path, sr, block_size)
+
+    def read(self, path: str, sr: int, start: int,
+             n_samples: int) -> np.ndarray:
+        if path not in self._unsupported:
+            try:
+                return self.soundfile.read(path, sr, start, n_samples)
+            except (ImportError, RuntimeError):
+                self._unsupported.add(path)
+        return self.ffmpeg.read(path, sr, start, n_samples)
+
+
+DECODERS: Dict[str, Type[AudioDecoder]] = {
+    'auto': AutoDecoder,
+    'ffmpeg': FFmpegDecoder,
+    'soundfile': SoundfileDecoder,
+    'torchaudio': TorchaudioDecoder,
+}
+
+
+def get_decoder(name: str) -> AudioDecoder:
+    if name not in DECODERS:
+        raise ValueError(
+            f'unknown decoder {name}, available: {", ".join(DECODERS)}')
+    return DECODERS[name]()
+
+
+class TranscodeCache(AudioDecoder):
+    """
+    Decodes files once into a local directory of raw interleaved int16 PCM
+    files, one per (file, sampling rate), and slices them through memory
+    maps afterwards. Least recently opened files are evicted once the
+    directory exceeds max_bytes. Files are shared by every process using the
+    same directory: they are written under a temporary name and renamed
+    once complete, and their modification time tracks their last use.
+    """
+
+    def __init__(self,
+                 path: str,
+                 decoder: Union[str, AudioDecoder] = 'ffmpeg',
+                 max_bytes: int = 50 * 1024**3,
+                 max_open: int = 64) -> None:
+        if isinstance(decoder, str):
+            decoder = get_decoder(decoder)
+        self.path = path
+        self.decoder = decoder
+        self.max_bytes = max_bytes
+        self.max_open = max_open
+        self._maps = OrderedDict()
+        os.makedirs(path, exist_ok=True)
+
+    def __getstate__(self):
+        return dict(self.__dict__, _maps=OrderedDict())
+
+    def get_path(self, path: str, sr: int, channels: int) -> str:
+        archive, member = split_member(path)
+        key = json.dumps([
+            os.path.abspath(archive), member,
+            get_signature(path), sr
+        ])
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.path, f'{digest}_{channels}.pcm')
+
+    def transcode(self, path: str, sr: int, pcm_path: str) -> None:
+        tmp_path = f'{pcm_path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp_path, 'wb') as f:
+                for block in self.decoder.decode(path, sr, 2**16):
+                    f.write(np.ascontiguousarray(block.T).tobytes())
+            os.replace(tmp_path, pcm_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        self.evict(keep=pcm_path)
+
+    def evict(self, keep: Optional[str] = None) -> None:
+        """
+        Removes the least recently used files until the cache fits in
+        max_bytes. Files still mapped by a process remain readable by it.
+        """
+        entries = []
+        with os.scandir(self.path) as it:
+            for entry in it:
+                if entry.name.endswith('.pcm') and entry.is_file():
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        n_bytes = sum(e[1] for e in entries)
+        for _, size, path in sorted(entries):
+            if n_bytes <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                n_bytes -= size
+            except OSError:
+                pass
+
+    def open(self, path: str, sr: int) -> np.ndarray:
+        """
+        Memory-maps the PCM of a file as (n_samples, channels), transcoding
+        it first if needed.
+        """
+        channels = probe(path).channels
+        pcm_path = self.get_path(path, sr, channels)
+        if pcm_path in self._maps:
+            self._maps.move_to_end(pcm_path)
+            return self._maps[pcm_path]
+        if not os.path.exists(pcm_path):
+            self.transcode(path, sr, pcm_path)
+        else:
+            try:
+                os.utime(pcm_path)
+            except OSError:
+                pass
+        if os.path.getsize(pcm_path) < 2 * channels:
+            x = np.zeros((0, channels), dtype=np.int16)
+        else:
+            x = np.memmap(pcm_path, dtype=np.int16, mode='r')
+            x = x[:len(x) - len(x) % channels].reshape(-1, channels)
+        self._maps[pcm_path] = x
+        while len(self._maps) > self.max_open:
+            self._maps.popitem(last=False)
+        return x
+
+    def decode(self, path: str, sr: int,
+               block_size: int) -> Iterable[np.ndarray]:
+        x = self.open(path, sr)
+        for i in range(0, len(x), block_size):
+            yield np.ascontiguousarray(x[i:i + block_size].T)
+
+    def read(self, path: str, sr: int, start: int,
+             n_samples: int) -> np.ndarray:
+        return np.ascontiguousarray(self.open(path, sr)[start:start +
+                                                          n_samples].T)
+
+
+class SegmentCache(object):
+    """
+    Byte-bounded LRU cache of audio decoded and resampled at sr, split into
+    blocks of block_size samples so that reads overlapping the same parts of
+    a file share them. Consecutive missing blocks are decoded at once.
+    """
+
+    def __init__(self,
+                 decoder: Union[str, AudioDecoder] = 'ffmpeg',
+                 sr: int = 44100,
+                 block_size: int = 2**17,
+                 max_bytes: int = 512 * 1024**2) -> None:
+        if isinstance(decoder, str):
+            decoder = get_decoder(decoder)
+        self.decoder = decoder
+        self.sr = sr
+        self.block_size = block_size
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._blocks = OrderedDict()
+
+    def read(self, path: str, start: int, n_samples: int) -> np.ndarray:
+        """
+        Returns n_samples (fewer at the end of the file) from sample start
+        on, as int16 of shape (input_channels, n_samples).
+        """
+        first = start // self.block_size
+        last = (start + n_samples - 1) // self.block_size
+        indices = range(first, last + 1)
+        missing = [i for i in indices if (path, i) not in self._blocks]
+        self.hits += len(indices) - len(missing)
+        self.misses += len(missing)
+        blocks = {}
+        if missing:
+            x = self.decoder.read(path, self.sr,
+                                  missing[0] * self.block_size,
+                                  (missing[-1] - missing[0] + 1) *
+                                  self.block_size)
+            for i in range(missing[0], missing[-1] + 1):
+                offset = (i - missing[0]) * self.block_size
+                blocks[i] = np.ascontiguousarray(
+                    x[:, offset:offset + self.block_size])
+        for i in indices:
+            if i not in blocks:
+                blocks[i] = self._blocks[path, i]
+                self._blocks.move_to_end((path, i))
+            elif (path, i) not in self._blocks:
+                self._blocks[path, i] = blocks[i]
+                self.n_bytes += blocks[i].nbytes
+        while self.n_bytes > self.max_bytes and self._blocks:
+            self.n_bytes -= self._blocks.popitem(last=False)[1].nbytes
+
+        x = np.concatenate([blocks[i] for i in indices], -1)
+        offset = start - first * self.block_size
+        return x[:, offset:offset + n_samples]
+
+    def clear(self) -> None:
+        self._blocks.clear()
+        self.n_bytes = 0
+
+
+def load_audio_chunks(path: str,
+                      n_signal: int,
+                      sr: int,
+                      channels: int = 1,
+                      decoder: str = 'ffmpeg',
+                      keep_last: bool = False) -> Iterable[np.ndarray]:
+    """
+    Yields int16 chunks of shape (channels, n_signal) from a single decoding
+    pass. The trailing incomplete chunk is dropped, unless keep_last is set.
+    """
+    channel_map = None
+    for block in get_decoder(decoder).decode(path, sr, n_signal):
+        if block.shape[-1] != n_signal and not keep_last:
+            break
+        if channel_map is None:
+            channel_map = get_channel_map(block.shape[0], channels)
+        yield block[channel_map]
@@ -0,0 +1,293 @@
+"""
+Counterparts of the dataset transforms applied to whole [B, C, T] batches
+with torch operations, drawing random parameters for every example. They
+run once per batch after collation, either in the DataLoader workers or on
+the training device, instead of once per item in NumPy.
+"""
+import math
+from typing import Callable, Sequence
+
+import numpy as np
+import torch
+import torchaudio
+from torch.utils import data
+
+from . import filters, transforms
+from .resampler import resample
+
+
+class BatchTransform(object):
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        raise NotImplementedError
+
+
+class Compose(BatchTransform):
+
+    def __init__(self, transform_list: Sequence[Callable]):
+        self.transform_list = list(transform_list)
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        for transform in self.transform_list:
+            x = transform(x)
+        return x
+
+
+class RandomApply(BatchTransform):
+    """
+    Applies a transform preserving shapes to every example with probability p.
+    """
+
+    def __init__(self, transform: Callable, p: float = .5):
+        self.transform = transform
+        self.p = p
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        mask = torch.rand(x.shape[0], device=x.device) < self.p
+        if not mask.any():
+            return x
+        x = x.clone()
+        x[mask] = self.transform(x[mask])
+        return x
+
+
+def crop(x: torch.Tensor, offsets: torch.Tensor, n_signal: int) -> torch.Tensor:
+    index = offsets[:, None] + torch.arange(n_signal, device=x.device)
+    return x.gather(-1, index[:, None].expand(-1, x.shape[1], -1))
+
+
+class RandomCrop(BatchTransform):
+
+    def __init__(self, n_signal: int):
+        self.n_signal = n_signal
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        offsets = torch.randint(0,
+                                x.shape[-1] - self.n_signal + 1,
+                                (x.shape[0], ),
+                                device=x.device)
+        return crop(x, offsets, self.n_signal)
+
+
+class RandomPitch(BatchTransform):
+    """
+    Resamples every example with probability prob by a rational factor
+    taken in pitch_range, then randomly crops n_signal samples out of all
+    of them (replacing RandomCrop). Examples sharing a factor are resampled
+    together.
+    """
+
+    def __init__(self,
+                 n_signal: int,
+                 pitch_range: Sequence[float] = [0.7, 1.3],
+                 max_factor: int = 20,
+                 prob: float = 0.5):
+        self.n_signal = n_signal
+        self.pitch_range = pitch_range
+        self.prob = prob
+        self.factor_list, self.ratio_list = transforms.RandomPitch(
+            n_signal, pitch_range, max_factor)._get_factors(
+                max_factor, pitch_range)
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        batch_size, length = x.shape[0], x.shape[-1]
+        high = min(self.pitch_range[1], length / self.n_signal)
+        pitch = torch.rand(batch_size) * (high -
+                                          self.pitch_range[0]) + self.pitch_range[0]
+        ratios = np.searchsorted(self.factor_list, pitch.numpy())
+        ratios = np.minimum(ratios, len(self.factor_list) - 1)
+        ratios[~(torch.rand(batch_size) < self.prob).numpy()] = -1
+
+        y = x.new_empty(x.shape[:-1] + (self.n_signal, ))
+        for ratio in np.unique(ratios):
+            index = torch.from_numpy(np.flatnonzero(ratios == ratio)).to(
+                x.device)
+            group = x[index]
+            if ratio >= 0:
+                up, down = self.ratio_list[ratio]
+                group = resample(group, down, up)
+            offsets = torch.randint(0,
+                                    group.shape[-1] - self.n_signal + 1,
+                                    (len(index), ),
+                                    device=x.device)
+            y[index] = crop(group, offsets, self.n_signal)
+        return y
+
+
+def biquad(x: torch.Tensor, b: torch.Tensor, a: torch.Tensor) -> torch.Tensor:
+    """
+    Filters every example of x with its own (3,) coefficients, shared by its
+    channels, with filters.biquad on the CPU.
+    """
+    if x.device.type == 'cpu':
+        return torch.from_numpy(
+            filters.biquad(x.numpy(),
+                           b.cpu().numpy()[:, None],
+                           a.cpu().numpy()[:, None]))
+    channels = x.shape[1]
+    y = torchaudio.functional.lfilter(
+        x.reshape(-1, x.shape[-1]),
+        a.repeat_interleave(channels, 0).to(x),
+        b.repeat_interleave(channels, 0).to(x),
+        clamp=False,
+    )
+    return y.reshape(x.shape)
+
+
+class PhaseMangle(BatchTransform):
+    """
+    All-pass filters every example around a random frequency, log-uniformly
+    drawn between min_f and max_f (see filters.random_phase_mangle).
+    """
+
+    def __init__(self, min_f: float, max_f: float, amp: float, sr: int):
+        self.min_f = min_f
+        self.max_f = max_f
+        self.amp = amp
+        self.sr = sr
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        log_f = torch.rand(x.shape[0], dtype=torch.float64) * (
+            math.log(self.max_f) - math.log(self.min_f)) + math.log(self.min_f)
+        omega = 2 * math.pi * torch.exp(log_f) / self.sr
+        real = self.amp * torch.cos(omega)
+        square = torch.full_like(real, self.amp**2)
+        one = torch.ones_like(real)
+        b = torch.stack([square, -2 * real, one], -1)
+        a = torch.stack([one, -2 * real, square], -1)
+        return biquad(x, b, a)
+
+
+class Filter(BatchTransform):
+    """
+    Applies the same IIR filter to every example, as a sum of delayed inputs
+    when it has no feedback.
+    """
+
+    def __init__(self, b: Sequence[float], a: Sequence[float]):
+        order = max(len(b), len(a))
+        self.b = torch.tensor(list(b) + [0.] * (order - len(b)))
+        self.a = torch.tensor(list(a) + [0.] * (order - len(a)))
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        if not self.a[1:].any():
+            b = (self.b / self.a[0]).tolist()
+            y = b[0] * x
+            for k in range(1, len(b)):
+                y[..., k:] += b[k] * x[..., :-k]
+            return y
+        if x.device.type == 'cpu' and len(self.a) <= 3:
+            return torch.from_numpy(
+                filters.biquad(x.numpy(), self.b.numpy(), self.a.numpy()))
+        return torchaudio.functional.lfilter(x,
+                                             self.a.to(x),
+                                             self.b.to(x),
+                                             clamp=False,
+                                             batching=False)
+
+
+class Dequantize(BatchTransform):
+
+    def __init__(self, bit_depth: int):
+        self.bit_depth = bit_depth
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        return x + torch.rand_like(x) / 2**self.bit_depth
+
+
+class Resample(BatchTransform):
+
+    def __init__(self, orig_sr: int, target_sr: int):
+        self.orig_sr = orig_sr
+        self.target_sr = target_sr
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        return resample(x, self.orig_sr, self.target_sr)
+
+
+class Normalize(BatchTransform):
+    """
+    Raises every example to full scale, by at most max_gain_db (see
+    dataset.normalize_signal).
+    """
+
+    def __init__(self, max_gain_db: float = 30):
+        self.max_gain_db = max_gain_db
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        peak = x.abs().amax((1, 2), keepdim=True)
+        gain_db = torch.clamp(-20 * torch.log10(peak.clamp_min(1e-12)),
+                              max=self.max_gain_db)
+        return torch.where(peak > 0, x * 10**(gain_db / 20), x)
+
+
+class RandomGain(BatchTransform):
+
+    def __init__(self,
+                 gain_range: Sequence[float] = [-6, 3],
+                 prob: float = 0.5,
+                 limit: bool = True):
+        self.gain_range = gain_range
+        self.prob = prob
+        self.limit = limit
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        shape = (x.shape[0], 1, 1)
+        gain_db = torch.rand(shape, device=x.device) * (
+            self.gain_range[1] - self.gain_range[0]) + self.gain_range[0]
+        gain_db = torch.where(
+            torch.rand(shape, device=x.device) < self.prob, gain_db, 0)
+        x = x * 10**(gain_db / 20)
+        if self.limit:
+            x = x / x.abs().amax((1, 2), keepdim=True).clamp_min(1)
+        return x
+
+
+class RandomMute(BatchTransform):
+
+    def __init__(self, prob: float = 0.1):
+        self.prob = prob
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        mask = torch.rand(x.shape[0], 1, 1, device=x.device) >= self.prob
+        return x * mask
+
+
+class ItemTransform(BatchTransform):
+    """
+    Applies a NumPy transform with no batch counterpart to every example.
+    """
+
+    def __init__(self, transform: Callable):
+        self.transform = transform
+
+    def __call__(self, x: torch.Tensor) -> torch.Tensor:
+        items = [
+            np.asarray(self.transform(item), dtype=np.float32)
+            for item in x.cpu().numpy()
+        ]
+        return torch.from_numpy(np.stack(items)).to(x.device)
+
+
+def from_item_transform(transform: Callable) -> BatchTransform:
+    """
+    Batch counterpart of an augmentation, falling back to ItemTransform.
+    """
+    if isinstance(transform, transforms.RandomGain):
+        return RandomGain(transform.gain_range, transform.prob,
+                          transform.limit)
+    if isinstance(transform, transforms.RandomMute):
+        return RandomMute(transform.prob)
+    return ItemTransform(transform)
+
+
+class CollateTransform(object):
+    """
+    DataLoader collate_fn applying a batch transform to the collated batch.
+    """
+
+    def __init__(self, transform: Callable):
+        self.transform = transform
+
+    def __call__(self, items):
+        return self.transform(data.default_collate(items).float())
@@ -0,0 +1,97 @@
+import io
+from typing import Dict, Type
+
+import numpy as np
+
+
+class ChunkCodec(object):
+    """
+    Encodes int16 chunks of shape (channels, n_signal) stored in the
+    datasets. Decoding returns the flattened channel-major samples.
+    """
+    name = None
+
+    def encode(self, x: np.ndarray, sr: int) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, data: bytes) -> np.ndarray:
+        raise NotImplementedError
+
+
+class PCMCodec(ChunkCodec):
+    """
+    Raw int16 samples.
+    """
+    name = 'pcm'
+
+    def encode(self, x: np.ndarray, sr: int) -> bytes:
+        return np.ascontiguousarray(x, dtype=np.int16).tobytes()
+
+    def decode(self, data: bytes) -> np.ndarray:
+        return np.frombuffer(data, dtype=np.int16)
+
+
+class FLACCodec(ChunkCodec):
+    """
+    Lossless FLAC frames, through libsndfile.
+    """
+    name = 'flac'
+
+    def encode(self, x: np.ndarray, sr: int) -> bytes:
+        import soundfile as sf
+        buffer = io.BytesIO()
+        sf.write(buffer, x.T, sr, format='FLAC', subtype='PCM_16')
+        return buffer.getvalue()
+
+    def decode(self, data: bytes) -> np.ndarray:
+        import soundfile as sf
+        x, _ = sf.read(io.BytesIO(data), dtype='int16', always_2d=True)
+        return x.T.reshape(-1)
+
+
+class ZstdCodec(ChunkCodec):
+    """
+    Delta-coded samples split into low and high byte planes, compressed with
+    zstd. Deltas wrap around in int16 arithmetic, so the coding is lossless.
+    """
+    name = 'zstd'
+
+    def __init__(self, level: int = 3) -> None:
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError(
+                'the zstd codec requires the zstandard package '
+                '(pip install zstandard)')
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        self._decompressor = zstandard.ZstdDecompressor()
+
+    def encode(self, x: np.ndarray, sr: int) -> bytes:
+        x = np.ascontiguousarray(x, dtype=np.int16).reshape(-1)
+        delta = np.diff(x, prepend=np.int16(0))
+        planes = delta.view(np.uint8).reshape(-1, 2).T
+        return self._compressor.compress(np.ascontiguousarray(planes).tobytes())
+
+    def decode(self, data: bytes) -> np.ndarray:
+        planes = np.frombuffer(self._decompressor.decompress(data),
+                               dtype=np.uint8)
+        delta = np.ascontiguousarray(planes.reshape(2, -1).T).view(np.int16)
+        return np.cumsum(delta.reshape(-1), dtype=np.int16)
+
+
+CODECS: Dict[str, Type[ChunkCodec]] = {
+    'pcm': PCMCodec,
+    'flac': FLACCodec,
+    'zstd': ZstdCodec,
+}
+
+_codecs = {}
+
+
+def get_codec(name: str) -> ChunkCodec:
+    if name not in CODECS:
+        raise ValueError(
+            f'unknown codec {name}, available: {", ".join(CODECS)}')
+    if name not in _codecs:
+        _codecs[name] = CODECS[name]()
+    return _codecs[name]
@@ -1,7 +1,6 @@
 import json
 import os
 from pathlib import Path
-from random import random
 from typing import Callable, Optional, Sequence, Union
 
 import GPUtil as gpu
@@ -14,37 +13,18 @@ import torch.fft as fft
 import torch.nn as nn
 import torchaudio
 from einops import rearrange
-from scipy.signal import lfilter
+
+from .filters import pole_to_z_filter, random_angle, random_phase_mangle
 
 
 def mod_sigmoid(x):
     return 2 * torch.sigmoid(x)**2.3 + 1e-7
 
 
-def random_angle(min_f=20, max_f=8000, sr=24000):
-    min_f = np.log(min_f)
-    max_f = np.log(max_f)
-    rand = np.exp(random() * (max_f - min_f) + min_f)
-    rand = 2 * np.pi * rand / sr
-    return rand
-
-
 def get_augmented_latent_size(latent_size: int, noise_augmentation: int):
     return latent_size + noise_augmentation
 
 
-def pole_to_z_filter(omega, amplitude=.9):
-    z0 = amplitude * np.exp(1j * omega)
-    a = [1, -2 * np.real(z0), abs(z0)**2]
-    b = [abs(z0)**2, -2 * np.real(z0), 1]
-    return b, a
-
-def random_phase_mangle(x, min_f, max_f, amp, sr):
-    angle = random_angle(min_f, max_f, sr)
-    b, a = pole_to_z_filter(angle, amp)
-    return lfilter(b, a, x)
-
-
 def amp_to_impulse_response(amp, target_size):
     """
     transforms frequency amps to ir on the last dimension
@@ -535,6 +515,53 @@ class LoggerCallback(pl.Callback):
         self.state.update(state_dict)
 
 
+class ProgressCallback(pl.Callback):
+    """
+    Reports the training step and the logged scalar metrics as progress
+    events, and validation metrics once computed.
+    """
+
+    def __init__(self, reporter, stage: str = 'train') -> None:
+        super().__init__()
+        self.reporter = reporter
+        self.stage = stage
+
+    @staticmethod
+    def get_metrics(trainer) -> dict:
+        return {
+            k: v.item()
+            for k, v in trainer.callback_metrics.items()
+            if isinstance(v, torch.Tensor) and v.numel() == 1
+        }
+
+    def on_train_start(self, trainer, pl_module) -> None:
+        self.reporter.emit('start',
+                           stage=self.stage,
+                           step=trainer.global_step,
+                           total=trainer.max_steps)
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch,
+                           batch_idx) -> None:
+        if self.reporter.due(self.stage):
+            self.reporter.update(self.stage,
+                                 trainer.global_step,
+                                 trainer.max_steps,
+                                 metrics=self.get_metrics(trainer),
+                                 epoch=trainer.current_epoch)
+
+    def on_validation_end(self, trainer, pl_module) -> None:
+        if trainer.sanity_checking:
+            return
+        self.reporter.emit('metrics',
+                           stage='validation',
+                           step=trainer.global_step,
+                           epoch=trainer.current_epoch,
+                           metrics=self.get_metrics(trainer))
+
+    def on_train_end(self, trainer, pl_module) -> None:
+        self.reporter.emit('end', stage=self.stage, step=trainer.global_step)
+
+
 class ModelCheckpoint(pl.callbacks.ModelCheckpoint):
     def __init__(self, step_period: int = None, **kwargs):
         super().__init__(**kwargs)
@@ -1,10 +1,13 @@
 import base64
+import hashlib
 import logging
-import math
 import os
-import subprocess
-from random import random
-from typing import Dict, Iterable, Optional, Sequence, Union, Callable
+import queue
+import shutil
+import threading
+import time
+from random import randint
+from typing import Dict, Iterable, Optional, Sequence, Tuple, Union, Callable
 
 import gin
 import lmdb
@@ -13,10 +16,12 @@ import requests
 import torch
 import torchaudio
 import yaml
-from scipy.signal import lfilter
 from torch.utils import data
 from tqdm import tqdm
-from . import transforms
+from . import batch_transforms, transforms
+from .audio import SegmentCache, TranscodeCache, get_channel_map
+from .codecs import get_codec
+from .filters import biquad, random_phase_mangle
 from udls import AudioExample as AudioExampleWrapper
 from udls.generated import AudioExample
 
@@ -26,129 +31,784 @@ def get_derivator_integrator(sr: int):
     derivator = ([.5, -.5], [1])
     integrator = ([alpha**2, -alpha**2], [1, -2 * alpha, alpha**2])
 
-    return lambda x: lfilter(*derivator, x), lambda x: lfilter(*integrator, x)
+    return lambda x: biquad(x, *derivator), lambda x: biquad(x, *integrator)
 
 
-class AudioDataset(data.Dataset):
+SHARD_INDEX_DTYPE = np.dtype([('shard', '<u2'), ('key', '<u4')])
+
+
+STATS_DTYPE = np.dtype([('key', '<u4'), ('peak', '<f4'), ('rms', '<f4'),
+                        ('centroid', '<f4'), ('silence', '<f4')])
+STATS_FILE = 'stats.npy'
+
+KEY_INDEX_DTYPE = np.dtype([('key', '<u4'), ('length', '<f8')])
+KEY_INDEX_FILE = 'keys.npy'
+
+
+def load_stats(db_path: str) -> Optional[np.ndarray]:
+    """
+    Loads the per-chunk statistics computed during preprocessing, following
+    the order of the dataset items.
+    """
+    path = os.path.join(db_path, STATS_FILE)
+    if not os.path.exists(path):
+        return None
+    return np.load(path)
+
+
+@gin.configurable
+def get_chunk_weights(stats: np.ndarray,
+                      min_db: float = -60.,
+                      max_db: float = -20.,
+                      min_weight: float = .05) -> np.ndarray:
+    """
+    Sampling weights growing with the RMS level of the chunks (from min_db
+    to max_db) and with their ratio of non-silent frames.
+    """
+    rms_db = 20 * np.log10(np.maximum(stats['rms'], 1e-7))
+    level = np.clip((rms_db - min_db) / (max_db - min_db), 0, 1)
+    return np.maximum(level * (1 - stats['silence']), min_weight)
+
+
+def get_weighted_sampler(
+        dataset: data.Dataset) -> Optional[data.WeightedRandomSampler]:
+    """
+    Builds a sampler down-weighting quiet chunks of a dataset (or of a
+    subset of it), or returns None if it has no statistics.
+    """
+    indices = None
+    if isinstance(dataset, data.Subset):
+        dataset, indices = dataset.dataset, dataset.indices
+    stats = getattr(dataset, 'stats', None)
+    if stats is None:
+        return None
+    weights = get_chunk_weights(stats)
+    if indices is not None:
+        weights = weights[indices]
+    return data.WeightedRandomSampler(torch.from_numpy(weights).double(),
+                                      len(weights))
+
+
+def check_stats(stats: Optional[np.ndarray],
+                dataset: data.Dataset) -> Optional[np.ndarray]:
+    if stats is not None and len(stats) != len(dataset):
+        print('[Warning] chunk statistics do not match the dataset, '
+              'preprocess it again to use them')
+        return None
+    return stats
+
+
+def save_key_index(db_path: str, index: np.ndarray) -> None:
+    path = os.path.join(db_path, KEY_INDEX_FILE)
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, np.sort(np.asarray(index, dtype=KEY_INDEX_DTYPE),
+                           order='key'))
+    os.replace(path + '.tmp', path)
+
+
+def load_key_index(db_path: str) -> Optional[np.ndarray]:
+    """
+    Memory-maps the (key, length in seconds) index of a database, following
+    the order of its records, or returns None if it is missing or older than
+    the database.
+    """
+    path = os.path.join(db_path, KEY_INDEX_FILE)
+    if not os.path.exists(path):
+        return None
+    if os.path.getmtime(os.path.join(db_path, 'data.mdb')) > os.path.getmtime(
+            path):
+        print(f'[Warning] {path} is outdated, run '
+              f'`rave index_dataset --db_path {db_path}` to rebuild it')
+        return None
+    return np.load(path, mmap_mode='r')
+
+
+def build_key_index(db_path: str, lazy: bool,
+                    n_seconds: Optional[float] = None) -> np.ndarray:
+    """
+    Indexes a database by scanning it. Lazy records are parsed for the
+    length of their file, chunks all last n_seconds / number of chunks.
+    """
+    env = lmdb.open(db_path, lock=False, readonly=True)
+    with env.begin() as txn:
+        if lazy:
+            index = np.array(
+                [(int(key),
+                  float(AudioExample.FromString(value).metadata['length']))
+                 for key, value in tqdm(txn.cursor(),
+                                        total=env.stat()['entries'],
+                                        desc='Indexing dataset')],
+                dtype=KEY_INDEX_DTYPE)
+        else:
+            keys = np.fromiter(map(int, txn.cursor().iternext(values=False)),
+                               dtype=np.uint32)
+            index = np.empty(len(keys), dtype=KEY_INDEX_DTYPE)
+            index['key'] = keys
+            index['length'] = (n_seconds or 0) / max(len(keys), 1)
+    env.close()
+    return index
+
+
+def write_key_index(db_path: str) -> np.ndarray:
+    """
+    (Re)builds the key index of a database, e.g. for datasets preprocessed
+    before it was introduced.
+    """
+    with open(os.path.join(db_path, 'metadata.yaml'), 'r') as f:
+        metadata = yaml.safe_load(f)
+    index = build_key_index(db_path, metadata['lazy'], metadata['n_seconds'])
+    save_key_index(db_path, index)
+    return index
+
+
+def list_shards(db_path: str) -> Sequence[str]:
+    """
+    Lists the shards of a dataset, i.e. every sub-directory holding its own
+    database and metadata.
+    """
+    return sorted(
+        name for name in os.listdir(db_path)
+        if os.path.isfile(os.path.join(db_path, name, 'metadata.yaml'))
+        and os.path.isfile(os.path.join(db_path, name, 'data.mdb')))
+
+
+def write_shard_index(db_path: str) -> Dict:
+    """
+    (Re)generates the global index and metadata of a sharded dataset from
+    the shards found in db_path, so that shards produced separately can be
+    merged by copying their directories.
+    """
+    shards = list_shards(db_path)
+    if not shards:
+        raise RuntimeError(f'no shard found in {db_path}')
+
+    metadata = None
+    index = []
+    for i, shard in enumerate(shards):
+        shard_path = os.path.join(db_path, shard)
+        with open(os.path.join(shard_path, 'metadata.yaml'), 'r') as f:
+            shard_metadata = yaml.safe_load(f)
+        if metadata is None:
+            metadata = dict(shard_metadata, n_seconds=0)
+        elif any(shard_metadata.get(k) != metadata.get(k)
+                 for k in ['lazy', 'channels', 'sr']):
+            raise RuntimeError(f'shard {shard} is not compatible with {shards[0]}')
+        metadata['n_seconds'] += shard_metadata['n_seconds']
+        if i and 'silence' in shard_metadata:
+            for k in ['dropped_chunks', 'dropped_seconds', 'flagged_chunks',
+                      'flagged_seconds']:
+                if k in shard_metadata['silence']:
+                    metadata['silence'][k] += shard_metadata['silence'][k]
+        if i and 'dedup' in shard_metadata:
+            for k in ['duplicate_chunks', 'duplicate_seconds']:
+                metadata['dedup'][k] += shard_metadata['dedup'][k]
+
+        keys = load_key_index(shard_path)
+        if keys is None:
+            keys = build_key_index(shard_path, shard_metadata['lazy'],
+                                   shard_metadata['n_seconds'])
+            save_key_index(shard_path, keys)
+        keys = keys['key']
+        shard_index = np.empty(len(keys), dtype=SHARD_INDEX_DTYPE)
+        shard_index['shard'] = i
+        shard_index['key'] = keys
+        index.append(shard_index)
+
+    np.save(os.path.join(db_path, 'index.npy'), np.concatenate(index))
+
+    stats = [load_stats(os.path.join(db_path, s)) for s in shards]
+    if all(s is not None and len(s) == len(i) for s, i in zip(stats, index)):
+        np.save(os.path.join(db_path, STATS_FILE), np.concatenate(stats))
+    elif os.path.exists(os.path.join(db_path, STATS_FILE)):
+        os.remove(os.path.join(db_path, STATS_FILE))
+    metadata['shards'] = shards
+    with open(os.path.join(db_path, 'metadata.yaml'), 'w') as f:
+        yaml.safe_dump(metadata, f)
+    return metadata
+
+
+def get_variant_path(db_path: str, sr: int) -> str:
+    return os.path.join(db_path, 'variants', f'sr_{sr}')
+
+
+def get_source_fingerprint(db_path: str, metadata: Dict) -> str:
+    """
+    Hashes the manifests of a dataset (of each of its shards), which change
+    whenever one of its files is added, removed or modified. Datasets
+    preprocessed without manifest are hashed from their metadata instead.
+    """
+    digest = hashlib.sha1()
+    for path in [os.path.join(db_path, s)
+                 for s in metadata.get('shards') or []] or [db_path]:
+        for name in ['manifest.json', 'metadata.yaml']:
+            if os.path.isfile(os.path.join(path, name)):
+                with open(os.path.join(path, name), 'rb') as f:
+                    digest.update(f.read())
+                break
+    return digest.hexdigest()
+
+
+def get_variant(db_path: str, metadata: Dict,
+                sr: int) -> Optional[Tuple[str, Dict]]:
+    """
+    Looks for a copy of the dataset resampled at sr, ignoring copies made
+    from another rate, layout or content than the dataset has now.
+    """
+    path = get_variant_path(db_path, sr)
+    if not os.path.isfile(os.path.join(path, 'metadata.yaml')):
+        return None
+    with open(os.path.join(path, 'metadata.yaml'), 'r') as f:
+        variant = yaml.safe_load(f)
+    source = variant['source']
+    if (source.get('sr') != metadata.get('sr', 44100)
+            or source.get('channels') != metadata['channels']
+            or source.get('n_seconds') != metadata['n_seconds']
+            or source.get('fingerprint') != get_source_fingerprint(
+                db_path, metadata)):
+        print(f'[Warning] {path} is outdated, resample the dataset again')
+        return None
+    return path, variant
+
+
+class LMDBDataset(data.Dataset):
+    """
+    Base of the datasets reading records from an LMDB database. Keys are
+    kept in numpy arrays rather than lists of bytes objects, whose refcounts
+    would make every DataLoader worker copy the pages they were inherited
+    in. LMDB environments cannot be used across a fork, so the ones
+    inherited from a parent process are closed and opened again, and they
+    are not pickled along with the dataset.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        super().__init__()
+        self._db_path = db_path
+        self._env = None
+        self._pid = os.getpid()
+        self._keys = None
+        self._key_index = None
+
+    def check_fork(self) -> None:
+        if self._pid != os.getpid():
+            self.close()
+            self._pid = os.getpid()
+
+    def close(self) -> None:
+        if self._env is not None:
+            self._env.close()
+            self._env = None
 
     @property
     def env(self) -> lmdb.Environment:
+        self.check_fork()
         if self._env is None:
             self._env = lmdb.open(self._db_path, lock=False)
         return self._env
 
     @property
-    def keys(self) -> Sequence[str]:
+    def keys(self) -> np.ndarray:
         if self._keys is None:
             with self.env.begin() as txn:
-                self._keys = list(txn.cursor().iternext(values=False))
+                self._keys = np.array(list(
+                    txn.cursor().iternext(values=False)),
+                                      dtype=bytes)
         return self._keys
 
+    def get_key(self, index: int) -> bytes:
+        if self._key_index is not None:
+            return f'{self._key_index["key"][index]:08d}'.encode()
+        return self.keys[index]
+
+    def __getstate__(self) -> Dict:
+        state = self.__dict__.copy()
+        state['_env'] = None
+        return state
+
+
+class AudioDataset(LMDBDataset):
+
+    def close(self) -> None:
+        super().close()
+        for env in self._shard_envs or []:
+            if env is not None:
+                env.close()
+        self._shard_envs = None
+
+    def get_shard_env(self, shard: int) -> lmdb.Environment:
+        self.check_fork()
+        if self._shard_envs is None:
+            self._shard_envs = [None] * len(self._shards)
+        if self._shard_envs[shard] is None:
+            self._shard_envs[shard] = lmdb.open(
+                os.path.join(self._db_path, self._shards[shard]),
+                lock=False,
+                readonly=True,
+            )
+        return self._shard_envs[shard]
+
     def __init__(self,
                  db_path: str,
                  audio_key: str = 'waveform',
                  transforms: Optional[transforms.Transform] = None, 
-                 n_channels: int = 1) -> None:
-        super().__init__()
-        self._db_path = db_path
+                 n_channels: int = 1,
+                 shards: Optional[Sequence[str]] = None,
+                 stats: Optional[np.ndarray] = None,
+                 normalize: bool = False) -> None:
+        super().__init__(db_path)
         self._audio_key = audio_key
-        self._env = None
-        self._keys = None
         self._transforms = transforms
         self._n_channels = n_channels
-        lens = []
-        with self.env.begin() as txn:
-            for k in self.keys:
-               ae = AudioExample.FromString(txn.get(k)) 
-               lens.append(np.frombuffer(ae.buffers['waveform'].data, dtype=np.int16).shape)
+        self._shards = shards
+        self._shard_envs = None
+        self._shard_index = None
 
+        if shards:
+            self._shard_index = np.load(os.path.join(db_path, 'index.npy'),
+                                        mmap_mode='r')
+        else:
+            self._key_index = load_key_index(db_path)
+
+        self.stats = check_stats(stats, self)
+        self._normalize = normalize
+
+    def __getstate__(self) -> Dict:
+        state = super().__getstate__()
+        state['_shard_envs'] = None
+        return state
 
     def __len__(self):
+        if self._shard_index is not None:
+            return len(self._shard_index)
+        if self._key_index is not None:
+            return len(self._key_index)
         return len(self.keys)
 
     def __getitem__(self, index):
-        with self.env.begin() as txn:
-            ae = AudioExample.FromString(txn.get(self.keys[index]))
+        if self._shard_index is not None:
+            shard, key = self._shard_index[index]
+            with self.get_shard_env(shard).begin() as txn:
+                ae = AudioExample.FromString(txn.get(f'{key:08d}'.encode()))
+        else:
+            with self.env.begin() as txn:
+                ae = AudioExample.FromString(txn.get(self.get_key(index)))
 
         buffer = ae.buffers[self._audio_key]
-        assert buffer.precision == AudioExample.Precision.INT16
-
-        audio = np.frombuffer(buffer.data, dtype=np.int16)
+        if buffer.precision == AudioExample.Precision.RAW:
+            audio = get_codec(buffer.format).decode(buffer.data)
+        else:
+            assert buffer.precision == AudioExample.Precision.INT16
+            audio = np.frombuffer(buffer.data, dtype=np.int16)
         audio = audio.astype(np.float32) / (2**15 - 1)
         audio = audio.reshape(self._n_channels, -1)
 
+        if self._normalize:
+            audio = normalize_signal(
+                audio,
+                peak=None if self.stats is None else self.stats['peak'][index])
+
         if self._transforms is not None:
             audio = self._transforms(audio)
 
         return audio
 
 
-class LazyAudioDataset(data.Dataset):
+class MemmapAudioDataset(data.Dataset):
+    """
+    Reads datasets stored as a single flat int16 file, sliced through the
+    [start, stop) sample offsets of every segment. Segments are sliced
+    without copy or parsing from a memory map shared by every worker through
+    the page cache.
+
+    By default every segment is a channel-major chunk and an item. Windowed
+    datasets instead store every file as a single interleaved segment, and
+    items are windows of window samples taken every hop samples, randomly
+    shifted within the hop if random_offset is set.
+    """
+    audio_file = 'audio.raw'
+    offsets_file = 'offsets.npy'
 
     @property
-    def env(self) -> lmdb.Environment:
-        if self._env is None:
-            self._env = lmdb.open(self._db_path, lock=False)
-        return self._env
+    def audio(self) -> np.ndarray:
+        if self._audio is None:
+            self._audio = np.memmap(os.path.join(self._db_path,
+                                                 self.audio_file),
+                                    dtype=np.int16,
+                                    mode='r')
+        return self._audio
+
+    def __init__(self,
+                 db_path: str,
+                 transforms: Optional[transforms.Transform] = None,
+                 n_channels: int = 1,
+                 window: Optional[int] = None,
+                 hop: Optional[int] = None,
+                 random_offset: bool = True,
+                 stats: Optional[np.ndarray] = None,
+                 normalize: bool = False) -> None:
+        super().__init__()
+        self._db_path = db_path
+        self._audio = None
+        self._transforms = transforms
+        self._n_channels = n_channels
+        self._offsets = np.load(os.path.join(db_path, self.offsets_file),
+                                mmap_mode='r')
+        self._window = window
+        self._hop = hop or window
+        self._random_offset = random_offset
+        if window is not None:
+            self._windows = self.get_windows()
+
+        self.stats = check_stats(stats, self)
+        self._normalize = normalize
+
+    def get_windows(self) -> np.ndarray:
+        """
+        Indexes the (segment, offset) pairs of every window.
+        """
+        lengths = np.diff(self._offsets, axis=-1)[:, 0] // self._n_channels
+        n_windows = np.maximum(lengths - self._window, -1) // self._hop + 1
+        segments = np.repeat(np.arange(len(lengths)), n_windows)
+        first = np.cumsum(n_windows) - n_windows
+        offsets = (np.arange(len(segments)) - first[segments]) * self._hop
+        return np.stack([segments, offsets], -1)
+
+    def __len__(self):
+        if self._window is not None:
+            return len(self._windows)
+        return len(self._offsets)
+
+    def __getitem__(self, index):
+        if self._window is not None:
+            segment, offset = self._windows[index]
+            start, stop = self._offsets[segment]
+            if self._random_offset:
+                length = (stop - start) // self._n_channels
+                offset += randint(0, min(self._hop, length - self._window - offset))
+            start += offset * self._n_channels
+            audio = self.audio[start:start + self._window * self._n_channels]
+            audio = audio.reshape(-1, self._n_channels).T
+        else:
+            start, stop = self._offsets[index]
+            audio = self.audio[start:stop].reshape(self._n_channels, -1)
+        audio = audio.astype(np.float32) / (2**15 - 1)
+
+        if self._normalize:
+            audio = normalize_signal(
+                audio,
+                peak=None if self.stats is None else self.stats['peak'][index])
+
+        if self._transforms is not None:
+            audio = self._transforms(audio)
+
+        return audio
+
+
+class LMDBWriter(threading.Thread):
+    """
+    Single writer thread grouping puts into transactions, committed every
+    commit_items records or commit_bytes bytes.
+    """
+
+    def __init__(self,
+                 env: lmdb.Environment,
+                 commit_items: int = 256,
+                 commit_bytes: int = 64 * 1024**2,
+                 queue_depth: int = 64) -> None:
+        super().__init__(daemon=True)
+        self.env = env
+        self.commit_items = commit_items
+        self.commit_bytes = commit_bytes
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._error = None
+        self.n_items = 0
+        self.n_bytes = 0
+        self.n_commits = 0
+        self.busy_time = 0.
+        self._start_time = None
+
+    def put(self,
+            key: bytes,
+            value: bytes,
+            release: Optional[Callable[[], None]] = None) -> None:
+        """
+        Queues a record. release, if given, is called by the writer thread
+        once the value has been copied into the transaction, so that value
+        may be a view over a buffer to be reused.
+        """
+        if self._error is not None:
+            raise self._error
+        self._queue.put((key, value, release))
+
+    def delete(self, key: bytes) -> None:
+        self.put(key, None)
+
+    def flush(self) -> None:
+        """
+        Blocks until every record queued so far is committed.
+        """
+        flushed = threading.Event()
+        self.put(flushed, None)
+        while not flushed.wait(.1):
+            if not self.is_alive():
+                break
+        if self._error is not None:
+            raise self._error
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self.join()
+        if self._error is not None:
+            raise self._error
+
+    def run(self):
+        self._start_time = time.monotonic()
+        txn, txn_items, txn_bytes = None, 0, 0
+        try:
+            while (item := self._queue.get()) is not None:
+                key, value, release = item
+                if isinstance(key, threading.Event):
+                    if txn is not None:
+                        self._commit(txn, txn_items, txn_bytes)
+                        txn, txn_items, txn_bytes = None, 0, 0
+                    key.set()
+                    continue
+                start = time.perf_counter()
+                if txn is None:
+                    txn = self.env.begin(write=True)
+                if value is None:
+                    txn.delete(key)
+                    self.busy_time += time.perf_counter() - start
+                    continue
+                txn.put(key, value)
+                txn_items += 1
+                txn_bytes += len(value)
+                if release is not None:
+                    release()
+                if txn_items >= self.commit_items or txn_bytes >= self.commit_bytes:
+                    self._commit(txn, txn_items, txn_bytes)
+                    txn, txn_items, txn_bytes = None, 0, 0
+                self.busy_time += time.perf_counter() - start
+            if txn is not None:
+                self._commit(txn, txn_items, txn_bytes)
+        except Exception as e:
+            if txn is not None:
+                txn.abort()
+            self._error = e
+            # unblock producers waiting on a full queue
+            while True:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    break
+
+    def _commit(self, txn: lmdb.Transaction, n_items: int, n_bytes: int):
+        start = time.perf_counter()
+        txn.commit()
+        self.busy_time += time.perf_counter() - start
+        self.n_items += n_items
+        self.n_bytes += n_bytes
+        self.n_commits += 1
 
     @property
-    def keys(self) -> Sequence[str]:
-        if self._keys is None:
-            with self.env.begin() as txn:
-                self._keys = list(txn.cursor().iternext(values=False))
-        return self._keys
+    def stats(self) -> dict:
+        elapsed = max(time.monotonic() - (self._start_time or time.monotonic()), 1e-6)
+        return {
+            'items': self.n_items,
+            'bytes': self.n_bytes,
+            'commits': self.n_commits,
+            'commits_per_second': self.n_commits / elapsed,
+            'bytes_per_second': self.n_bytes / elapsed,
+        }
+
+    def describe(self) -> str:
+        stats = self.stats
+        return (f'{stats["commits_per_second"]:.1f} commits/s, '
+                f'{stats["bytes_per_second"] / 1024**2:.1f} MB/s')
+
+
+class MemmapWriter(object):
+    """
+    Appends raw int16 records to the flat file of a memmap dataset. Keys are
+    not stored: the manifest tracks the samples owned by every file, and
+    the offsets index is rebuilt from it once done.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        path = os.path.join(db_path, MemmapAudioDataset.audio_file)
+        self._file = open(path, 'r+b' if os.path.exists(path) else 'wb')
+        self._file.seek(0, os.SEEK_END)
+        self.n_items = 0
+        self.n_bytes = 0
+        self.n_commits = 0
+        self.busy_time = 0.
+        self._start_time = time.monotonic()
+
+    @property
+    def position(self) -> int:
+        return self._file.tell() // 2
+
+    def truncate(self, n_samples: int) -> None:
+        self._file.truncate(n_samples * 2)
+        self._file.seek(n_samples * 2)
+
+    def put(self,
+            key: bytes,
+            value: bytes,
+            release: Optional[Callable[[], None]] = None) -> None:
+        start = time.perf_counter()
+        self._file.write(value)
+        self.busy_time += time.perf_counter() - start
+        self.n_items += 1
+        self.n_bytes += len(value)
+        if release is not None:
+            release()
+
+    def put_file(self, key: bytes, f) -> None:
+        """
+        Appends the content of a file object, e.g. a segment spooled to disk.
+        """
+        start = time.perf_counter()
+        f.seek(0)
+        n_bytes = self._file.tell()
+        shutil.copyfileobj(f, self._file, 1 << 20)
+        self.busy_time += time.perf_counter() - start
+        self.n_items += 1
+        self.n_bytes += self._file.tell() - n_bytes
+
+    def delete(self, key: bytes) -> None:
+        pass
+
+    def flush(self) -> None:
+        start = time.perf_counter()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.busy_time += time.perf_counter() - start
+        self.n_commits += 1
+
+    def close(self) -> None:
+        self.flush()
+        self._file.close()
+
+    def write_offsets(self, offsets: np.ndarray) -> None:
+        path = os.path.join(self.db_path,
+                            MemmapAudioDataset.offsets_file)
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, np.asarray(offsets, dtype=np.int64).reshape(-1, 2))
+        os.replace(path + '.tmp', path)
+
+    def describe(self) -> str:
+        elapsed = max(time.monotonic() - self._start_time, 1e-6)
+        return f'{self.n_bytes / elapsed / 1024**2:.1f} MB/s'
+
+
+def get_memmap_offsets(segments: Iterable[Tuple[int, int]],
+                       chunk_samples: Optional[int] = None) -> np.ndarray:
+    """
+    Splits the [start, stop) sample ranges owned by every file into chunks
+    of chunk_samples, or keeps them whole if chunk_samples is None.
+    """
+    offsets = []
+    for start, stop in sorted(segments):
+        if chunk_samples is None:
+            offsets.append([start, stop])
+            continue
+        offsets.extend([i, i + chunk_samples]
+                       for i in range(start, stop, chunk_samples))
+    return np.asarray(offsets, dtype=np.int64).reshape(-1, 2)
+
+
+class LazyAudioDataset(LMDBDataset):
 
     def __init__(self,
                  db_path: str,
                  n_signal: int,
                  sampling_rate: int,
                  transforms: Optional[transforms.Transform] = None,
-                 n_channels: int = 1) -> None:
-        super().__init__()
-        self._db_path = db_path
-        self._env = None
-        self._keys = None
+                 n_channels: int = 1,
+                 decoder: str = 'auto',
+                 cache_size: int = 512,
+                 transcode_dir: Optional[str] = None,
+                 transcode_size: int = 50) -> None:
+        super().__init__(db_path)
         self._transforms = transforms
         self._n_signal = n_signal
         self._sampling_rate = sampling_rate
         self._n_channels = n_channels
+        self._decoder = decoder
+        self._cache_size = cache_size
+        self._transcode_dir = transcode_dir
+        self._transcode_size = transcode_size
+        self._cache = None
 
         self.parse_dataset()
 
+    @property
+    def cache(self) -> SegmentCache:
+        """
+        Decoded audio of the worker, in blocks of n_signal samples: items
+        span two of them and share one with each of their neighbours. With
+        a transcode directory, files are decoded once into it and the page
+        cache keeps them in memory instead.
+        """
+        self.check_fork()
+        if self._cache is None:
+            decoder, max_bytes = self._decoder, self._cache_size * 1024**2
+            if self._transcode_dir is not None:
+                decoder = TranscodeCache(self._transcode_dir, decoder,
+                                         self._transcode_size * 1024**3)
+                max_bytes = 0
+            self._cache = SegmentCache(decoder,
+                                       self._sampling_rate,
+                                       block_size=self._n_signal,
+                                       max_bytes=max_bytes)
+        return self._cache
+
+    def close(self) -> None:
+        super().close()
+        self._cache = None
+
+    def __getstate__(self) -> Dict:
+        state = super().__getstate__()
+        state['_cache'] = None
+        return state
+
     def parse_dataset(self):
-        items = []
-        for key in tqdm(self.keys, desc='Discovering dataset'):
-            with self.env.begin() as txn:
-                ae = AudioExample.FromString(txn.get(key))
-            length = float(ae.metadata['length'])
-            n_signal = int(math.floor(length * self._sampling_rate))
-            n_chunks = n_signal // self._n_signal
-            items.append(n_chunks)
-        items = np.asarray(items)
-        items = np.cumsum(items)
-        self.items = items
+        """
+        Indexes the cumulative number of items of the files, from the key
+        index of the dataset. Datasets without one are scanned once, and
+        the index is saved when the dataset directory is writable.
+        """
+        self._key_index = load_key_index(self._db_path)
+        if self._key_index is None:
+            self._key_index = build_key_index(self._db_path, lazy=True)
+            try:
+                save_key_index(self._db_path, self._key_index)
+            except OSError:
+                pass
+        n_signal = np.floor(self._key_index['length'] *
+                            self._sampling_rate).astype(np.int64)
+        self.items = np.cumsum(n_signal // self._n_signal)
 
     def __len__(self):
-        return self.items[-1]
+        return int(self.items[-1]) if len(self.items) else 0
 
     def __getitem__(self, index):
-        audio_id = np.where(index < self.items)[0][0]
+        audio_id = int(np.searchsorted(self.items, index, side='right'))
         if audio_id:
             index -= self.items[audio_id - 1]
 
-        key = self.keys[audio_id]
+        key = self.get_key(audio_id)
 
         with self.env.begin() as txn:
             ae = AudioExample.FromString(txn.get(key))
 
-        audio = extract_audio(
-            ae.metadata['path'],
-            self._n_signal,
-            self._sampling_rate,
-            index * self._n_signal,
-            int(ae.metadata['channels']),
-            self._n_channels
-        )
+        x = self.cache.read(ae.metadata['path'], index * self._n_signal,
+                            2 * self._n_signal)
+        audio = np.zeros((self._n_channels, 2 * self._n_signal),
+                         dtype=np.float32)
+        audio[:, :x.shape[-1]] = x[get_channel_map(x.shape[0],
+                                                   self._n_channels)] / 2**15
 
         if self._transforms is not None:
             audio = self._transforms(audio)
@@ -193,8 +853,11 @@ class HTTPAudioDataset(data.Dataset):
         return example.copy()
 
 
-def normalize_signal(x: np.ndarray, max_gain_db: int = 30):
-    peak = np.max(abs(x))
+def normalize_signal(x: np.ndarray,
+                     max_gain_db: int = 30,
+                     peak: Optional[float] = None):
+    if peak is None:
+        peak = np.max(abs(x))
     if peak == 0: return x
 
     log_peak = 20 * np.log10(peak)
@@ -211,12 +874,27 @@ def get_dataset(db_path,
                 normalize: bool = False,
                 rand_pitch: bool = False,
                 augmentations: Union[None, Iterable[Callable]] = None, 
-                n_channels: int = 1):
+                n_channels: int = 1,
+                lazy_decoder: str = 'auto',
+                lazy_cache_size: int = 512,
+                lazy_transcode_dir: Optional[str] = None,
+                lazy_transcode_size: int = 50,
+                batch_augment: Optional[str] = None):
+    """
+    With batch_augment ('worker' or 'device'), items are left uncropped
+    and the transforms are applied to whole batches instead: the dataset
+    then gets a batch_transform to run in the DataLoader collate_fn, or on
+    the training device after transfer, as given by its batch_augment.
+    """
     if db_path[:4] == "http":
         return HTTPAudioDataset(db_path=db_path)
     with open(os.path.join(db_path, 'metadata.yaml'), 'r') as metadata:
         metadata = yaml.safe_load(metadata)
 
+    if metadata.get('sr', 44100) != sr and (variant := get_variant(
+            db_path, metadata, sr)) is not None:
+        db_path, metadata = variant
+
     sr_dataset = metadata.get('sr', 44100)
     lazy = metadata['lazy']
 
@@ -238,7 +916,9 @@ def get_dataset(db_path,
     if sr_dataset != sr:
         transform_list.append(transforms.Resample(sr_dataset, sr))
 
-    if normalize:
+    # non-lazy datasets normalize items themselves, from the peaks stored
+    # during preprocessing when available
+    if normalize and lazy:
         transform_list.append(normalize_signal)
 
     if derivative:
@@ -251,14 +931,85 @@ def get_dataset(db_path,
 
     transform_list = transforms.Compose(transform_list)
 
+    batch_transform = None
+    if batch_augment is not None:
+        if batch_augment not in ['worker', 'device']:
+            raise ValueError(f'unknown batch_augment {batch_augment}, '
+                             'available: worker, device')
+        batch_transform = get_batch_transform(n_signal, sr, sr_dataset,
+                                              normalize and lazy,
+                                              derivative, rand_pitch,
+                                              augmentations)
+        transform_list = lambda x: x.astype(np.float32)
+
     if lazy:
-        return LazyAudioDataset(db_path, n_signal, sr_dataset, transform_list, n_channels)
+        dataset = LazyAudioDataset(db_path,
+                                   n_signal,
+                                   sr_dataset,
+                                   transform_list,
+                                   n_channels,
+                                   decoder=lazy_decoder,
+                                   cache_size=lazy_cache_size,
+                                   transcode_dir=lazy_transcode_dir,
+                                   transcode_size=lazy_transcode_size)
+    elif metadata.get('format', 'lmdb') == 'memmap':
+        if metadata.get('windowed'):
+            dataset = MemmapAudioDataset(db_path,
+                                         transform_list,
+                                         n_channels,
+                                         window=2 * n_signal,
+                                         normalize=normalize)
+        else:
+            dataset = MemmapAudioDataset(db_path,
+                                         transform_list,
+                                         n_channels,
+                                         stats=load_stats(db_path),
+                                         normalize=normalize)
     else:
-        return AudioDataset(
+        dataset = AudioDataset(
             db_path,
             transforms=transform_list,
-            n_channels=n_channels
+            n_channels=n_channels,
+            shards=metadata.get('shards'),
+            stats=load_stats(db_path),
+            normalize=normalize,
         )
+    dataset.batch_transform = batch_transform
+    dataset.batch_augment = batch_augment
+    return dataset
+
+
+def get_batch_transform(
+        n_signal: int,
+        sr: int,
+        sr_dataset: int,
+        normalize: bool = False,
+        derivative: bool = False,
+        rand_pitch: Optional[Sequence[float]] = None,
+        augmentations: Optional[Iterable[Callable]] = None
+) -> batch_transforms.Compose:
+    """
+    Batch counterpart of the item transforms built by get_dataset.
+    """
+    transform_list = [
+        batch_transforms.RandomPitch(n_signal, rand_pitch)
+        if rand_pitch else batch_transforms.RandomCrop(n_signal),
+        batch_transforms.RandomApply(
+            batch_transforms.PhaseMangle(20, 2000, .99, sr_dataset),
+            p=.8,
+        ),
+        batch_transforms.Dequantize(16),
+    ]
+    if sr_dataset != sr:
+        transform_list.append(batch_transforms.Resample(sr_dataset, sr))
+    if normalize:
+        transform_list.append(batch_transforms.Normalize())
+    if derivative:
+        transform_list.append(batch_transforms.Filter([.5, -.5], [1]))
+    for augmentation in augmentations or []:
+        transform_list.append(
+            batch_transforms.from_item_transform(augmentation))
+    return batch_transforms.Compose(transform_list)
 
 
 @gin.configurable
@@ -276,61 +1027,3 @@ def split_dataset(dataset, percent, max_residual: Optional[int] = None):
         generator=torch.Generator().manual_seed(42),
     )
     return split1, split2
-
-
-def random_angle(min_f=20, max_f=8000, sr=24000):
-    min_f = np.log(min_f)
-    max_f = np.log(max_f)
-    rand = np.exp(random() * (max_f - min_f) + min_f)
-    rand = 2 * np.pi * rand / sr
-    return rand
-
-
-def pole_to_z_filter(omega, amplitude=.9):
-    z0 = amplitude * np.exp(1j * omega)
-    a = [1, -2 * np.real(z0), abs(z0)**2]
-    b = [abs(z0)**2, -2 * np.real(z0), 1]
-    return b, a
-
-
-def random_phase_mangle(x, min_f, max_f, amp, sr):
-    angle = random_angle(min_f, max_f, sr)
-    b, a = pole_to_z_filter(angle, amp)
-    return lfilter(b, a, x)
-
-def extract_audio(path: str, n_signal: int, sr: int,
-                  start_sample: int, input_channels: int, channels: int) -> Iterable[np.ndarray]:
-    # channel mapping
-    channel_map = range(channels)
-    if input_channels < channels:
-        channel_map = (math.ceil(channels / input_channels) * list(range(input_channels)))[:channels]
-    # time information
-    start_sec = start_sample / sr
-    length = (n_signal * 2) / sr
-    chunks = []
-    for i in channel_map:
-        process = subprocess.Popen(
-            [
-                'ffmpeg', '-v', 'error',
-                '-ss',
-                str(start_sec),
-                '-i',
-                path,
-                '-ar',
-                str(sr),
-                '-filter_complex',
-                'channelmap=%d-0'%i,
-                '-t',
-                str(length),
-                '-f',
-                's16le',
-                '-'
-            ],
-            stdout=subprocess.PIPE,
-        )
-
-        chunk = process.communicate()[0]
-        chunk = np.frombuffer(chunk, dtype=np.int16).astype(np.float32) / 2**15
-        chunk = np.concatenate([chunk, np.zeros(n_signal)], -1)
-        chunks.append(chunk)
-    return np.stack(chunks)[:, :(n_signal*2)]
@@ -0,0 +1,90 @@
+"""
+IIR filtering of many signals at once, every signal with its own second
+order coefficients, in a single call instead of one scipy.signal.lfilter
+call per item and per coefficient set.
+"""
+from random import random
+
+import numpy as np
+from scipy.signal import lfilter
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def _biquad_kernel(x, coefficients, y):
+    # transposed direct form II, as lfilter
+    for i in range(x.shape[0]):
+        b0, b1, b2, a1, a2 = coefficients[i]
+        z1 = 0.
+        z2 = 0.
+        for n in range(x.shape[1]):
+            xn = x[i, n]
+            yn = b0 * xn + z1
+            z1 = b1 * xn - a1 * yn + z2
+            z2 = b2 * xn - a2 * yn
+            y[i, n] = yn
+
+
+if numba is not None:
+    _biquad_kernel = numba.njit(nogil=True)(_biquad_kernel)
+
+
+def _lfilter_kernel(x, coefficients, y):
+    for i in range(x.shape[0]):
+        b0, b1, b2, a1, a2 = coefficients[i]
+        y[i] = lfilter([b0, b1, b2], [1., a1, a2], x[i])
+
+
+def _second_order(coefficients) -> np.ndarray:
+    coefficients = np.asarray(coefficients, dtype=np.float64)
+    order = coefficients.shape[-1]
+    if order > 3:
+        raise ValueError(f'biquad filters have at most 3 coefficients, '
+                         f'got {order}')
+    padding = [(0, 0)] * (coefficients.ndim - 1) + [(0, 3 - order)]
+    return np.pad(coefficients, padding)
+
+
+def biquad(x: np.ndarray, b, a) -> np.ndarray:
+    """
+    Filters x [..., T] along its last axis, as lfilter(b, a, x) but with
+    coefficients b and a [..., <= 3] broadcast against x.shape[:-1], so that
+    every signal can have its own filter.
+    """
+    x = np.asarray(x)
+    dtype = x.dtype if x.dtype in (np.float32, np.float64) else np.float64
+    b, a = np.broadcast_arrays(_second_order(b), _second_order(a))
+    if np.any(a[..., 0] == 0):
+        raise ValueError('first denominator coefficient must be non zero')
+    coefficients = np.concatenate([b, a[..., 1:]], -1) / a[..., :1]
+    coefficients = np.broadcast_to(coefficients, x.shape[:-1] + (5, ))
+
+    signals = np.ascontiguousarray(x.reshape(-1, x.shape[-1]), dtype=dtype)
+    y = np.empty_like(signals)
+    kernel = _lfilter_kernel if numba is None else _biquad_kernel
+    kernel(signals, np.ascontiguousarray(coefficients.reshape(-1, 5)), y)
+    return y.reshape(x.shape)
+
+
+def random_angle(min_f=20, max_f=8000, sr=24000):
+    min_f = np.log(min_f)
+    max_f = np.log(max_f)
+    rand = np.exp(random() * (max_f - min_f) + min_f)
+    rand = 2 * np.pi * rand / sr
+    return rand
+
+
+def pole_to_z_filter(omega, amplitude=.9):
+    z0 = amplitude * np.exp(1j * omega)
+    a = [1, -2 * np.real(z0), abs(z0)**2]
+    b = [abs(z0)**2, -2 * np.real(z0), 1]
+    return b, a
+
+
+def random_phase_mangle(x, min_f, max_f, amp, sr):
+    angle = random_angle(min_f, max_f, sr)
+    b, a = pole_to_z_filter(angle, amp)
+    return biquad(x, b, a)
@@ -219,6 +219,7 @@ class RAVE(pl.LightningModule):
         self.eval_number = 0
         self.beta_factor = 1.
         self.integrator = None
+        self.batch_transform = None
 
         self.register_buffer("receptive_field", torch.tensor([0, 0]).long())
         self.audio_monitor_epochs = audio_monitor_epochs
@@ -269,6 +270,12 @@ class RAVE(pl.LightningModule):
         z = self.encoder.reparametrize(z)[0]
         return self.decode(z)
 
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        # batch augmentations running on the training device
+        if self.batch_transform is not None:
+            batch = self.batch_transform(batch.float())
+        return batch
+
     def on_train_batch_end(self, outputs, batch, batch_idx) -> None:
         self.lr_schedulers().step()
         return super().on_train_batch_end(outputs, batch, batch_idx)
@@ -0,0 +1,145 @@
+"""
+Machine readable progress of the command line scripts, emitted as compact
+JSON events (one per line) to a file descriptor or to a file, so that
+frontends do not have to scrape logs.
+"""
+import json
+import math
+import os
+import time
+from typing import Dict, Optional
+
+from absl import flags
+
+
+def define_flags(flag_values: flags.FlagValues = flags.FLAGS) -> None:
+    """
+    Adds --progress_fd and --progress_jsonl to a script. Several scripts may
+    be imported in the same process, so flags are only defined once.
+    """
+    if 'progress_fd' not in flag_values:
+        flags.DEFINE_integer(
+            'progress_fd',
+            None,
+            help='File descriptor receiving JSON progress events',
+            flag_values=flag_values)
+    if 'progress_jsonl' not in flag_values:
+        flags.DEFINE_string('progress_jsonl',
+                            None,
+                            help='File receiving JSON progress events',
+                            flag_values=flag_values)
+
+
+class ProgressReporter(object):
+    """
+    Writes events such as
+    {"event":"progress","stage":"train","done":100,"total":1000,...}.
+    Progress updates of a stage are throttled to one every interval seconds,
+    and carry the rate and ETA measured since the stage started. Every event
+    is a single write, so that processes sharing the sink (e.g. preprocess
+    shards) do not interleave them. tags are added to every event.
+    """
+
+    def __init__(self,
+                 fd: Optional[int] = None,
+                 path: Optional[str] = None,
+                 interval: float = .5,
+                 **tags) -> None:
+        self.fd = fd
+        self._owned = path is not None
+        if path is not None:
+            self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND,
+                              0o644)
+        self.interval = interval
+        self.tags = tags
+        self._stages = {}
+
+    @property
+    def enabled(self) -> bool:
+        return self.fd is not None
+
+    def emit(self, event: str, **fields) -> None:
+        if self.fd is None:
+            return
+        record = {'event': event, 'time': round(time.time(), 3)}
+        record.update(self.tags)
+        record.update((k, v) for k, v in fields.items() if v is not None)
+        line = json.dumps(record, separators=(',', ':'), default=float)
+        try:
+            os.write(self.fd, (line + '\n').encode())
+        except OSError:
+            # the reader went away, keep running silently
+            self.fd = None
+
+    def due(self, stage: str) -> bool:
+        """
+        Whether an update of stage would be emitted now, to skip gathering
+        metrics otherwise.
+        """
+        if self.fd is None:
+            return False
+        last = self._stages.get(stage, (0, 0, -math.inf))[2]
+        return time.monotonic() - last >= self.interval
+
+    def update(self,
+               stage: str,
+               done: float,
+               total: Optional[float] = None,
+               metrics: Optional[Dict[str, float]] = None,
+               force: bool = False,
+               **fields) -> None:
+        if self.fd is None:
+            return
+        now = time.monotonic()
+        start, start_done, _ = self._stages.setdefault(
+            stage, (now, done, -math.inf))
+        finished = total is not None and done >= total
+        if not (force or finished or self.due(stage)):
+            return
+        self._stages[stage] = (start, start_done, now)
+
+        rate = eta = None
+        if now > start and done > start_done:
+            rate = (done - start_done) / (now - start)
+            if total is not None:
+                eta = round(max(total - done, 0) / rate, 1)
+            rate = round(rate, 3)
+        self.emit('progress',
+                  stage=stage,
+                  done=done,
+                  total=total,
+                  rate=rate,
+                  eta=eta,
+                  metrics=metrics,
+                  **fields)
+
+    def close(self) -> None:
+        if self._owned and self.fd is not None:
+            os.close(self.fd)
+        self.fd = None
+
+
+def from_flags(flag_values: flags.FlagValues = flags.FLAGS,
+               **tags) -> ProgressReporter:
+    """
+    Reporter writing to the sink given on the command line, if any.
+    """
+    return ProgressReporter(fd=flag_values['progress_fd'].value,
+                            path=flag_values['progress_jsonl'].value,
+                            **tags)
+
+
+def describe(event: Dict) -> str:
+    """
+    Human readable summary of a progress event.
+    """
+    message = event.get('stage', event['event'])
+    if 'done' in event:
+        done = event['done']
+        message += f' {done:g}' if isinstance(done, float) else f' {done}'
+        if 'total' in event:
+            message += f'/{event["total"]}'
+    if 'eta' in event:
+        eta = int(event['eta'])
+        message += f' (ETA {eta // 3600}:{eta // 60 % 60:02d}:{eta % 60:02d})'
+    return message
@@ -1,7 +1,12 @@
+import functools
+import math
+from typing import Union
+
 import cached_conv as cc
 import numpy as np
 import torch
 import torch.nn as nn
+import torchaudio
 
 from .pqmf import kaiser_filter
 
@@ -68,3 +73,38 @@ class Resampler(nn.Module):
         x_up = x_up.permute(0, 2, 1).reshape(x_up.shape[0], -1).unsqueeze(1)
         x_up = x_up.reshape(x.shape[0], x.shape[1], -1)
         return x_up
+
+
+@functools.lru_cache(maxsize=64)
+def get_resampler(orig_sr: int,
+                  target_sr: int,
+                  dtype: torch.dtype = torch.float32,
+                  device: torch.device = torch.device('cpu')
+                  ) -> torchaudio.transforms.Resample:
+    """
+    torchaudio resampler whose sinc kernel is computed once for every rate
+    pair, dtype and device, instead of on every resample call.
+    """
+    return torchaudio.transforms.Resample(orig_sr, target_sr,
+                                          dtype=dtype).to(device)
+
+
+def resample(x: Union[np.ndarray, torch.Tensor], orig_sr: int,
+             target_sr: int) -> Union[np.ndarray, torch.Tensor]:
+    """
+    Resamples x [..., T] along its last axis as
+    torchaudio.functional.resample, all leading dimensions in one call.
+    NumPy arrays are viewed as tensors without a copy and resampled into
+    arrays. Other dtypes than float32 and float64 are cast to float32.
+    """
+    if isinstance(x, np.ndarray):
+        return resample(torch.from_numpy(x), orig_sr, target_sr).numpy()
+    if x.dtype not in (torch.float32, torch.float64):
+        x = x.float()
+    if orig_sr == target_sr:
+        return x
+    # the kernel only depends on the reduced ratio
+    gcd = math.gcd(int(orig_sr), int(target_sr))
+    resampler = get_resampler(int(orig_sr) // gcd,
+                              int(target_sr) // gcd, x.dtype, x.device)
+    return resampler(x)
@@ -9,6 +9,8 @@ import torch
 import scipy.signal as signal
 from udls.transforms import *
 
+from .resampler import resample
+
 
 class Transform(object):
     def __call__(self, x: torch.Tensor):
@@ -37,7 +39,7 @@ class Resample(Transform):
         self.target_sr = target_sr
 
     def __call__(self, x: np.ndarray):
-        return torchaudio.functional.resample(torch.from_numpy(x).float(), self.orig_sr, self.target_sr).numpy()
+        return resample(x, self.orig_sr, self.target_sr)
 
 
 class Compose(Transform):
@@ -160,7 +162,7 @@ class RandomGain(Transform):
             x_amp = x * amp_factor
             if (self.limit) and (np.abs(x_amp).max() > 1): 
                 x_amp = x_amp / np.abs(x_amp).max()
-            return x
+            return x_amp
         else:
             return x
 
@@ -172,7 +174,6 @@ class RandomMute(Transform):
         self.prob = prob
 
     def __call__(self, x: torch.Tensor):
-        mask = torch.bernoulli(torch.full((x.shape[0],), 1 - self.prob))
         mask = np.random.binomial(1, 1-self.prob, size=1)
         return x * mask
 
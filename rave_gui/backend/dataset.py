@@ -2,8 +2,7 @@
 Dataset operations backend.
 """
 from pathlib import Path
-from typing import Optional, List, Dict
-import json
+from typing import Callable, Optional, List, Dict, Sequence
 
 
 class DatasetManager:
@@ -119,6 +118,12 @@ class DatasetManager:
                 - duration_seconds: Total duration in seconds
                 - channels: Number of channels
                 - sample_rate: Sampling rate
+            and, when the preprocessed dataset has chunk statistics:
+                - num_chunks: Number of chunks
+                - peak: Largest chunk peak amplitude
+                - rms_db: Median chunk RMS level in dBFS
+                - centroid: Median chunk spectral centroid in Hz
+                - silence_ratio: Mean ratio of silent frames
         """
         dataset = self.get_dataset(dataset_id)
         if not dataset:
@@ -130,9 +135,89 @@ class DatasetManager:
         
         duration_seconds = num_samples / sample_rate if sample_rate > 0 and num_samples else 0
         
-        return {
+        stats = {
             'total_samples': num_samples,
             'duration_seconds': duration_seconds,
             'channels': dataset.get('channels', 1),
             'sample_rate': sample_rate
         }
+        stats.update(self.read_chunk_stats(Path(dataset['path'])))
+        return stats
+
+    @staticmethod
+    def read_chunk_stats(dataset_path: Path) -> Dict:
+        """Summarize the chunk statistics stored by `rave preprocess`.
+        
+        Args:
+            dataset_path: Preprocessed dataset folder
+            
+        Returns:
+            Dictionary of summary statistics, empty if the dataset has none
+        """
+        import numpy as np
+        
+        stats_path = Path(dataset_path) / "stats.npy"
+        if not stats_path.is_file():
+            return {}
+        chunks = np.load(stats_path)
+        if len(chunks) == 0:
+            return {'num_chunks': 0}
+        rms_db = 20 * np.log10(np.maximum(chunks['rms'], 1e-7))
+        return {
+            'num_chunks': len(chunks),
+            'peak': float(chunks['peak'].max()),
+            'rms_db': float(np.median(rms_db)),
+            'centroid': float(np.median(chunks['centroid'])),
+            'silence_ratio': float(chunks['silence'].mean())
+        }
+
+    @staticmethod
+    def scan_audio_files(input_path: Path,
+                         extensions: Optional[Sequence[str]] = None,
+                         interrupted: Optional[Callable[[], bool]] = None
+                         ) -> Dict:
+        """Scan an input folder and probe its audio files.
+        
+        Probe results go through the persistent probe cache shared with
+        `rave preprocess`, so scanning an already known folder is cheap.
+        
+        Args:
+            input_path: Folder containing audio files
+            extensions: Extensions to look for (default: preprocess defaults)
+            interrupted: Polled between files, the scan stops early and
+                returns partial statistics once it returns True
+            
+        Returns:
+            Dictionary with keys:
+                - num_files: Number of audio files found
+                - num_failed: Number of files that could not be probed
+                - duration_seconds: Total duration in seconds
+                - max_channels: Largest channel count found
+                - sample_rates: Sorted list of native sample rates
+        """
+        from rave import audio
+        
+        paths = audio.find_audio_files(
+            [input_path], extensions or audio.AUDIO_EXTENSIONS)
+        
+        stats = {
+            'num_files': len(paths),
+            'num_failed': 0,
+            'duration_seconds': 0.,
+            'max_channels': 0,
+            'sample_rates': set()
+        }
+        for path in paths:
+            if interrupted is not None and interrupted():
+                break
+            try:
+                info = audio.probe(str(path))
+            except (RuntimeError, OSError):
+                stats['num_failed'] += 1
+                continue
+            stats['duration_seconds'] += info.duration
+            stats['max_channels'] = max(stats['max_channels'], info.channels)
+            stats['sample_rates'].add(info.sr)
+        stats['sample_rates'] = sorted(stats['sample_rates'])
+        
+        return stats
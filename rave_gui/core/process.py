@@ -1,9 +1,12 @@
 """
 Subprocess management for RAVE CLI operations.
 """
+import json
+import os
 import subprocess
+import threading
 from pathlib import Path
-from typing import List, Optional, Callable
+from typing import Dict, List, Optional, Callable
 from PyQt6.QtCore import QThread, pyqtSignal
 
 
@@ -12,32 +15,57 @@ class ProcessThread(QThread):
     
     output = pyqtSignal(str)  # stdout/stderr output
     progress = pyqtSignal(int, str)  # percentage, message
+    event = pyqtSignal(dict)  # structured progress event
     finished = pyqtSignal(bool, str)  # success, message
     
-    def __init__(self, command: List[str], cwd: Optional[Path] = None):
+    def __init__(self, command: List[str], cwd: Optional[Path] = None,
+                 progress_events: bool = False):
         """Initialize the process thread.
         
         Args:
             command: Command and arguments as list
             cwd: Working directory for the process
+            progress_events: Whether the command is a RAVE script accepting
+                --progress_fd, in which case progress is read from its JSON
+                events instead of parsed from its output (POSIX only)
         """
         super().__init__()
         self.command = command
         self.cwd = cwd
+        self.progress_events = progress_events and os.name == 'posix'
         self.process = None
         self._should_stop = False
         
     def run(self):
         """Run the subprocess."""
         try:
-            self.process = subprocess.Popen(
-                self.command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                cwd=str(self.cwd) if self.cwd else None
-            )
+            command, pass_fds, events_fd = self.command, (), None
+            if self.progress_events:
+                events_fd, write_fd = os.pipe()
+                command = command + ['--progress_fd', str(write_fd)]
+                pass_fds = (write_fd, )
+
+            try:
+                self.process = subprocess.Popen(
+                    command,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.STDOUT,
+                    text=True,
+                    bufsize=1,
+                    cwd=str(self.cwd) if self.cwd else None,
+                    pass_fds=pass_fds
+                )
+            finally:
+                # only the child keeps the write end, so that reading
+                # events stops when it exits
+                for fd in pass_fds:
+                    os.close(fd)
+
+            events_thread = None
+            if events_fd is not None:
+                events_thread = threading.Thread(
+                    target=self.read_events, args=(events_fd, ), daemon=True)
+                events_thread.start()
             
             # Read output line by line
             for line in self.process.stdout:
@@ -48,12 +76,16 @@ class ProcessThread(QThread):
                 self.output.emit(line.strip())
                 
                 # Parse progress if possible
-                progress, msg = self.parse_progress(line)
-                if progress is not None:
-                    self.progress.emit(progress, msg)
+                if events_thread is None:
+                    progress, msg = self.parse_progress(line)
+                    if progress is not None:
+                        self.progress.emit(progress, msg)
             
             # Wait for process to complete
             return_code = self.process.wait()
+            if events_thread is not None:
+                # children of the process may hold the pipe a bit longer
+                events_thread.join(timeout=5)
             success = return_code == 0
             
             message = "Completed successfully" if success else f"Failed with code {return_code}"
@@ -62,6 +94,34 @@ class ProcessThread(QThread):
         except Exception as e:
             self.finished.emit(False, f"Error: {str(e)}")
             
+    def read_events(self, fd: int):
+        """Read JSON progress events until the process closes its end.
+        
+        Args:
+            fd: Read end of the events pipe
+        """
+        with os.fdopen(fd, 'r') as events:
+            for line in events:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                self.event.emit(event)
+                self.handle_event(event)
+                
+    def handle_event(self, event: Dict):
+        """Turn a progress event into a progress update.
+        
+        Args:
+            event: Decoded JSON event
+        """
+        from rave.progress import describe
+        
+        if event.get('event') != 'progress' or not event.get('total'):
+            return
+        percentage = int(100 * event['done'] / event['total'])
+        self.progress.emit(min(percentage, 100), describe(event))
+            
     def parse_progress(self, line: str) -> tuple[Optional[int], str]:
         """Parse progress from output line.
         
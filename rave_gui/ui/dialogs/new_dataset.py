@@ -5,7 +5,8 @@ from PyQt6.QtWidgets import (QWizard, QWizardPage, QVBoxLayout, QLabel,
                               QPushButton, QLineEdit, QSpinBox, QCheckBox,
                               QFileDialog, QListWidget, QHBoxLayout, QFormLayout,
                               QProgressBar)
-from PyQt6.QtCore import Qt
+from PyQt6.QtCore import Qt, QThread, pyqtSignal
+from datetime import timedelta
 from pathlib import Path
 from rave_gui.backend.dataset import DatasetManager
 from rave_gui.core.signals import AppSignals
@@ -73,6 +74,31 @@ class IntroPage(QWizardPage):
         self.setLayout(layout)
 
 
+class AudioScanThread(QThread):
+    """Thread probing the audio files of an input folder."""
+    
+    scanned = pyqtSignal(dict)  # scan statistics
+    
+    def __init__(self, input_path: Path):
+        """Initialize the scan thread.
+        
+        Args:
+            input_path: Folder to scan
+        """
+        super().__init__()
+        self.input_path = input_path
+        
+    def run(self):
+        """Scan the folder."""
+        try:
+            stats = DatasetManager.scan_audio_files(
+                self.input_path, interrupted=self.isInterruptionRequested)
+        except Exception as e:
+            stats = {'error': str(e)}
+        if not self.isInterruptionRequested():
+            self.scanned.emit(stats)
+
+
 class InputFilesPage(QWizardPage):
     """Page for selecting input audio files."""
     
@@ -112,7 +138,10 @@ class InputFilesPage(QWizardPage):
         layout.addLayout(output_layout)
         
         # File list
-        layout.addWidget(QLabel("\nAudio files will be scanned from the input folder."))
+        self.scan_label = QLabel("\nAudio files will be scanned from the input folder.")
+        self.scan_label.setWordWrap(True)
+        layout.addWidget(self.scan_label)
+        self.scan_thread = None
         
         layout.addStretch()
         self.setLayout(layout)
@@ -130,6 +159,35 @@ class InputFilesPage(QWizardPage):
         )
         if folder:
             self.input_path_edit.setText(folder)
+            self.scan_input_folder(Path(folder))
+            
+    def scan_input_folder(self, folder: Path):
+        """Probe the audio files of the input folder in the background."""
+        if self.scan_thread is not None:
+            # a scan of the previous folder must not overwrite this one
+            self.scan_thread.requestInterruption()
+            self.scan_thread.wait()
+        self.scan_label.setText(f"\nScanning {folder}...")
+        self.scan_thread = AudioScanThread(folder)
+        self.scan_thread.scanned.connect(self.on_scanned)
+        self.scan_thread.start()
+        
+    def on_scanned(self, stats: dict):
+        """Display scan statistics."""
+        if self.sender() is not self.scan_thread:
+            return
+        if 'error' in stats:
+            self.scan_label.setText(f"\nCould not scan input folder: {stats['error']}")
+            return
+        duration = timedelta(seconds=int(stats['duration_seconds']))
+        text = (f"\nFound {stats['num_files']} audio files ({duration}), "
+                f"up to {stats['max_channels']} channels")
+        if stats['sample_rates']:
+            rates = ", ".join(f"{sr} Hz" for sr in stats['sample_rates'])
+            text += f", sample rates: {rates}"
+        if stats['num_failed']:
+            text += f"\n{stats['num_failed']} files could not be read and will be skipped"
+        self.scan_label.setText(text)
             
     def browse_output_folder(self):
         """Open folder selection dialog for output."""
@@ -260,7 +318,7 @@ class PreprocessingPage(QWizardPage):
             )
             
             # Start preprocessing thread
-            self.process_thread = ProcessThread(cmd)
+            self.process_thread = ProcessThread(cmd, progress_events=True)
             self.process_thread.output.connect(self.on_output)
             self.process_thread.progress.connect(self.on_progress)
             self.process_thread.finished.connect(self.on_finished)
@@ -20,10 +20,10 @@ class TrainingProcess(ProcessThread):
             command: Command list for subprocess
             training_config: Training configuration dictionary
         """
-        super().__init__(command)
+        super().__init__(command, progress_events=True)
         self.training_config = training_config
         
-        # Metrics patterns for parsing
+        # Metrics patterns for parsing, when progress events are unavailable
         self.metric_patterns = {
             'loss': re.compile(r'loss[:\s]+([0-9.]+)', re.IGNORECASE),
             'step': re.compile(r'step[:\s]+(\d+)', re.IGNORECASE),
@@ -34,6 +34,29 @@ class TrainingProcess(ProcessThread):
         
         self.current_metrics = {}
     
+    def handle_event(self, event: Dict):
+        """Update metrics and step from a training event.
+        
+        Args:
+            event: Decoded JSON event
+        """
+        if event.get('event') == 'metrics':
+            metrics = event.get('metrics') or {}
+            self.current_metrics.update(metrics)
+            self.metrics_update.emit(metrics)
+            return
+        if event.get('event') != 'progress' or event.get('stage') != 'train':
+            return
+        
+        step = int(event['done'])
+        total = event.get('total') or self.training_config.get(
+            'max_steps', 500000)
+        metrics = dict(event.get('metrics') or {}, step=step)
+        self.current_metrics.update(metrics)
+        self.metrics_update.emit(metrics)
+        self.step_update.emit(step, total)
+        super().handle_event(event)
+    
     def parse_progress(self, line: str) -> tuple[Optional[int], str]:
         """Parse training progress from log line.
         
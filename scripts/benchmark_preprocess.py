@@ -0,0 +1,233 @@
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, NamedTuple, Optional, Sequence
+
+import numpy as np
+import soundfile as sf
+from absl import app, flags
+
+FLAGS = flags.FLAGS
+
+
+class Corpus(NamedTuple):
+    n_files: int
+    duration: float
+    channels: int
+    sample_rates: Sequence[int]
+
+
+CORPORA = {
+    'short': Corpus(400, 8., 1, [44100]),
+    'long': Corpus(3, 300., 2, [44100]),
+    'multichannel': Corpus(24, 20., 6, [48000]),
+    'mixed_sr': Corpus(60, 10., 2, [16000, 22050, 32000, 44100, 48000,
+                                    96000]),
+}
+MODES = ['full', 'lazy']
+
+flags.DEFINE_multi_enum('corpus',
+                        list(CORPORA),
+                        list(CORPORA),
+                        help='Synthetic corpora to preprocess')
+flags.DEFINE_multi_enum('mode', MODES, MODES, help='Dataset modes to run')
+flags.DEFINE_float('scale',
+                   1.,
+                   help='Scales the number of files of every corpus')
+flags.DEFINE_integer('repeat',
+                     1,
+                     help='Runs per configuration, the fastest one is kept')
+flags.DEFINE_integer('seed', 0, help='Seed of the synthetic audio')
+flags.DEFINE_string('work_dir',
+                    None,
+                    help='Directory where corpora are generated (and reused '
+                    'across benchmarks) and datasets written (default: a '
+                    'temporary directory)')
+flags.DEFINE_multi_string('preprocess_flag', [],
+                          help='Extra flag passed to preprocess, e.g. '
+                          '--preprocess_flag=--codec=zstd')
+flags.DEFINE_string('results_path',
+                    None,
+                    help='Where to write the JSON results (default: stdout)')
+
+
+def make_corpus(path: str,
+                corpus: Corpus,
+                scale: float = 1.,
+                seed: int = 0,
+                block_seconds: float = 10.) -> None:
+    """
+    Writes noisy sines as 16 bit wav files, reusing a previously completed
+    corpus found at path.
+    """
+    done = os.path.join(path, '.complete')
+    if os.path.exists(done):
+        return
+    os.makedirs(path, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    for i in range(max(1, round(corpus.n_files * scale))):
+        sr = corpus.sample_rates[i % len(corpus.sample_rates)]
+        freqs = rng.uniform(50, 2000, corpus.channels)
+        n_samples = int(corpus.duration * sr)
+        block = int(block_seconds * sr)
+        with sf.SoundFile(os.path.join(path, f'{i:05d}.wav'),
+                          'w',
+                          samplerate=sr,
+                          channels=corpus.channels,
+                          subtype='PCM_16') as f:
+            for start in range(0, n_samples, block):
+                t = np.arange(start, min(start + block, n_samples)) / sr
+                x = .3 * np.sin(2 * np.pi * freqs * t[:, None])
+                x += .05 * rng.standard_normal(x.shape)
+                f.write(x.astype(np.float32))
+    open(done, 'w').close()
+
+
+def run_preprocess(input_path: str, output_path: str, lazy: bool,
+                   extra_flags: Sequence[str]) -> Dict:
+    """
+    Runs preprocess in a fresh process with an empty probe cache, and
+    returns its report along with the peak RSS of its largest process.
+    """
+    if os.path.exists(output_path):
+        shutil.rmtree(output_path)
+    os.makedirs(output_path)
+    run_dir = tempfile.mkdtemp(prefix='rave_benchmark_')
+    report_path = os.path.join(run_dir, 'report.json')
+    command = [
+        sys.executable, '-m', 'scripts.preprocess', '--input_path',
+        input_path, '--output_path', output_path, '--report_path',
+        report_path
+    ]
+    if lazy:
+        command.append('--lazy')
+    command.extend(extra_flags)
+
+    start = time.perf_counter()
+    with open(os.path.join(run_dir, 'log.txt'), 'wb') as log:
+        process = subprocess.Popen(
+            command,
+            stdin=subprocess.PIPE,
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=dict(os.environ, RAVE_CACHE_DIR=os.path.join(run_dir,
+                                                             'cache')))
+        # answers the confirmation asked for lazy datasets
+        process.stdin.write(b'y\n')
+        process.stdin.close()
+        peak_rss = None
+        if hasattr(os, 'wait4'):
+            # also accounts for the pool workers reaped by preprocess
+            _, status, usage = os.wait4(process.pid, 0)
+            process.returncode = os.waitstatus_to_exitcode(status)
+            peak_rss = usage.ru_maxrss * (1 if sys.platform == 'darwin' else
+                                          1024)
+        else:
+            process.wait()
+    process_time = time.perf_counter() - start
+
+    if process.returncode:
+        with open(os.path.join(run_dir, 'log.txt'), 'r') as f:
+            log = f.read()
+        shutil.rmtree(run_dir)
+        raise RuntimeError(f'preprocess failed ({process.returncode}):\n'
+                           f'{log[-2000:]}')
+    with open(report_path, 'r') as f:
+        report = json.load(f)
+    shutil.rmtree(run_dir)
+    report['process_time'] = process_time
+    report['peak_rss'] = peak_rss
+    return report
+
+
+def summarize(report: Dict) -> Dict:
+    wall_time = max(report['wall_time'], 1e-9)
+    return {
+        'files': report['files'],
+        'audio_seconds': report['audio_seconds'],
+        'bytes': report['bytes'],
+        'wall_time': report['wall_time'],
+        'process_time': report['process_time'],
+        'files_per_second': report['files'] / wall_time,
+        'audio_seconds_per_second': report['audio_seconds'] / wall_time,
+        'mb_per_second': report['bytes'] / 1024**2 / wall_time,
+        'stages': report['stages'],
+        'peak_rss_mb': (None if report['peak_rss'] is None else
+                        report['peak_rss'] / 1024**2),
+    }
+
+
+def run_benchmark(work_dir: str,
+                  corpora: Sequence[str],
+                  modes: Sequence[str],
+                  scale: float = 1.,
+                  repeat: int = 1,
+                  seed: int = 0,
+                  extra_flags: Sequence[str] = (),
+                  log: Optional[Callable[[str], None]] = None) -> Dict:
+    runs = []
+    for name in corpora:
+        corpus_path = os.path.join(work_dir, 'corpora',
+                                   f'{name}_x{scale:g}_seed{seed}')
+        make_corpus(corpus_path, CORPORA[name], scale, seed)
+        for mode in modes:
+            output_path = os.path.join(work_dir, 'datasets', f'{name}_{mode}')
+            reports = [
+                run_preprocess(corpus_path, output_path, mode == 'lazy',
+                               extra_flags) for _ in range(repeat)
+            ]
+            run = summarize(min(reports, key=lambda r: r['wall_time']))
+            run = {'corpus': name, 'mode': mode, **run}
+            if log is not None:
+                log(f'{name} ({mode}): {run["files_per_second"]:.1f} files/s, '
+                    f'{run["audio_seconds_per_second"]:.1f} audio s/s, '
+                    f'{run["mb_per_second"]:.1f} MB/s')
+            runs.append(run)
+            shutil.rmtree(output_path)
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+        },
+        'settings': {
+            'scale': scale,
+            'repeat': repeat,
+            'seed': seed,
+            'preprocess_flags': list(extra_flags),
+        },
+        'runs': runs,
+    }
+
+
+def main(argv):
+    work_dir = FLAGS.work_dir or tempfile.mkdtemp(prefix='rave_benchmark_')
+    try:
+        results = run_benchmark(
+            work_dir,
+            FLAGS.corpus,
+            FLAGS.mode,
+            scale=FLAGS.scale,
+            repeat=FLAGS.repeat,
+            seed=FLAGS.seed,
+            extra_flags=FLAGS.preprocess_flag,
+            log=lambda message: print(message, file=sys.stderr))
+    finally:
+        if FLAGS.work_dir is None:
+            shutil.rmtree(work_dir)
+
+    if FLAGS.results_path is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(FLAGS.results_path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -29,6 +29,7 @@ except:
     import rave
 import rave.blocks
 import rave.core
+import rave.progress
 import rave.resampler
 from rave.prior import model as prior
 
@@ -66,6 +67,9 @@ flags.DEFINE_integer('sr',
 flags.DEFINE_string('prior', 
                     default=None,
                     help = "path to prior (optional)")
+rave.progress.define_flags()
+
+EXPORT_PHASES = ['load', 'script', 'save', 'test']
 
 
 class DumbPrior(nn.Module):
@@ -491,8 +495,18 @@ def get_state_dict(RUN, PRIOR):
 
 def main(argv):
     cc.use_cached_conv(FLAGS.streaming)
+    progress = rave.progress.from_flags()
+    progress.emit('start', script='export')
+
+    def report(phase: str):
+        progress.update('export',
+                        EXPORT_PHASES.index(phase),
+                        len(EXPORT_PHASES),
+                        force=True,
+                        phase=phase)
 
     logging.info("building rave")
+    report('load')
 
     config_file = rave.core.search_for_config(FLAGS.run)
     if config_file is None:
@@ -563,6 +577,7 @@ def main(argv):
             nn.utils.remove_weight_norm(m)
 
     logging.info("script model")
+    report('script')
     scripted_rave = script_class(
         pretrained=pretrained,
         channels = FLAGS.channels,
@@ -574,6 +589,7 @@ def main(argv):
     x = scripted_rave.decode(z)
 
     logging.info("save model")
+    report('save')
     output = FLAGS.output or os.path.dirname(FLAGS.run)
     model_name = FLAGS.name or FLAGS.run.split(os.sep)[-4]
     if FLAGS.streaming:
@@ -584,6 +600,7 @@ def main(argv):
     if not os.path.isdir(output):
         os.makedirs(output)
     scripted_rave.export_to_ts(os.path.join(output, model_name))
+    report('test')
     try:
         if pretrained.n_channels <= 2:
             # test stereo mode for VST export
@@ -597,6 +614,12 @@ def main(argv):
 
     logging.info(
         f"all good ! model exported to {os.path.join(output, model_name)}")
+    progress.update('export', len(EXPORT_PHASES), len(EXPORT_PHASES))
+    progress.emit('end',
+                  script='export',
+                  success=True,
+                  path=os.path.join(output, model_name))
+    progress.close()
 
 
 if __name__ == "__main__":
@@ -5,10 +5,16 @@ import cached_conv as cc
 
 try:
     import rave
+    import rave.audio
+    import rave.progress
+    import rave.resampler
 except:
     import sys, os 
     sys.path.append(os.path.abspath('.'))
     import rave
+    import rave.audio
+    import rave.progress
+    import rave.resampler
 
 
 FLAGS = flags.FLAGS
@@ -19,15 +25,13 @@ flags.DEFINE_string('name', None, help="name of the model")
 flags.DEFINE_integer('gpu', default=-1, help='GPU to use')
 flags.DEFINE_bool('stream', default=False, help='simulates streaming mode')
 flags.DEFINE_integer('chunk_size', default=None, help="chunk size for encoding/decoding (default: full file)")
+rave.progress.define_flags()
 
 
 def get_audio_files(path):
-    audio_files = []
     valid_exts = rave.core.get_valid_extensions()
-    for root, _, files in os.walk(path):
-        valid_files = list(filter(lambda x: os.path.splitext(x)[1] in valid_exts, files))
-        audio_files.extend([(path, os.path.join(root, f)) for f in valid_files])
-    return audio_files
+    audio_files = rave.audio.find_audio_files([path], valid_exts, archives=False)
+    return [(path, f) for f in audio_files]
 
 
 def main(argv):
@@ -76,8 +80,11 @@ def main(argv):
 
     progress_bar = tqdm.tqdm(audio_files)
     cc.MAX_BATCH_SIZE = 8
+    progress = rave.progress.from_flags()
+    progress.emit('start', script='generate', total=len(audio_files))
 
     for i, (d, f) in enumerate(progress_bar):
+        progress.update('generate', i, len(audio_files), file=f)
         #TODO reset cache
             
         try:
@@ -89,7 +96,7 @@ def main(argv):
 
         # load file
         if sr != model.sr:
-            x = torchaudio.functional.resample(x, sr, model.sr)
+            x = rave.resampler.resample(x, sr, model.sr)
         if model.n_channels != x.shape[0]:
             if model.n_channels < x.shape[0]:
                 x = x[:model.n_channels]
@@ -122,5 +129,9 @@ def main(argv):
         os.makedirs(os.path.dirname(out_path), exist_ok=True)
         torchaudio.save(out_path, out[0].cpu(), sample_rate=model.sr)
 
+    progress.update('generate', len(audio_files), len(audio_files))
+    progress.emit('end', script='generate', success=True)
+    progress.close()
+
 if __name__ == "__main__": 
     app.run(main)
\ No newline at end of file
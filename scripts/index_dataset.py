@@ -0,0 +1,29 @@
+import os
+from datetime import timedelta
+
+from absl import app, flags
+
+import rave.dataset
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('db_path',
+                    None,
+                    help='Dataset directory to index, either a database or '
+                    'a directory containing shards',
+                    required=True)
+
+
+def main(argv):
+    if os.path.isfile(os.path.join(FLAGS.db_path, 'data.mdb')):
+        index = rave.dataset.write_key_index(FLAGS.db_path)
+        print(f'indexed {len(index)} records '
+              f'({timedelta(seconds=float(index["length"].sum()))})')
+        return
+    metadata = rave.dataset.write_shard_index(FLAGS.db_path)
+    print(f'indexed {len(metadata["shards"])} shards '
+          f'({timedelta(seconds=metadata["n_seconds"])})')
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -3,7 +3,8 @@ import sys
 from absl import app
 
 AVAILABLE_SCRIPTS = [
-    'preprocess', 'train', 'train_prior', 'export', 'export_onnx', 'remote_dataset', 'generate'
+    'preprocess', 'train', 'train_prior', 'export', 'export_onnx', 'remote_dataset', 'generate',
+    'index_dataset', 'resample_dataset', 'benchmark_preprocess'
 ]
 
 
@@ -52,5 +53,17 @@ def main():
         from scripts import remote_dataset
         sys.argv[0] = remote_dataset.__name__
         app.run(remote_dataset.main)
+    elif command == 'index_dataset':
+        from scripts import index_dataset
+        sys.argv[0] = index_dataset.__name__
+        app.run(index_dataset.main)
+    elif command == 'resample_dataset':
+        from scripts import resample_dataset
+        sys.argv[0] = resample_dataset.__name__
+        app.run(resample_dataset.main)
+    elif command == 'benchmark_preprocess':
+        from scripts import benchmark_preprocess
+        sys.argv[0] = benchmark_preprocess.__name__
+        app.run(benchmark_preprocess.main)
     else:
         raise Exception(f'Command {command} not found')
@@ -1,29 +1,41 @@
 import functools
+import hashlib
+import json
 import multiprocessing
 import os
-import pathlib
-import subprocess
+import queue
+import shutil
+import sys
+import tempfile
+import time
+from contextlib import contextmanager, nullcontext
 from datetime import timedelta
 from functools import partial
-from itertools import repeat
-from typing import Callable, Iterable, Sequence, Tuple
+from multiprocessing import shared_memory
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple, Union
 
 import lmdb
 import numpy as np
 import torch
 import yaml
-import math
 from absl import app, flags
 from tqdm import tqdm
 from udls.generated import AudioExample
 
+import rave.audio
+import rave.codecs
+import rave.dataset
+import rave.progress
+from rave.dataset import LMDBWriter, MemmapWriter, get_memmap_offsets
+
 torch.set_grad_enabled(False)
 
 FLAGS = flags.FLAGS
 
 flags.DEFINE_multi_string('input_path',
                           None,
-                          help='Path to a directory containing audio files',
+                          help='Path to a directory or to a tar/zip archive '
+                          'containing audio files',
                           required=True)
 flags.DEFINE_string('output_path',
                     None,
@@ -41,7 +53,7 @@ flags.DEFINE_integer('max_db_size',
                      help='Maximum size (in GB) of the dataset')
 flags.DEFINE_multi_string(
     'ext',
-    default=['aif', 'aiff', 'wav', 'opus', 'mp3', 'aac', 'flac', 'ogg'],
+    default=rave.audio.AUDIO_EXTENSIONS,
     help='Extension to search for in the input directory')
 flags.DEFINE_bool('lazy',
                   default=False,
@@ -49,238 +61,1179 @@ flags.DEFINE_bool('lazy',
 flags.DEFINE_bool('dyndb',
                   default=True,
                   help="Allow the database to grow dynamically")
+flags.DEFINE_integer('commit_items',
+                     default=256,
+                     help='Number of records written per LMDB transaction')
+flags.DEFINE_integer('commit_size',
+                     default=64,
+                     help='Size (in MB) after which a transaction is committed')
+flags.DEFINE_integer('queue_depth',
+                     default=64,
+                     help='Maximum number of records waiting for the writer')
+flags.DEFINE_integer('shm_size',
+                     default=256,
+                     help='Size (in MB) of the shared memory used to hand '
+                     'chunks over from the decoding workers to the writer, '
+                     'split between shards (0 sends them through pipes)')
+flags.DEFINE_string('report_path',
+                    default=None,
+                    help='Write a JSON report of the run (work done and time '
+                    'spent per pipeline stage) to this path')
+rave.progress.define_flags()
+flags.DEFINE_integer('shards',
+                     default=0,
+                     help='Number of LMDB shards written in parallel')
+flags.DEFINE_string('shard_prefix',
+                    default='shard',
+                    help='Name prefix of the shards (use distinct prefixes '
+                    'for shards produced on different machines)')
+flags.DEFINE_bool('hash_files',
+                  default=False,
+                  help='Detect modified files by content hash instead of mtime')
+flags.DEFINE_enum('codec',
+                  default='pcm',
+                  enum_values=list(rave.codecs.CODECS),
+                  help='Codec used to store audio chunks')
+flags.DEFINE_enum('format',
+                  default='lmdb',
+                  enum_values=['lmdb', 'memmap'],
+                  help='Storage format: protobuf records in LMDB, or a flat '
+                  'memory-mapped PCM file')
+flags.DEFINE_bool('windowed',
+                  default=False,
+                  help='Store every file once as a contiguous segment, and '
+                  'sample training windows at any offset (memmap only)')
+flags.DEFINE_enum('silence',
+                  default='keep',
+                  enum_values=['keep', 'flag', 'drop'],
+                  help='Keep, flag (in the record metadata) or drop silent '
+                  'chunks')
+flags.DEFINE_float('silence_threshold',
+                   default=-60.,
+                   help='RMS level (in dBFS) below which a frame is silent')
+flags.DEFINE_float('min_active_ratio',
+                   default=.1,
+                   help='Minimum ratio of non-silent frames in a chunk')
+flags.DEFINE_enum('dedup',
+                  default='off',
+                  enum_values=['off', 'exact', 'fingerprint'],
+                  help='Skip chunks identical to (exact) or with the same '
+                  'coarse spectral fingerprint as an already stored chunk')
+flags.DEFINE_enum('decoder',
+                  default='ffmpeg',
+                  enum_values=list(rave.audio.DECODERS),
+                  help='Backend used to decode and resample audio files')
+
+
+HASHES_DTYPE = np.dtype([('key', '<u4'), ('hash', '<u8')])
+HASHES_FILE = 'hashes.npy'
+
+# frames per block streamed by load_audio_segment
+SEGMENT_BLOCK_SIZE = 2**16
+
+# (path, (data, statistics, hash)) chunks yielded by the loaders, (path,
+# None) for dropped chunks and (path, success) markers
+ChunkItem = Tuple[str, Union[Tuple[bytes, Optional[Dict], Optional[int]], bool,
+                             None]]
 
 
 def float_array_to_int16_bytes(x):
     return np.floor(x * (2**15 - 1)).astype(np.int16).tobytes()
 
 
-def load_audio_chunk(path: str, n_signal: int,
-                     sr: int, channels: int = 1) -> Iterable[np.ndarray]:
-
-    _, input_channels = get_audio_channels(path)
-    channel_map = range(channels)
-    if input_channels < channels:
-        channel_map = (math.ceil(channels / input_channels) * list(range(input_channels)))[:channels]
-
-    processes = []
-    for i in range(channels): 
-        process = subprocess.Popen(
-            [
-                'ffmpeg', '-hide_banner', '-loglevel', 'panic', '-i', path, 
-                '-ar', str(sr),
-                '-f', 's16le',
-                '-filter_complex', 'channelmap=%d-0'%channel_map[i],
-                '-'
-            ],
-            stdout=subprocess.PIPE,
-        )
-        processes.append(process)
-    
-    chunk = [p.stdout.read(n_signal * 4) for p in processes]
-    while len(chunk[0]) == n_signal * 4:
-        yield b''.join(chunk)
-        chunk = [p.stdout.read(n_signal * 4) for p in processes]
-    process.stdout.close()
-
-
-def get_audio_length(path: str) -> float:
-    process = subprocess.Popen(
-        [
-            'ffprobe', '-i', path, '-v', 'error', '-show_entries',
-            'format=duration'
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, _ = process.communicate()
-    if process.returncode: return None
+def load_audio_chunk(path: str,
+                     n_signal: int,
+                     sr: int,
+                     channels: int = 1,
+                     decoder: str = 'ffmpeg') -> Iterable[bytes]:
+    for chunk in rave.audio.load_audio_chunks(path, n_signal * 2, sr,
+                                              channels, decoder):
+        yield chunk.tobytes()
+
+
+def serialize_chunk(
+        audio_samples: bytes, sr: int, channels: int, codec: str, raw: bool,
+        silence: str, silence_threshold: float, min_active_ratio: float,
+        dedup: str) -> Optional[Tuple[bytes, Dict, Optional[int]]]:
+    """
+    Analyses and serializes a decoded chunk, or returns None if the chunk is
+    dropped as silent.
+    """
+    stats = get_metadata(audio_samples, channels, silence_threshold, sr=sr)
+    metadata = None
+    if silence != 'keep':
+        is_silent = stats['active_ratio'] < min_active_ratio
+        if is_silent and silence == 'drop':
+            return None
+        metadata = {k: f'{v:.6g}' for k, v in stats.items()}
+        metadata['silent'] = str(int(is_silent))
+    digest = None
+    if dedup != 'off':
+        digest = get_chunk_hash(audio_samples, channels,
+                                dedup == 'fingerprint')
+    if raw:
+        return audio_samples, stats, digest
+    return process_audio_array(audio_samples, sr, channels, codec,
+                               metadata), stats, digest
+
+
+def load_audio_examples(path: str,
+                        n_signal: int,
+                        sr: int,
+                        channels: int = 1,
+                        decoder: str = 'ffmpeg',
+                        codec: str = 'pcm',
+                        raw: bool = False,
+                        silence: str = 'keep',
+                        silence_threshold: float = -60.,
+                        min_active_ratio: float = .1,
+                        dedup: str = 'off') -> Iterable[ChunkItem]:
+    """
+    Runs inside the pool workers, so that serialization and analysis are
+    parallelized. Yields (path, (serialized example, statistics, hash))
+    pairs, or raw int16 chunks if raw is set, (path, None) for dropped
+    silent chunks, followed by a (path, success) marker once the file is
+    exhausted.
+    """
     try:
-        stdout = stdout.decode().split('\n')[1].split('=')[-1]
-        length = float(stdout)
-        _, channels = get_audio_channels(path)
-        return path, float(length), int(channels)
-    except:
-        return None
+        with measure('probe'):
+            rave.audio.probe(path)
+        for audio_samples in timed(
+                load_audio_chunk(path, n_signal, sr, channels, decoder),
+                'decode'):
+            with measure('serialize'):
+                example = serialize_chunk(audio_samples, sr, channels, codec,
+                                          raw, silence, silence_threshold,
+                                          min_active_ratio, dedup)
+            yield path, example
+    except RuntimeError as e:
+        print(f'[Warning] could not decode {path} ({e}); skipping')
+        yield path, False
+    else:
+        yield path, True
 
-def get_audio_channels(path: str) -> int:
-    process = subprocess.Popen(
-        [
-            'ffprobe', '-i', path, '-v', 'error', '-show_entries',
-            'stream=channels'
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, _ = process.communicate()
-    if process.returncode: return None
+
+def load_audio_segment(path: str,
+                       sr: int,
+                       channels: int = 1,
+                       decoder: str = 'ffmpeg',
+                       block_size: int = SEGMENT_BLOCK_SIZE
+                       ) -> Iterable[ChunkItem]:
+    """
+    Streams a whole file as interleaved int16 blocks, followed by a
+    (path, success) marker. Segments have no statistics.
+    """
     try:
-        stdout = stdout.decode().split('\n')[1].split('=')[-1]
-        channels = int(stdout)
-        return path, int(channels)
-    except:
-        return None 
+        with measure('probe'):
+            rave.audio.probe(path)
+        for block in timed(
+                rave.audio.load_audio_chunks(path,
+                                             block_size,
+                                             sr,
+                                             channels,
+                                             decoder,
+                                             keep_last=True), 'decode'):
+            with measure('serialize'):
+                block = np.ascontiguousarray(block.T).tobytes()
+            yield path, (block, None, None)
+    except RuntimeError as e:
+        print(f'[Warning] could not decode {path} ({e}); skipping')
+        yield path, False
+    else:
+        yield path, True
+
 
+def get_audio_length(path: str) -> Optional[Tuple[str, rave.audio.AudioInfo]]:
+    try:
+        with measure('probe'):
+            return path, rave.audio.probe(path)
+    except (RuntimeError, OSError):
+        return None
 
-def flatten(iterator: Iterable):
-    for elm in iterator:
-        for sub_elm in elm:
-            yield sub_elm
 
-def get_metadata(audio_samples, channels: int = 1):
+def get_metadata(audio_samples: bytes,
+                 channels: int = 1,
+                 threshold_db: float = -60.,
+                 frame_size: int = 1024,
+                 sr: int = 44100) -> Dict[str, float]:
+    """
+    Computes the peak and RMS amplitudes of a chunk, its spectral centroid
+    (in Hz), and the ratio of its frames whose RMS level is above
+    threshold_db.
+    """
     audio = np.frombuffer(audio_samples, dtype=np.int16)
-    audio = audio.astype(float) / (2**15 - 1)
+    audio = audio.astype(np.float32) / (2**15 - 1)
     audio = audio.reshape(channels, -1)
     peak_amplitude = np.amax(np.abs(audio))
     rms_amplitude = np.sqrt(np.mean(audio**2))
-    return {'peak': peak_amplitude, 'rms_amplitude': rms_amplitude}
 
+    n_frames = audio.shape[-1] // frame_size
+    frames = audio[:, :n_frames * frame_size].reshape(channels, n_frames,
+                                                      frame_size)
+    frames_rms = np.sqrt(np.mean(frames**2, axis=(0, -1)))
+    active = frames_rms > 10**(threshold_db / 20)
 
-def process_audio_array(audio: Tuple[int, bytes],
-                        env: lmdb.Environment,
-                        channels: int = 1) -> int:
-    audio_id, audio_samples = audio
-    buffers = {}
-    buffers['waveform'] = AudioExample.AudioBuffer(
-        shape=(channels, int(len(audio_samples) / channels)),
-        sampling_rate=FLAGS.sampling_rate,
-        data=audio_samples,
-        precision=AudioExample.Precision.INT16,
-    )
+    spectrum = np.abs(np.fft.rfft(frames.mean(0), axis=-1)).sum(0)
+    frequencies = np.fft.rfftfreq(frame_size, 1 / sr)
+    centroid = (spectrum * frequencies).sum() / max(spectrum.sum(), 1e-12)
+    return {
+        'peak': float(peak_amplitude),
+        'rms_amplitude': float(rms_amplitude),
+        'active_ratio': float(np.mean(active)) if n_frames else 0.,
+        'centroid': float(centroid),
+    }
 
-    ae = AudioExample(buffers=buffers)
-    key = f'{audio_id:08d}'
-    with env.begin(write=True) as txn:
-        txn.put(
-            key.encode(),
-            ae.SerializeToString(),
+
+def get_chunk_hash(audio_samples: bytes,
+                   channels: int = 1,
+                   fingerprint: bool = False,
+                   frame_size: int = 2048,
+                   n_bands: int = 16) -> int:
+    """
+    Computes a 64 bits hash of a chunk, either of its exact samples or of a
+    coarse spectral fingerprint: the signs of the band energy differences
+    across bands and frames, which ignore gain changes and most small
+    encoding differences.
+    """
+    if fingerprint:
+        audio = np.frombuffer(audio_samples, dtype=np.int16)
+        audio = audio.astype(np.float32).reshape(channels, -1).mean(0)
+        n_frames = len(audio) // frame_size
+        frames = audio[:n_frames * frame_size].reshape(n_frames, frame_size)
+        spectrum = np.abs(np.fft.rfft(frames * np.hanning(frame_size)))**2
+        edges = np.unique(
+            np.geomspace(2, frame_size // 2, n_bands + 1).astype(int))
+        bands = np.add.reduceat(spectrum, edges[:-1], axis=-1)
+        bits = np.diff(np.diff(bands, axis=-1), axis=0) > 0
+        audio_samples = np.packbits(bits).tobytes()
+    digest = hashlib.blake2b(audio_samples, digest_size=8).digest()
+    return int.from_bytes(digest, 'little')
+
+
+def process_audio_array(audio_samples: bytes,
+                        sr: int,
+                        channels: int = 1,
+                        codec: str = 'pcm',
+                        metadata: Optional[Dict[str, str]] = None) -> bytes:
+    buffers = {}
+    if codec == 'pcm':
+        buffers['waveform'] = AudioExample.AudioBuffer(
+            shape=(channels, int(len(audio_samples) / channels)),
+            sampling_rate=sr,
+            data=audio_samples,
+            precision=AudioExample.Precision.INT16,
         )
-    return audio_id
+    else:
+        audio = np.frombuffer(audio_samples, dtype=np.int16)
+        audio = audio.reshape(channels, -1)
+        buffers['waveform'] = AudioExample.AudioBuffer(
+            shape=audio.shape,
+            sampling_rate=sr,
+            data=rave.codecs.get_codec(codec).encode(audio, sr),
+            precision=AudioExample.Precision.RAW,
+            format=codec,
+        )
+
+    ae = AudioExample(buffers=buffers, metadata=metadata)
+    return ae.SerializeToString()
+
+
+def process_audio_file(audio: Tuple[str, rave.audio.AudioInfo]) -> bytes:
+    path, info = audio
+    ae = AudioExample(
+        metadata={
+            'path': path,
+            'length': str(info.duration),
+            'channels': str(info.channels),
+            'sr': str(info.sr),
+            'codec': info.codec,
+        })
+    return ae.SerializeToString()
+
 
+def get_file_signature(path: str,
+                       content_hash: bool = False) -> Tuple[str, Dict]:
+    signature = rave.audio.get_signature(path)
+    if content_hash:
+        digest = hashlib.blake2b()
+        source = rave.audio.open_input(path)
+        with open(source, 'rb') if isinstance(source, str) else source as f:
+            while block := f.read(1 << 20):
+                digest.update(block)
+        signature['hash'] = digest.hexdigest()
+    return path, signature
 
-def process_audio_file(audio: Tuple[int, Tuple[str, float]],
-                       env: lmdb.Environment) -> int:
-    audio_id, (path, length, channels) = audio
-    ae = AudioExample(metadata={'path': path, 'length': str(length), 'channels': str(channels)})
-    key = f'{audio_id:08d}'
+
+def signature_matches(old: Dict, new: Dict) -> bool:
+    if old['size'] != new['size']:
+        return False
+    if 'hash' in old and 'hash' in new:
+        return old['hash'] == new['hash']
+    return old['mtime'] == new['mtime']
+
+
+def extend_ranges(ranges: list, start: int, stop: int) -> None:
+    """
+    Appends [start, stop) to a list of ranges, merging it with the last one
+    when contiguous.
+    """
+    if stop <= start:
+        return
+    if ranges and ranges[-1][1] == start:
+        ranges[-1][1] = stop
+    else:
+        ranges.append([start, stop])
+
+
+def get_file_keys(entry: Dict) -> np.ndarray:
+    return np.concatenate([np.arange(*r) for r in entry['keys']] +
+                          [np.zeros(0, dtype=int)])
+
+
+class Manifest(object):
+    """
+    Content manifest stored next to metadata.yaml. Every source file is
+    mapped to its signature and to the [start, stop) ranges of keys it
+    produced, so that preprocessing can be resumed or updated incrementally.
+    Keys are never reused: new chunks are given keys after next_key as they
+    are written, and ranges of deleted or modified files are tombstoned.
+    Files whose chunks are still being written are kept in partial until
+    complete, and dropped by the next run if it was interrupted.
+    """
+    filename = 'manifest.json'
+
+    def __init__(self,
+                 config: Dict,
+                 files: Optional[Dict[str, Dict]] = None,
+                 next_key: int = 0,
+                 tombstones: Optional[Sequence[Tuple[int, int]]] = None,
+                 partial: Optional[Dict[str, Dict]] = None):
+        self.config = config
+        self.files = files or {}
+        self.next_key = next_key
+        self.tombstones = list(tombstones or [])
+        self.partial = partial or {}
+        # manifests of earlier versions hold a single range per file
+        for entry in self.files.values():
+            for name in ['keys', 'samples']:
+                if entry.get(name) and not isinstance(entry[name][0], list):
+                    entry[name] = [entry[name]]
+
+    @classmethod
+    def load(cls, db_path: str) -> Optional['Manifest']:
+        path = os.path.join(db_path, cls.filename)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r') as f:
+            return cls(**json.load(f))
+
+    def save(self, db_path: str) -> None:
+        path = os.path.join(db_path, self.filename)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(
+                {
+                    'config': self.config,
+                    'files': self.files,
+                    'next_key': self.next_key,
+                    'tombstones': self.tombstones,
+                    'partial': self.partial,
+                }, f)
+        os.replace(path + '.tmp', path)
+
+    def is_up_to_date(self, path: str, signature: Dict) -> bool:
+        return path in self.files and signature_matches(
+            self.files[path]['signature'], signature)
+
+    def add(self,
+            path: str,
+            signature: Dict,
+            n_keys: int,
+            length: float,
+            n_dropped: int = 0,
+            n_duplicates: int = 0) -> Tuple[int, int]:
+        start = self.next_key
+        for _ in range(n_keys):
+            self.allocate(path)
+        self.complete(path, signature, length, n_dropped, n_duplicates)
+        return start, self.next_key
+
+    def allocate(self,
+                 path: str,
+                 samples: Optional[Tuple[int, int]] = None) -> int:
+        """
+        Gives the next key to a chunk of path, along with the [start, stop)
+        samples it was written to in memmap datasets.
+        """
+        if path in self.files:
+            raise ValueError(f'{path} was already added to the manifest')
+        key, self.next_key = self.next_key, self.next_key + 1
+        entry = self.partial.setdefault(path, {'keys': []})
+        extend_ranges(entry['keys'], key, key + 1)
+        if samples is not None:
+            extend_ranges(entry.setdefault('samples', []), *samples)
+        return key
+
+    def complete(self,
+                 path: str,
+                 signature: Dict,
+                 length: float,
+                 n_dropped: int = 0,
+                 n_duplicates: int = 0,
+                 n_flagged: int = 0) -> None:
+        entry = self.partial.pop(path, {'keys': []})
+        entry['signature'] = signature
+        entry['length'] = length
+        if n_dropped:
+            entry['dropped'] = n_dropped
+        if n_flagged:
+            entry['flagged'] = n_flagged
+        if n_duplicates:
+            entry['duplicates'] = n_duplicates
+        self.files[path] = entry
+
+    def discard(self, path: str) -> np.ndarray:
+        """
+        Tombstones the keys given to a file that could not be completed,
+        and returns them.
+        """
+        entry = self.partial.pop(path, {'keys': []})
+        self.tombstones.extend(entry['keys'])
+        return get_file_keys(entry)
+
+    def remove(self, path: str) -> np.ndarray:
+        entry = self.files.pop(path)
+        self.tombstones.extend(r for r in entry['keys'] if r[1] > r[0])
+        return get_file_keys(entry)
+
+    @property
+    def n_seconds(self) -> float:
+        return sum(f['length'] for f in self.files.values())
+
+    @property
+    def n_dropped(self) -> int:
+        return sum(f.get('dropped', 0) for f in self.files.values())
+
+    @property
+    def n_flagged(self) -> int:
+        return sum(f.get('flagged', 0) for f in self.files.values())
+
+    @property
+    def n_duplicates(self) -> int:
+        return sum(f.get('duplicates', 0) for f in self.files.values())
+
+
+def delete_keys_from(env: lmdb.Environment, start: int) -> int:
+    """
+    Removes records left over by an interrupted run, i.e. every key at or
+    after start.
+    """
+    n_deleted = 0
     with env.begin(write=True) as txn:
-        txn.put(
-            key.encode(),
-            ae.SerializeToString(),
-        )
-    return length
+        cursor = txn.cursor()
+        if cursor.set_range(f'{start:08d}'.encode()):
+            while cursor.delete():
+                n_deleted += 1
+    return n_deleted
+
+
+def save_chunk_array(path: str, manifest: Manifest,
+                     arrays: Sequence[np.ndarray], dtype: np.dtype) -> None:
+    """
+    Writes the rows of the chunks referenced by the manifest, sorted by key
+    so that they follow the order of the dataset.
+    """
+    array = np.concatenate(list(arrays) + [np.zeros(0, dtype=dtype)])
+    keys = [get_file_keys(f) for f in manifest.files.values()]
+    keys = np.concatenate(keys + [np.zeros(0, dtype=int)])
+    array = array[np.isin(array['key'], keys)]
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, np.sort(array, order='key'))
+    os.replace(path + '.tmp', path)
+
+
+def get_key_index(manifest: Manifest) -> np.ndarray:
+    """
+    Indexes the keys of the manifest along with their length in seconds,
+    i.e. the length of a chunk or of a whole file for lazy datasets.
+    """
+    keys = [get_file_keys(f) for f in manifest.files.values()]
+    lengths = [f['length'] / max(len(k), 1)
+               for f, k in zip(manifest.files.values(), keys)]
+    index = np.zeros(sum(map(len, keys)), dtype=rave.dataset.KEY_INDEX_DTYPE)
+    index['key'] = np.concatenate(keys + [np.zeros(0, dtype=int)])
+    index['length'] = np.repeat(lengths, list(map(len, keys)))
+    return index
+
+
+def load_chunk_array(path: str) -> Optional[np.ndarray]:
+    return np.load(path) if os.path.exists(path) else None
+
+
+class ChunkTransport(object):
+    """
+    Hands the chunks decoded by the pool workers over to the main process.
+    Chunk bytes are copied into fixed-size slots of a shared memory segment
+    and only slot numbers go through the (synchronous) control pipe. Workers
+    block until a slot is free, which bounds the chunks in flight, and the
+    consumer copies every chunk out of its slot and frees the slot as soon
+    as it is received. Chunks larger than a slot go through the pipe.
+    """
+
+    def __init__(self, slot_size: int, n_slots: int) -> None:
+        self.slot_size = slot_size
+        self.items = multiprocessing.SimpleQueue()
+        self.shm = None
+        if n_slots > 0:
+            try:
+                self.shm = shared_memory.SharedMemory(create=True,
+                                                      size=n_slots * slot_size)
+            except OSError as e:
+                print(f'[Warning] could not allocate shared memory ({e}); '
+                      'sending chunks through pipes')
+                n_slots = 0
+        self.n_slots = n_slots
+        # stack of free slots, whose size is counted by the semaphore
+        self._available = multiprocessing.Semaphore(n_slots)
+        self._free = multiprocessing.Array('i', range(n_slots))
+        self._n_free = multiprocessing.Value('i', n_slots, lock=False)
+
+    def _acquire(self) -> int:
+        self._available.acquire()
+        with self._free.get_lock():
+            self._n_free.value -= 1
+            return self._free[self._n_free.value]
+
+    def _release(self, slot: int) -> None:
+        with self._free.get_lock():
+            self._free[self._n_free.value] = slot
+            self._n_free.value += 1
+        self._available.release()
+
+    def send(self, path: str, payload) -> None:
+        slot = None
+        if self.n_slots and isinstance(payload, tuple) and len(
+                payload[0]) <= self.slot_size:
+            slot = self._acquire()
+            data, offset = payload[0], slot * self.slot_size
+            self.shm.buf[offset:offset + len(data)] = data
+            payload = (len(data), ) + payload[1:]
+        self.items.put((path, payload, slot))
+
+    def receive(self):
+        """
+        Returns the next (path, payload) item, or None once the workers are
+        done.
+        """
+        item = self.items.get()
+        if item is None:
+            return None
+        path, payload, slot = item
+        if slot is not None:
+            offset = slot * self.slot_size
+            data = bytes(self.shm.buf[offset:offset + payload[0]])
+            self._release(slot)
+            payload = (data, ) + payload[1:]
+        return path, payload
+
+    def close(self) -> None:
+        if self.shm is None:
+            return
+        self.shm.close()
+        self.shm.unlink()
+        self.shm = None
+
+
+class PipelineStats(object):
+    """
+    Time spent per pipeline stage and work done, accumulated in shared memory
+    by the main process, the pool workers and the shards. Stage times of
+    concurrent workers add up, and may exceed the wall time of the run.
+    """
+    stages = ['discover', 'probe', 'decode', 'serialize', 'commit']
+    counters = ['files', 'audio_seconds', 'bytes']
+
+    def __init__(self) -> None:
+        self._values = multiprocessing.Array(
+            'd', len(self.stages) + len(self.counters))
+
+    def add(self, name: str, value: float) -> None:
+        index = (self.stages + self.counters).index(name)
+        with self._values.get_lock():
+            self._values[index] += value
+
+    @contextmanager
+    def measure(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def as_dict(self) -> Dict:
+        values = dict(zip(self.stages + self.counters, self._values))
+        report = {
+            'files': int(values['files']),
+            'audio_seconds': values['audio_seconds'],
+            'bytes': int(values['bytes']),
+        }
+        report['stages'] = {k: values[k] for k in self.stages}
+        return report
+
+
+_transport = None
+_stats = None
+
+
+def init_worker(transport: Optional[ChunkTransport],
+                stats: Optional[PipelineStats]) -> None:
+    # pool initializer, both are inherited by the workers
+    global _transport, _stats
+    _transport, _stats = transport, stats
+
+
+def measure(stage: str):
+    return _stats.measure(stage) if _stats is not None else nullcontext()
+
+
+def timed(iterable: Iterable, stage: str) -> Iterable:
+    """
+    Iterates while accounting the time spent producing every item to stage.
+    """
+    iterator = iter(iterable)
+    while True:
+        with measure(stage):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
 
 
 def flatmap(pool: multiprocessing.Pool,
             func: Callable,
             iterable: Iterable,
+            transport: ChunkTransport,
             chunksize=None):
-    queue = multiprocessing.Manager().Queue(maxsize=os.cpu_count())
+    iterable = list(iterable)
+    if not iterable:
+        # map_async never calls back on empty inputs
+        return
     pool.map_async(
         functools.partial(flat_mappper, func),
-        zip(iterable, repeat(queue)),
+        iterable,
         chunksize,
-        lambda _: queue.put(None),
+        lambda _: transport.items.put(None),
         lambda *e: print(e),
     )
 
-    item = queue.get()
-    while item is not None:
+    while (item := transport.receive()) is not None:
         yield item
-        item = queue.get()
 
 
-def flat_mappper(func, arg):
-    data, queue = arg
-    for item in func(data):
-        queue.put(item)
+def flat_mappper(func, data):
+    for path, payload in func(data):
+        _transport.send(path, payload)
+
+
+def get_transport_slots(slot_size: int, size: int, n_shares: int = 1) -> int:
+    # stay well below the free space of /dev/shm, as writing past it
+    # crashes the workers with SIGBUS. Shards share the budget
+    if os.path.isdir('/dev/shm'):
+        size = min(size, shutil.disk_usage('/dev/shm').free // 2)
+    return size // n_shares // slot_size
 
 
 def search_for_audios(path_list: Sequence[str], extensions: Sequence[str]):
-    paths = map(pathlib.Path, path_list)
-    audios = []
-    for p in paths:
-        for ext in extensions:
-            audios.append(p.rglob(f'*.{ext}'))
-            audios.append(p.rglob(f'*.{ext.upper()}'))
-    audios = flatten(audios)
-    return audios
+    return rave.audio.find_audio_files(path_list, extensions)
 
 
-def main(argv):
-    if FLAGS.lazy and os.name in ["nt", "posix"]:
-        while (answer := input(
-                "Using lazy datasets on Windows/macOS might result in slow training. Continue ? (y/n) "
-        ).lower()) not in ["y", "n"]:
-            print("Answer 'y' or 'n'.")
-        if answer == "n":
-            print("Aborting...")
-            exit()
+def get_shard(path: str, n_shards: int) -> int:
+    # stable across runs, so that incremental runs route files to the same
+    # shard
+    return int(hashlib.md5(path.encode()).hexdigest(), 16) % n_shards
 
 
-    chunk_load = partial(load_audio_chunk,
-                         n_signal=FLAGS.num_signal,
-                         sr=FLAGS.sampling_rate,
-                         channels=FLAGS.channels)
+def preprocess_database(db_path: str,
+                        audios: Sequence[str],
+                        processes: Optional[int] = None,
+                        position: int = 0,
+                        pipeline_stats: Optional[PipelineStats] = None
+                        ) -> float:
+    """
+    Builds (or incrementally updates) a single database at db_path from
+    the given audio files, returning the dataset length in seconds. Work
+    done and time spent per stage are added to pipeline_stats if given.
+    """
+    if FLAGS.windowed:
+        chunk_load = partial(load_audio_segment,
+                             sr=FLAGS.sampling_rate,
+                             channels=FLAGS.channels,
+                             decoder=FLAGS.decoder)
+    else:
+        chunk_load = partial(load_audio_examples,
+                             n_signal=FLAGS.num_signal,
+                             sr=FLAGS.sampling_rate,
+                             channels=FLAGS.channels,
+                             decoder=FLAGS.decoder,
+                             codec=FLAGS.codec,
+                             raw=FLAGS.format == 'memmap',
+                             silence=FLAGS.silence,
+                             silence_threshold=FLAGS.silence_threshold,
+                             min_active_ratio=FLAGS.min_active_ratio,
+                             dedup=FLAGS.dedup)
 
-    output_dir = os.path.join(*os.path.split(FLAGS.output_path)[:-1])
-    if not os.path.isdir(output_dir):
-        os.makedirs(output_dir)
+    os.makedirs(db_path, exist_ok=True)
 
     # create database
-    env = lmdb.open(
-        FLAGS.output_path,
-        map_size=FLAGS.max_db_size * 1024**3,
-        map_async=not FLAGS.dyndb,
-        writemap=not FLAGS.dyndb,
-    )
-    pool = multiprocessing.Pool()
+    env = None
+    if FLAGS.format == 'memmap':
+        writer = MemmapWriter(db_path)
+    else:
+        env = lmdb.open(
+            db_path,
+            map_size=FLAGS.max_db_size * 1024**3,
+            map_async=not FLAGS.dyndb,
+            writemap=not FLAGS.dyndb,
+        )
+        writer = LMDBWriter(env,
+                            commit_items=FLAGS.commit_items,
+                            commit_bytes=FLAGS.commit_size * 1024**2,
+                            queue_depth=FLAGS.queue_depth)
+    transport = None
+    if not FLAGS.lazy:
+        if FLAGS.windowed:
+            slot_size = 2 * FLAGS.channels * SEGMENT_BLOCK_SIZE
+        else:
+            # serialized examples carry a small header
+            slot_size = 4 * FLAGS.channels * FLAGS.num_signal + 1024
+        transport = ChunkTransport(
+            slot_size,
+            get_transport_slots(slot_size, FLAGS.shm_size * 1024**2,
+                                max(FLAGS.shards, 1)))
+    init_worker(transport, pipeline_stats)
+    pool = multiprocessing.Pool(processes,
+                                initializer=init_worker,
+                                initargs=(transport, pipeline_stats))
 
+    # compare with a previous run
+    config = {
+        'lazy': FLAGS.lazy,
+        'channels': FLAGS.channels,
+        'sr': FLAGS.sampling_rate,
+        'num_signal': FLAGS.num_signal,
+        'format': FLAGS.format,
+        'windowed': FLAGS.windowed,
+    }
+    if FLAGS.silence == 'drop':
+        config['silence'] = [FLAGS.silence_threshold, FLAGS.min_active_ratio]
+    if FLAGS.dedup != 'off':
+        config['dedup'] = FLAGS.dedup
+    manifest = Manifest.load(db_path)
+    if manifest is not None and manifest.config != config:
+        print('[Warning] dataset was built with different parameters '
+              f'({manifest.config}); rebuilding it from scratch')
+        manifest = None
+    stats_path = os.path.join(db_path, rave.dataset.STATS_FILE)
+    hashes_path = os.path.join(db_path, HASHES_FILE)
+    if manifest is None:
+        manifest = Manifest(config)
+        for side_path in [stats_path, hashes_path]:
+            if os.path.exists(side_path):
+                os.remove(side_path)
+        if env is None:
+            writer.truncate(0)
+        else:
+            with env.begin(write=True) as txn:
+                txn.drop(env.open_db(), delete=False)
+    elif env is None:
+        writer.truncate(
+            max((r[1] for f in manifest.files.values()
+                 for r in f.get('samples', [])),
+                default=0))
+    elif n_orphans := delete_keys_from(env, manifest.next_key):
+        print(f'resuming interrupted run: removed {n_orphans} partial records')
+    # the key index is only written once the database is complete
+    key_index_path = os.path.join(db_path, rave.dataset.KEY_INDEX_FILE)
+    if os.path.exists(key_index_path):
+        os.remove(key_index_path)
+    stats = [s for s in [load_chunk_array(stats_path)] if s is not None]
+    hashes = [h for h in [load_chunk_array(hashes_path)] if h is not None]
 
-    # search for audio files
-    audios = search_for_audios(FLAGS.input_path, FLAGS.ext)
-    audios = map(str, audios)
-    audios = map(os.path.abspath, audios)
-    audios = [*audios]
-    if len(audios) == 0:
-        print("No valid file found in %s. Aborting"%FLAGS.input_path)
+    with measure('discover'):
+        signatures = dict(
+            pool.imap(partial(get_file_signature,
+                              content_hash=FLAGS.hash_files),
+                      audios,
+                      chunksize=64))
+
+    if env is not None:
+        writer.start()
+
+    # drop the files left partly written by an interrupted run
+    for path in list(manifest.partial):
+        for key in manifest.discard(path):
+            writer.delete(f'{key:08d}'.encode())
+
+    # tombstone deleted and modified files
+    n_removed = 0
+    for path in list(manifest.files):
+        if path in signatures and manifest.is_up_to_date(
+                path, signatures[path]):
+            manifest.files[path]['signature'] = signatures[path]
+            continue
+        for key in manifest.remove(path):
+            writer.delete(f'{key:08d}'.encode())
+        n_removed += 1
+
+    # chunks skipped as duplicates may have been duplicates of removed ones
+    if FLAGS.dedup != 'off' and n_removed:
+        for path in list(manifest.files):
+            if manifest.files[path].get('duplicates'):
+                for key in manifest.remove(path):
+                    writer.delete(f'{key:08d}'.encode())
+
+    # hashes of the chunks already stored
+    known_hashes = set()
+    if hashes:
+        live = [get_file_keys(f) for f in manifest.files.values()]
+        live = np.concatenate(live + [np.zeros(0, dtype=int)])
+        known_hashes = set(hashes[0]['hash'][np.isin(hashes[0]['key'],
+                                                       live)].tolist())
+
+    # overlapping input paths may list a file twice
+    audios = [a for a in dict.fromkeys(audios) if a not in manifest.files]
+    print(f'{len(signatures) - len(audios)} files up to date, '
+          f'{n_removed} removed, {len(audios)} to process')
+
+    progress = rave.progress.from_flags(
+        **({'shard': position} if FLAGS.shards > 1 else {}))
+    n_done = 0
+
+    def report(force: bool = False):
+        progress.update('preprocess',
+                        n_done,
+                        len(audios),
+                        metrics={
+                            'audio_seconds': n_seconds,
+                            'bytes': writer.n_bytes
+                        },
+                        force=force)
+
+    last_checkpoint = time.monotonic()
+
+    def checkpoint(force: bool = False):
+        nonlocal last_checkpoint
+        if force or time.monotonic() - last_checkpoint > 30:
+            writer.flush()
+            manifest.save(db_path)
+            if not FLAGS.lazy and not FLAGS.windowed:
+                save_chunk_array(stats_path, manifest, stats,
+                                 rave.dataset.STATS_DTYPE)
+            if FLAGS.dedup != 'off':
+                save_chunk_array(hashes_path, manifest, hashes, HASHES_DTYPE)
+            last_checkpoint = time.monotonic()
+
+    n_seconds = manifest.n_seconds
+    chunk_length = (FLAGS.num_signal * 2) / FLAGS.sampling_rate
+    report(force=True)
 
     if not FLAGS.lazy:
 
-        # load chunks
-        chunks = flatmap(pool, chunk_load, audios)
-        chunks = enumerate(chunks)
+        # load and serialize chunks in the workers. Chunks are written as
+        # they arrive, so that the keys of files decoded concurrently
+        # interleave, and files are only added to the manifest once all
+        # their chunks are written. The segments of windowed datasets must
+        # be contiguous, and are spooled to disk until complete
+        chunks = flatmap(pool, chunk_load, audios, transport)
+        in_progress = {}
 
-        processed_samples = map(partial(process_audio_array, env=env, channels=FLAGS.channels), chunks)
+        pbar = tqdm(chunks, position=position)
+        for path, ae in pbar:
+            state = in_progress.setdefault(path, {
+                'kept': 0,
+                'dropped': 0,
+                'flagged': 0,
+                'duplicates': 0,
+                'stats': [],
+                'hashes': [],
+                'spool': None,
+            })
+            if ae is None:
+                state['dropped'] += 1
+                continue
+            if not isinstance(ae, bool):
+                example, chunk_stats, digest = ae
+                if digest is not None and digest in known_hashes:
+                    state['duplicates'] += 1
+                    continue
+                if FLAGS.windowed:
+                    if state['spool'] is None:
+                        state['spool'] = tempfile.TemporaryFile(dir=db_path)
+                    state['spool'].write(example)
+                    continue
+                samples = None
+                if env is None:
+                    samples = (writer.position,
+                               writer.position + len(example) // 2)
+                key = manifest.allocate(path, samples)
+                writer.put(f'{key:08d}'.encode(), example)
+                state['kept'] += 1
+                if (FLAGS.silence == 'flag' and chunk_stats['active_ratio'] <
+                        FLAGS.min_active_ratio):
+                    state['flagged'] += 1
+                state['stats'].append(
+                    (key, chunk_stats['peak'], chunk_stats['rms_amplitude'],
+                     chunk_stats['centroid'], 1 - chunk_stats['active_ratio']))
+                if digest is not None:
+                    known_hashes.add(digest)
+                    state['hashes'].append((key, digest))
+                continue
 
-        pbar = tqdm(processed_samples)
-        n_seconds = 0
-        for audio_id in pbar:
-            n_seconds = (FLAGS.num_signal * 2) / FLAGS.sampling_rate * audio_id
+            del in_progress[path]
+            n_done += 1
+            if not ae:
+                known_hashes.difference_update(h for _, h in state['hashes'])
+                for key in manifest.discard(path):
+                    writer.delete(f'{key:08d}'.encode())
+                if state['spool'] is not None:
+                    state['spool'].close()
+                continue
+            if FLAGS.windowed:
+                spool = state['spool']
+                n_samples = spool.tell() // 2 if spool is not None else 0
+                key = manifest.allocate(
+                    path, (writer.position, writer.position + n_samples))
+                if spool is not None:
+                    writer.put_file(f'{key:08d}'.encode(), spool)
+                    spool.close()
+                length = n_samples / FLAGS.channels / FLAGS.sampling_rate
+            else:
+                length = state['kept'] * chunk_length
+                stats.append(
+                    np.array(state['stats'], dtype=rave.dataset.STATS_DTYPE))
+            manifest.complete(path, signatures[path], length,
+                              state['dropped'], state['duplicates'],
+                              state['flagged'])
+            if FLAGS.dedup != 'off':
+                hashes.append(np.array(state['hashes'], dtype=HASHES_DTYPE))
+            if pipeline_stats is not None:
+                pipeline_stats.add('files', 1)
+                pipeline_stats.add('audio_seconds', length)
+            n_seconds += length
             pbar.set_description(
                 f'dataset length: {timedelta(seconds=n_seconds)}')
+            pbar.set_postfix_str(writer.describe())
+            report()
+            checkpoint()
         pbar.close()
     else:
         audio_lengths = pool.imap_unordered(get_audio_length, audios)
         audio_lengths = filter(lambda x: x is not None, audio_lengths)
-        audio_lengths = enumerate(audio_lengths)
-        processed_samples = map(partial(process_audio_file, env=env),
-                                audio_lengths)
-        pbar = tqdm(processed_samples)
-        n_seconds = 0
-        for length in pbar:
-            n_seconds += length
+        pbar = tqdm(audio_lengths, position=position)
+        for audio in pbar:
+            path, info = audio
+            start, _ = manifest.add(path, signatures[path], 1, info.duration)
+            writer.put(f'{start:08d}'.encode(), process_audio_file(audio))
+            if pipeline_stats is not None:
+                pipeline_stats.add('files', 1)
+                pipeline_stats.add('audio_seconds', info.duration)
+            n_seconds += info.duration
+            n_done += 1
             pbar.set_description(
                 f'dataset length: {timedelta(seconds=n_seconds)}')
+            report()
+            checkpoint()
         pbar.close()
 
+    checkpoint(force=True)
+    writer.close()
+    report(force=True)
+    progress.close()
+    if pipeline_stats is not None:
+        pipeline_stats.add('bytes', writer.n_bytes)
+        pipeline_stats.add('commit', writer.busy_time)
+    if env is None:
+        writer.write_offsets(
+            get_memmap_offsets(
+                (r for f in manifest.files.values()
+                 for r in f.get('samples', [])),
+                None if FLAGS.windowed else 2 * FLAGS.num_signal *
+                FLAGS.channels))
+    print(f'written {writer.n_items} records in {writer.n_commits} commits '
+          f'({writer.describe()})')
+
+    metadata = {
+        'lazy': FLAGS.lazy,
+        'channels': FLAGS.channels,
+        'n_seconds': manifest.n_seconds,
+        'sr': FLAGS.sampling_rate,
+        'codec': FLAGS.codec,
+        'format': FLAGS.format,
+    }
+    if FLAGS.windowed:
+        metadata['windowed'] = True
+    if FLAGS.silence != 'keep':
+        action = 'dropped' if FLAGS.silence == 'drop' else 'flagged'
+        n_silent = (manifest.n_dropped
+                    if FLAGS.silence == 'drop' else manifest.n_flagged)
+        metadata['silence'] = {
+            'mode': FLAGS.silence,
+            'threshold_db': FLAGS.silence_threshold,
+            'min_active_ratio': FLAGS.min_active_ratio,
+            f'{action}_chunks': n_silent,
+            f'{action}_seconds': n_silent * chunk_length,
+        }
+        print(f'{action} {n_silent} silent chunks '
+              f'({timedelta(seconds=n_silent * chunk_length)})')
+    if FLAGS.dedup != 'off':
+        metadata['dedup'] = {
+            'mode': FLAGS.dedup,
+            'duplicate_chunks': manifest.n_duplicates,
+            'duplicate_seconds': manifest.n_duplicates * chunk_length,
+        }
+        print(f'skipped {manifest.n_duplicates} duplicate chunks '
+              f'({timedelta(seconds=manifest.n_duplicates * chunk_length)})')
     with open(os.path.join(
-            FLAGS.output_path,
+            db_path,
             'metadata.yaml',
-    ), 'w') as metadata:
-        yaml.safe_dump({'lazy': FLAGS.lazy, 'channels': FLAGS.channels, 'n_seconds': n_seconds, 'sr': FLAGS.sampling_rate}, metadata)
+    ), 'w') as f:
+        yaml.safe_dump(metadata, f)
     pool.close()
-    env.close()
+    pool.join()
+    if transport is not None:
+        transport.close()
+    if env is not None:
+        env.close()
+        rave.dataset.save_key_index(db_path, get_key_index(manifest))
+    return manifest.n_seconds
+
+
+def write_report(path: str, pipeline_stats: PipelineStats,
+                 wall_time: float) -> None:
+    report = pipeline_stats.as_dict()
+    report['wall_time'] = wall_time
+    report['flags'] = {
+        flag.name: flag.value
+        for flag in FLAGS.get_flags_for_module(sys.modules[__name__])
+    }
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+
+def preprocess_shard(argv: Sequence[str], db_path: str,
+                     audios: Sequence[str], processes: int, position: int,
+                     pipeline_stats: Optional[PipelineStats]):
+    # flags are not inherited by spawned (non-forked) processes
+    if not FLAGS.is_parsed():
+        FLAGS(argv)
+    preprocess_database(db_path, audios, processes, position,
+                        pipeline_stats)
+
+
+def remove_leftover_shards(db_path: str, prefix: str, n_shards: int) -> None:
+    """
+    Removes the shards of prefix numbered past n_shards, written by an
+    earlier run with more shards, which would be indexed along with the new
+    ones.
+    """
+    if not os.path.isdir(db_path):
+        return
+    for name in rave.dataset.list_shards(db_path):
+        shard_prefix, _, number = name.rpartition('_')
+        if shard_prefix == prefix and number.isdigit() and int(
+                number) >= n_shards:
+            print(f'removing shard {name} left over by a previous run')
+            shutil.rmtree(os.path.join(db_path, name))
+
+
+def preprocess_shards(audios: Sequence[str],
+                      pipeline_stats: Optional[PipelineStats] = None) -> None:
+    remove_leftover_shards(FLAGS.output_path, FLAGS.shard_prefix,
+                           FLAGS.shards)
+    # every shard is a standalone database owned by its own process
+    routes = [[] for _ in range(FLAGS.shards)]
+    for audio in audios:
+        routes[get_shard(audio, FLAGS.shards)].append(audio)
+
+    processes = max(1, os.cpu_count() // FLAGS.shards)
+    shards = []
+    for i, shard_audios in enumerate(routes):
+        shard_path = os.path.join(FLAGS.output_path,
+                                  f'{FLAGS.shard_prefix}_{i:04d}')
+        shard = multiprocessing.Process(target=preprocess_shard,
+                                        args=(sys.argv, shard_path,
+                                              shard_audios, processes, i,
+                                              pipeline_stats))
+        shard.start()
+        shards.append(shard)
+    for shard in shards:
+        shard.join()
+    failed = [i for i, shard in enumerate(shards) if shard.exitcode]
+    if failed:
+        raise RuntimeError(f'shards {failed} failed')
+
+    metadata = rave.dataset.write_shard_index(FLAGS.output_path)
+    print(f'indexed {len(metadata["shards"])} shards '
+          f'({timedelta(seconds=metadata["n_seconds"])})')
+
+
+def main(argv):
+    if FLAGS.lazy and os.name in ["nt", "posix"]:
+        while (answer := input(
+                "Using lazy datasets on Windows/macOS might result in slow training. Continue ? (y/n) "
+        ).lower()) not in ["y", "n"]:
+            print("Answer 'y' or 'n'.")
+        if answer == "n":
+            print("Aborting...")
+            exit()
+
+    if FLAGS.shards > 1 and FLAGS.lazy:
+        raise app.UsageError('sharding is not available for lazy datasets')
+    if FLAGS.format == 'memmap' and (FLAGS.lazy or FLAGS.shards > 1
+                                     or FLAGS.codec != 'pcm'):
+        raise app.UsageError('memmap datasets are neither lazy, sharded '
+                             'nor compressed')
+    if FLAGS.windowed and (FLAGS.format != 'memmap'
+                           or FLAGS.silence != 'keep' or FLAGS.dedup != 'off'):
+        raise app.UsageError('windowed datasets must use the memmap format '
+                             'and cannot filter silence or duplicates')
+    if FLAGS.lazy and FLAGS.dedup != 'off':
+        raise app.UsageError('lazy datasets cannot be deduplicated')
+    if FLAGS.format == 'memmap' and FLAGS.silence == 'flag':
+        raise app.UsageError('memmap datasets cannot flag silent chunks, '
+                             'use --silence drop')
+
+    start_time = time.perf_counter()
+    pipeline_stats = PipelineStats() if FLAGS.report_path else None
+    progress = rave.progress.from_flags()
+    progress.emit('start', script='preprocess')
+
+    # search for audio files
+    with (pipeline_stats.measure('discover')
+          if pipeline_stats is not None else nullcontext()):
+        audios = search_for_audios(FLAGS.input_path, FLAGS.ext)
+    audios = [
+        a if rave.audio.MEMBER_SEPARATOR in a else os.path.abspath(a)
+        for a in audios
+    ]
+    if FLAGS.lazy and any(rave.audio.MEMBER_SEPARATOR in a for a in audios):
+        raise app.UsageError('lazy datasets cannot read from archives')
+    if len(audios) == 0:
+        print("No valid file found in %s. Aborting"%FLAGS.input_path)
+    progress.update('discover', len(audios), len(audios))
+
+    if FLAGS.shards <= 1:
+        preprocess_database(FLAGS.output_path,
+                            audios,
+                            pipeline_stats=pipeline_stats)
+    else:
+        preprocess_shards(audios, pipeline_stats)
+
+    if pipeline_stats is not None:
+        write_report(FLAGS.report_path, pipeline_stats,
+                     time.perf_counter() - start_time)
+    progress.emit('end', script='preprocess', success=True)
+    progress.close()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,365 @@
+import json
+import multiprocessing
+import os
+import shutil
+from functools import partial
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import lmdb
+import numpy as np
+import yaml
+from absl import app, flags
+from tqdm import tqdm
+from udls.generated import AudioExample
+
+import rave.audio
+import rave.codecs
+import rave.dataset
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string('db_path',
+                    None,
+                    help='Preprocessed dataset to resample',
+                    required=True)
+flags.DEFINE_integer('sampling_rate',
+                     None,
+                     help='Target sampling rate',
+                     required=True)
+flags.DEFINE_string('output_path',
+                    None,
+                    help='Output directory (default: a variant of db_path '
+                    'picked automatically when training at this rate)')
+flags.DEFINE_integer('max_db_size',
+                     100,
+                     help='Maximum size (in GB) of the dataset')
+
+# chunks resampled from a file, each with the [first, last) source chunks
+# of the file it overlaps
+Resampled = List[Tuple[bytes, int, int]]
+
+
+def resample_int16(audio: np.ndarray, sr_in: int, sr_out: int) -> np.ndarray:
+    audio = audio.astype(np.float32) / (2**15 - 1)
+    return rave.audio.float_to_int16(
+        rave.audio.resample_poly(audio, sr_in, sr_out))
+
+
+def resample_chunks(chunks: Sequence[np.ndarray], sr_in: int,
+                    sr_out: int) -> Iterable[Tuple[np.ndarray, int, int]]:
+    """
+    Resamples the chunks of a file as a single signal, so that no filter
+    transient appears at their boundaries, and splits it again into chunks
+    as long as the source ones. The trailing incomplete chunk is dropped,
+    as in preprocessing, unless the file would be left without any chunk,
+    in which case it is padded with silence.
+    """
+    lengths = [c.shape[-1] for c in chunks]
+    chunk_size = max(lengths)
+    audio = resample_int16(np.concatenate(chunks, -1), sr_in, sr_out)
+    if audio.shape[-1] < chunk_size:
+        audio = np.pad(audio, ((0, 0), (0, chunk_size - audio.shape[-1])))
+    bounds = np.cumsum([0] + lengths) * sr_out / sr_in
+    for start in range(0, audio.shape[-1] - chunk_size + 1, chunk_size):
+        first = np.searchsorted(bounds, start, 'right') - 1
+        last = np.searchsorted(bounds, start + chunk_size, 'left')
+        first = min(first, len(chunks) - 1)
+        yield (audio[:, start:start + chunk_size], first,
+               max(min(last, len(chunks)), first + 1))
+
+
+def decode_example(ae: AudioExample) -> Tuple[np.ndarray, str]:
+    buffer = ae.buffers['waveform']
+    if buffer.precision == AudioExample.Precision.RAW:
+        codec = buffer.format
+        audio = rave.codecs.get_codec(codec).decode(buffer.data)
+    else:
+        codec = 'pcm'
+        audio = np.frombuffer(buffer.data, dtype=np.int16)
+    return audio.reshape(buffer.shape[0], -1), codec
+
+
+def encode_example(audio: np.ndarray, sr: int, codec: str,
+                   metadata: Dict[str, str]) -> bytes:
+    buffer = AudioExample.AudioBuffer(
+        shape=audio.shape,
+        sampling_rate=sr,
+        data=rave.codecs.get_codec(codec).encode(audio, sr),
+        precision=AudioExample.Precision.INT16
+        if codec == 'pcm' else AudioExample.Precision.RAW,
+        format='' if codec == 'pcm' else codec,
+    )
+    return AudioExample(buffers={
+        'waveform': buffer
+    },
+                        metadata=metadata).SerializeToString()
+
+
+_envs = {}
+
+
+def get_env(path: str) -> lmdb.Environment:
+    # opened once per worker process
+    if path not in _envs:
+        _envs[path] = lmdb.open(path, lock=False, readonly=True)
+    return _envs[path]
+
+
+def resample_records(records: Sequence[Tuple[str, bytes]], sr_in: int,
+                     sr_out: int) -> Resampled:
+    """
+    Resamples the (database, key) records holding the chunks of a file.
+    """
+    values = []
+    for path, key in records:
+        with get_env(path).begin() as txn:
+            values.append(txn.get(key))
+    examples = [AudioExample.FromString(v) for v in values]
+    if any('waveform' not in ae.buffers for ae in examples):
+        # lazy records are decoded at training time
+        return [(v, i, i + 1) for i, v in enumerate(values)]
+    chunks, codecs = zip(*map(decode_example, examples))
+    return [(encode_example(x, sr_out, codecs[first],
+                            dict(examples[first].metadata)), first, last)
+            for x, first, last in resample_chunks(chunks, sr_in, sr_out)]
+
+
+def resample_rows(rows: Sequence[Tuple[int, int]], db_path: str,
+                  channels: int, sr_in: int, sr_out: int) -> Resampled:
+    """
+    Resamples the [start, stop) rows of a memmap dataset holding the chunks
+    of a file.
+    """
+    audio = np.memmap(os.path.join(db_path,
+                                   rave.dataset.MemmapAudioDataset.audio_file),
+                      dtype=np.int16,
+                      mode='r')
+    chunks = [np.array(audio[start:stop]).reshape(channels, -1)
+              for start, stop in rows]
+    return [(x.tobytes(), first, last)
+            for x, first, last in resample_chunks(chunks, sr_in, sr_out)]
+
+
+def resample_segment(segment: Tuple[int, int], db_path: str, channels: int,
+                     sr_in: int, sr_out: int) -> bytes:
+    """
+    Resamples the interleaved samples of a file of a windowed dataset.
+    """
+    start, stop = segment
+    audio = np.memmap(os.path.join(db_path,
+                                   rave.dataset.MemmapAudioDataset.audio_file),
+                      dtype=np.int16,
+                      mode='r',
+                      offset=start * 2,
+                      shape=(stop - start, ))
+    audio = resample_int16(audio.reshape(-1, channels).T, sr_in, sr_out)
+    return np.ascontiguousarray(audio.T).tobytes()
+
+
+def load_manifest_files(db_path: str) -> List[Dict]:
+    path = os.path.join(db_path, 'manifest.json')
+    if not os.path.exists(path):
+        print(f'[Warning] {db_path} has no manifest, its chunks are '
+              'resampled separately')
+        return []
+    with open(path, 'r') as f:
+        files = list(json.load(f)['files'].values())
+    # manifests of earlier versions hold a single range per file
+    for entry in files:
+        for name in ['keys', 'samples']:
+            if entry.get(name) and not isinstance(entry[name][0], list):
+                entry[name] = [entry[name]]
+    return files
+
+
+def group_chunks(n_chunks: int, files: Iterable[np.ndarray]) -> List[List[int]]:
+    """
+    Groups the indices of the chunks of a dataset by file, in dataset order.
+    Chunks of no known file form groups of their own.
+    """
+    groups, grouped = [], np.zeros(n_chunks, dtype=bool)
+    for indices in files:
+        indices = np.sort(indices[~grouped[indices]])
+        if len(indices):
+            grouped[indices] = True
+            groups.append(indices.tolist())
+    groups.extend([i] for i in np.flatnonzero(~grouped).tolist())
+    return sorted(groups, key=lambda g: g[0])
+
+
+def get_record_groups(
+        db_path: str,
+        metadata: Dict) -> Tuple[List[Tuple[str, bytes]], List[List[int]]]:
+    """
+    Lists the records of a database (of its shards) in dataset order, and
+    groups them by file from the manifests.
+    """
+    shards = metadata.get('shards') or []
+    if shards:
+        index = np.load(os.path.join(db_path, 'index.npy'))
+        parts = [(os.path.join(db_path, s), np.flatnonzero(index['shard'] == i))
+                 for i, s in enumerate(shards)]
+        keys = index['key']
+    else:
+        keys = rave.dataset.load_key_index(db_path)
+        if keys is None:
+            keys = rave.dataset.build_key_index(db_path, metadata['lazy'],
+                                                metadata['n_seconds'])
+        keys = keys['key']
+        parts = [(db_path, np.arange(len(keys)))]
+
+    records = [None] * len(keys)
+    files = []
+    for path, indices in parts:
+        part_keys = keys[indices]
+        for i, key in zip(indices, part_keys):
+            records[i] = (path, f'{key:08d}'.encode())
+        order = np.argsort(part_keys)
+        for entry in load_manifest_files(path) if len(order) else []:
+            file_keys = np.concatenate([np.arange(*r) for r in entry['keys']] +
+                                       [np.zeros(0, dtype=int)])
+            found = np.searchsorted(part_keys, file_keys, sorter=order)
+            found = order[np.minimum(found, len(order) - 1)]
+            files.append(indices[found[part_keys[found] == file_keys]])
+    return records, group_chunks(len(records), files)
+
+
+def get_row_groups(db_path: str,
+                   offsets: np.ndarray) -> List[List[int]]:
+    """
+    Groups the chunks of a memmap dataset by file from its manifest.
+    """
+    order = np.argsort(offsets[:, 0])
+    starts = offsets[order, 0]
+    files = []
+    for entry in load_manifest_files(db_path):
+        files.append(
+            np.concatenate([
+                order[np.searchsorted(starts, start):np.
+                      searchsorted(starts, stop)]
+                for start, stop in entry.get('samples', [])
+            ] + [np.zeros(0, dtype=int)]))
+    return group_chunks(len(offsets), files)
+
+
+def merge_stats(stats: np.ndarray, sources: Sequence[np.ndarray]) -> np.ndarray:
+    """
+    Statistics of resampled chunks, from the ones of the source chunks
+    they overlap.
+    """
+    merged = np.zeros(len(sources), dtype=rave.dataset.STATS_DTYPE)
+    merged['key'] = np.arange(len(sources))
+    for i, indices in enumerate(sources):
+        chunks = stats[indices]
+        merged[i]['peak'] = chunks['peak'].max()
+        merged[i]['rms'] = np.sqrt(np.mean(np.square(chunks['rms'])))
+        merged[i]['centroid'] = chunks['centroid'].mean()
+        merged[i]['silence'] = chunks['silence'].mean()
+    return merged
+
+
+def main(argv):
+    with open(os.path.join(FLAGS.db_path, 'metadata.yaml'), 'r') as f:
+        metadata = yaml.safe_load(f)
+    sr_in, sr_out = metadata.get('sr', 44100), FLAGS.sampling_rate
+    if sr_in == sr_out:
+        raise app.UsageError(f'{FLAGS.db_path} is already at {sr_out}Hz')
+    fingerprint = rave.dataset.get_source_fingerprint(FLAGS.db_path, metadata)
+
+    output_path = FLAGS.output_path or rave.dataset.get_variant_path(
+        FLAGS.db_path, sr_out)
+    if os.path.exists(output_path):
+        shutil.rmtree(output_path)
+    os.makedirs(output_path)
+
+    pool = multiprocessing.Pool()
+    channels = metadata['channels']
+    # source chunks of every output chunk, to carry their statistics over
+    sources = None
+
+    if metadata.get('format', 'lmdb') == 'memmap':
+        offsets = np.load(
+            os.path.join(FLAGS.db_path,
+                         rave.dataset.MemmapAudioDataset.offsets_file))
+        writer = rave.dataset.MemmapWriter(output_path)
+        new_offsets = []
+        if metadata.get('windowed'):
+            # segments already hold whole files
+            segments = pool.imap(partial(resample_segment,
+                                         db_path=FLAGS.db_path,
+                                         channels=channels,
+                                         sr_in=sr_in,
+                                         sr_out=sr_out),
+                                 map(tuple, offsets),
+                                 chunksize=4)
+            for segment in tqdm(segments, total=len(offsets)):
+                start = writer.position
+                writer.put(b'', segment)
+                new_offsets.append([start, writer.position])
+        else:
+            groups = get_row_groups(FLAGS.db_path, offsets)
+            resampled = pool.imap(
+                partial(resample_rows,
+                        db_path=FLAGS.db_path,
+                        channels=channels,
+                        sr_in=sr_in,
+                        sr_out=sr_out),
+                ([tuple(offsets[i]) for i in group] for group in groups))
+            sources = []
+            for group, chunks in zip(groups, tqdm(resampled,
+                                                  total=len(groups))):
+                for chunk, first, last in chunks:
+                    start = writer.position
+                    writer.put(b'', chunk)
+                    new_offsets.append([start, writer.position])
+                    sources.append(group[first:last])
+        writer.close()
+        writer.write_offsets(new_offsets)
+    else:
+        records, groups = get_record_groups(FLAGS.db_path, metadata)
+        env = lmdb.open(output_path, map_size=FLAGS.max_db_size * 1024**3)
+        writer = rave.dataset.LMDBWriter(env)
+        writer.start()
+        resampled = pool.imap(
+            partial(resample_records, sr_in=sr_in, sr_out=sr_out),
+            ([records[i] for i in group] for group in groups))
+        sources = []
+        for group, chunks in zip(groups, tqdm(resampled, total=len(groups))):
+            for example, first, last in chunks:
+                writer.put(f'{len(sources):08d}'.encode(), example)
+                sources.append(group[first:last])
+        writer.close()
+        env.close()
+    pool.close()
+    pool.join()
+
+    # resampling barely changes the levels of the chunks
+    stats = rave.dataset.load_stats(FLAGS.db_path)
+    if stats is not None and sources is None:
+        shutil.copy(os.path.join(FLAGS.db_path, rave.dataset.STATS_FILE),
+                    output_path)
+    elif stats is not None:
+        np.save(os.path.join(output_path, rave.dataset.STATS_FILE),
+                merge_stats(stats, sources))
+
+    # the copy is never sharded, and keeps track of the dataset it was made
+    # from to be discarded once outdated
+    metadata.pop('shards', None)
+    metadata['source'] = {
+        'path': os.path.abspath(FLAGS.db_path),
+        'sr': sr_in,
+        'channels': channels,
+        'n_seconds': metadata['n_seconds'],
+        'fingerprint': fingerprint,
+    }
+    metadata['sr'] = sr_out
+    with open(os.path.join(output_path, 'metadata.yaml'), 'w') as f:
+        yaml.safe_dump(metadata, f)
+    if metadata.get('format', 'lmdb') != 'memmap':
+        rave.dataset.write_key_index(output_path)
+    print(f'written {writer.n_items} records to {output_path} '
+          f'({writer.describe()})')
+
+
+if __name__ == '__main__':
+    app.run(main)
@@ -17,8 +17,10 @@ except:
     import rave
 
 import rave
+import rave.batch_transforms
 import rave.core
 import rave.dataset
+import rave.progress
 from rave.transforms import get_augmentations, add_augmentation
 
 
@@ -64,6 +66,9 @@ flags.DEFINE_bool('derivative',
 flags.DEFINE_bool('normalize',
                   default=False,
                   help='Train RAVE on normalized signals')
+flags.DEFINE_bool('weighted_sampling',
+                  default=False,
+                  help='Sample quiet and silent chunks less often')
 flags.DEFINE_list('rand_pitch',
                   default=None,
                   help='activates random pitch')
@@ -76,6 +81,7 @@ flags.DEFINE_bool('progress',
 flags.DEFINE_bool('smoke_test', 
                   default=False,
                   help="Run training with n_batches=1 to test the model")
+rave.progress.define_flags()
 
 
 class EMA(pl.Callback):
@@ -170,16 +176,38 @@ def main(argv):
                                        n_channels=n_channels)
     train, val = rave.dataset.split_dataset(dataset, 98)
 
+    # batch augmentations (see get_dataset.batch_augment)
+    collate_fn = None
+    batch_transform = getattr(dataset, 'batch_transform', None)
+    if batch_transform is not None:
+        if dataset.batch_augment == 'device':
+            model.batch_transform = batch_transform
+        else:
+            collate_fn = rave.batch_transforms.CollateTransform(
+                batch_transform)
+
     # get data-loader
     num_workers = FLAGS.workers
     if os.name == "nt" or sys.platform == "darwin":
         num_workers = 0
+    sampler = None
+    if FLAGS.weighted_sampling:
+        sampler = rave.dataset.get_weighted_sampler(train)
+        if sampler is None:
+            print('[Warning] no chunk statistics found in dataset, '
+                  'sampling uniformly')
     train = DataLoader(train,
                        FLAGS.batch,
-                       True,
+                       sampler is None,
+                       sampler=sampler,
                        drop_last=True,
-                       num_workers=num_workers)
-    val = DataLoader(val, FLAGS.batch, False, num_workers=num_workers)
+                       num_workers=num_workers,
+                       collate_fn=collate_fn)
+    val = DataLoader(val,
+                     FLAGS.batch,
+                     False,
+                     num_workers=num_workers,
+                     collate_fn=collate_fn)
 
     # CHECKPOINT CALLBACKS
     validation_checkpoint = pl.callbacks.ModelCheckpoint(monitor="validation",
@@ -239,6 +267,10 @@ def main(argv):
     if FLAGS.ema is not None:
         callbacks.append(EMA(FLAGS.ema))
 
+    progress = rave.progress.from_flags()
+    if progress.enabled:
+        callbacks.append(rave.core.ProgressCallback(progress))
+
     trainer = pl.Trainer(
         logger=pl.loggers.TensorBoardLogger(
             FLAGS.out_path,
@@ -16,8 +16,11 @@ except:
     import rave
 
 import rave
+import rave.batch_transforms
+import rave.core
 import rave.dataset
 import rave.prior
+import rave.progress
 
 FLAGS = flags.FLAGS
 
@@ -55,6 +58,7 @@ flags.DEFINE_bool('progress',
 flags.DEFINE_bool('smoke_test', 
                   default=False,
                   help="Run training with n_batches=1 to test the model")
+rave.progress.define_flags()
 
 def add_gin_extension(config_name: str) -> str:
     if config_name[-4:] != '.gin':
@@ -117,6 +121,12 @@ def main(argv):
 
     train, val = rave.dataset.split_dataset(dataset, 98)
 
+    # batch augmentations run in the workers, whatever get_dataset.batch_augment
+    collate_fn = None
+    if getattr(dataset, 'batch_transform', None) is not None:
+        collate_fn = rave.batch_transforms.CollateTransform(
+            dataset.batch_transform)
+
     # get data-loader
     num_workers = FLAGS.workers
     if os.name == "nt" or sys.platform == "darwin":
@@ -125,8 +135,13 @@ def main(argv):
                        FLAGS.batch,
                        True,
                        drop_last=True,
-                       num_workers=num_workers)
-    val = DataLoader(val, FLAGS.batch, False, num_workers=num_workers)
+                       num_workers=num_workers,
+                       collate_fn=collate_fn)
+    val = DataLoader(val,
+                     FLAGS.batch,
+                     False,
+                     num_workers=num_workers,
+                     collate_fn=collate_fn)
 
     # CHECKPOINT CALLBACKS
     validation_checkpoint = pl.callbacks.ModelCheckpoint(monitor="validation",
@@ -178,6 +193,10 @@ def main(argv):
         last_checkpoint,
     ]
 
+    progress = rave.progress.from_flags()
+    if progress.enabled:
+        callbacks.append(rave.core.ProgressCallback(progress))
+
     trainer = pl.Trainer(
         logger=pl.loggers.TensorBoardLogger(
             FLAGS.out_path,
@@ -0,0 +1,15 @@
+import sys
+
+import pytest
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    """
+    Keeps the caches written by the tests (e.g. probe results) out of the
+    user cache directory.
+    """
+    monkeypatch.setenv('RAVE_CACHE_DIR', str(tmp_path / 'cache'))
+    if 'rave.audio' in sys.modules:
+        monkeypatch.setattr(sys.modules['rave.audio'], '_probe_cache', None)
+    return tmp_path / 'cache'
@@ -0,0 +1,236 @@
+import os
+import numpy as np
+import pytest
+
+from rave.audio import (AutoDecoder, SegmentCache, SoundfileDecoder,
+                        TranscodeCache, get_channel_map, load_audio_chunks)
+
+sf = pytest.importorskip("soundfile")
+
+
+@pytest.mark.parametrize("input_channels,channels", [(1, 1), (1, 2), (2, 1),
+                                                     (3, 8)])
+def test_load_audio_chunks(tmp_path, input_channels, channels):
+    n_signal = 1024
+    x = np.random.uniform(-.5, .5, (5 * n_signal + 100, input_channels))
+    path = str(tmp_path / "audio.wav")
+    sf.write(path, x, 16000, subtype="PCM_16")
+
+    chunks = list(
+        load_audio_chunks(path, n_signal, 16000, channels, "soundfile"))
+    assert len(chunks) == 5
+    assert all(c.shape == (channels, n_signal) for c in chunks)
+    assert all(c.dtype == np.int16 for c in chunks)
+
+    reference = sf.read(path, dtype="int16", always_2d=True)[0].T
+    channel_map = get_channel_map(input_channels, channels)
+    np.testing.assert_array_equal(chunks[1], reference[channel_map,
+                                                       n_signal:2 * n_signal])
+
+
+def test_load_audio_chunks_resampled(tmp_path):
+    path = str(tmp_path / "audio.wav")
+    sf.write(path, np.zeros((48000, 2)), 48000)
+    chunks = list(load_audio_chunks(path, 4410, 44100, 2, "soundfile"))
+    assert len(chunks) == 10
+
+
+@pytest.mark.parametrize("sr", [16000, 44100])
+def test_decoder_read(tmp_path, monkeypatch, sr):
+    monkeypatch.setenv("RAVE_CACHE_DIR", str(tmp_path / "cache"))
+    path = str(tmp_path / "audio.wav")
+    sf.write(path, np.random.uniform(-.5, .5, (16000 * 3, 2)), 16000)
+
+    decoder = SoundfileDecoder()
+    reference = np.concatenate(list(decoder.decode(path, sr, 4096)), -1)
+    for start, n_samples in [(0, 1000), (12345, 5000), (len(reference[0]) -
+                                                        100, 1000)]:
+        x = decoder.read(path, sr, start, n_samples)
+        np.testing.assert_allclose(x,
+                                   reference[:, start:start + n_samples],
+                                   atol=1)
+    assert decoder.read(path, sr, 10**6, 100).shape == (2, 0)
+
+
+def test_auto_decoder(tmp_path, monkeypatch):
+    path = str(tmp_path / "audio.wav")
+    sf.write(path, np.random.uniform(-.5, .5, 10000), 16000, subtype="PCM_16")
+    unsupported = str(tmp_path / "audio.xyz")
+    with open(unsupported, "wb") as f:
+        f.write(b"not a soundfile format")
+
+    decoder = AutoDecoder()
+    ffmpeg_reads = []
+    monkeypatch.setattr(
+        decoder.ffmpeg, "read", lambda *args: ffmpeg_reads.append(args[0]) or
+        np.zeros((1, args[-1]), dtype=np.int16))
+    monkeypatch.setattr(decoder.ffmpeg, "decode",
+                        lambda *args: iter([np.zeros((1, 10), np.int16)]))
+
+    reference = sf.read(path, dtype="int16", always_2d=True)[0].T
+    np.testing.assert_array_equal(decoder.read(path, 16000, 1500, 2000),
+                                  reference[:, 1500:3500])
+    np.testing.assert_array_equal(
+        np.concatenate(list(decoder.decode(path, 16000, 4096)), -1),
+        reference)
+    assert ffmpeg_reads == []
+
+    # files libsndfile cannot read go through ffmpeg, which is remembered
+    assert decoder.read(unsupported, 16000, 0, 100).shape == (1, 100)
+    assert decoder.read(unsupported, 16000, 100, 100).shape == (1, 100)
+    assert ffmpeg_reads == [unsupported] * 2
+    assert unsupported in decoder._unsupported
+    assert len(list(decoder.decode(unsupported, 16000, 4096))) == 1
+
+
+def test_segment_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("RAVE_CACHE_DIR", str(tmp_path / "cache"))
+    path = str(tmp_path / "audio.wav")
+    sf.write(path, np.random.uniform(-.5, .5, 10000), 16000, subtype="PCM_16")
+    reference = sf.read(path, dtype="int16", always_2d=True)[0].T
+
+    cache = SegmentCache("soundfile", 16000, block_size=1000,
+                         max_bytes=2 * 2000)
+    np.testing.assert_array_equal(cache.read(path, 1500, 2000),
+                                  reference[:, 1500:3500])
+    assert (cache.hits, cache.misses) == (0, 3)
+    np.testing.assert_array_equal(cache.read(path, 2000, 2000),
+                                  reference[:, 2000:4000])
+    assert (cache.hits, cache.misses) == (2, 3)
+    # least recently used blocks are evicted
+    assert cache.n_bytes <= 2 * 2000 and (path, 1) not in cache._blocks
+    np.testing.assert_array_equal(cache.read(path, 9500, 2000),
+                                  reference[:, 9500:])
+
+
+def test_transcode_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv("RAVE_CACHE_DIR", str(tmp_path / "cache"))
+    paths = []
+    for i in range(3):
+        paths.append(str(tmp_path / f"{i}.wav"))
+        sf.write(paths[-1], np.random.uniform(-.5, .5, (8000, 2)), 16000)
+    decoder = SoundfileDecoder()
+    reference = np.concatenate(list(decoder.decode(paths[0], 8000, 4096)), -1)
+
+    n_decoded = []
+    decode = decoder.decode
+    decoder.decode = lambda *args: n_decoded.append(args) or decode(*args)
+    # budget of two transcoded files
+    cache = TranscodeCache(str(tmp_path / "pcm"), decoder, 2 * 4000 * 2 * 2)
+    for _ in range(2):
+        np.testing.assert_array_equal(cache.read(paths[0], 8000, 100, 500),
+                                      reference[:, 100:600])
+    assert len(n_decoded) == 1
+
+    # other processes reuse the transcoded files
+    other = TranscodeCache(str(tmp_path / "pcm"), decoder, 2 * 4000 * 2 * 2)
+    np.testing.assert_array_equal(
+        np.concatenate(list(other.decode(paths[0], 8000, 1000)), -1),
+        reference)
+    assert len(n_decoded) == 1
+
+    # least recently used files are evicted
+    os.utime(cache.get_path(paths[0], 8000, 2), (0, 0))
+    cache.read(paths[1], 8000, 0, 10)
+    cache.read(paths[2], 8000, 0, 10)
+    assert len(os.listdir(tmp_path / "pcm")) == 2
+    assert not os.path.exists(cache.get_path(paths[0], 8000, 2))
+    # modified files are transcoded again
+    sf.write(paths[1], np.zeros((100, 2)), 16000)
+    assert cache.read(paths[1], 8000, 0, 1000).shape == (2, 50)
+
+
+def test_probe_cache(tmp_path, monkeypatch):
+    from rave import audio
+
+    path = str(tmp_path / "audio.wav")
+    sf.write(path, np.zeros((22050, 3)), 22050)
+
+    cache = audio.ProbeCache(str(tmp_path / "cache"))
+    assert cache.get(path) is None
+    info = cache.probe(path)
+    assert info.channels == 3
+    assert info.sr == 22050
+    assert info.duration == pytest.approx(1.)
+
+    calls = []
+    monkeypatch.setattr(audio, "probe_audio",
+                        lambda p: calls.append(p) or info)
+    assert cache.probe(path) == info
+    assert calls == []
+
+    # modified files are probed again
+    sf.write(path, np.zeros((44100, 1)), 44100)
+    assert cache.get(path) is None
+
+
+@pytest.mark.parametrize("archive_name", ["audio.tar", "audio.tar.gz",
+                                          "audio.zip"])
+def test_archive_members(tmp_path, monkeypatch, archive_name):
+    import tarfile
+    import zipfile
+
+    from rave import audio
+
+    monkeypatch.setattr(audio, "_probe_cache",
+                        audio.ProbeCache(str(tmp_path / "cache")))
+    x = np.random.uniform(-.5, .5, (3000, 2))
+    sf.write(tmp_path / "a.wav", x, 16000, subtype="PCM_16")
+    (tmp_path / "notes.txt").write_text("not audio")
+
+    archive = str(tmp_path / archive_name)
+    if archive_name.endswith(".zip"):
+        with zipfile.ZipFile(archive, "w") as f:
+            f.write(tmp_path / "a.wav", "sub/a.wav")
+            f.write(tmp_path / "notes.txt", "notes.txt")
+    else:
+        with tarfile.open(archive, "w:gz" if archive.endswith("gz") else "w") as f:
+            f.add(tmp_path / "a.wav", "sub/a.wav")
+            f.add(tmp_path / "notes.txt", "notes.txt")
+
+    assert audio.is_archive(archive)
+    members = audio.list_archive(archive, ["wav"])
+    assert members == [archive + "::sub/a.wav"]
+
+    info = audio.probe(members[0])
+    assert (info.channels, info.sr) == (2, 16000)
+    assert audio.get_signature(members[0])["size"] == os.path.getsize(
+        tmp_path / "a.wav")
+
+    chunks = list(load_audio_chunks(members[0], 1000, 16000, 2, "soundfile"))
+    reference = list(
+        load_audio_chunks(str(tmp_path / "a.wav"), 1000, 16000, 2,
+                          "soundfile"))
+    assert len(chunks) == 3
+    np.testing.assert_array_equal(np.stack(chunks), np.stack(reference))
+
+
+def test_find_audio_files(tmp_path):
+    import zipfile
+
+    from rave.audio import find_audio_files
+
+    for name in ["a.wav", "b.WAV", "sub/c.Flac", "sub/deep/d.mp3",
+                 "sub/notes.txt", "other/e.ogg"]:
+        (tmp_path / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / name).write_bytes(b"")
+    with zipfile.ZipFile(tmp_path / "sub" / "more.ZIP", "w") as f:
+        f.writestr("f.wav", b"")
+
+    found = find_audio_files([str(tmp_path)], ["wav", "flac", "mp3"])
+    assert sorted(found) == sorted([
+        str(tmp_path / "a.wav"),
+        str(tmp_path / "b.WAV"),
+        str(tmp_path / "sub" / "c.Flac"),
+        str(tmp_path / "sub" / "deep" / "d.mp3"),
+        str(tmp_path / "sub" / "more.ZIP") + "::f.wav",
+    ])
+    assert len(found) == len(set(found))
+
+    found = find_audio_files([str(tmp_path / "sub")], [".flac", ".wav"],
+                             archives=False)
+    assert found == [str(tmp_path / "sub" / "c.Flac")]
+
+    assert find_audio_files([str(tmp_path / "a.wav")]) == [
+        str(tmp_path / "a.wav")
+    ]
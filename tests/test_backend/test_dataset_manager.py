@@ -237,3 +237,59 @@ def test_create_dataset_with_defaults(dataset_manager):
         # Check defaults
         assert dataset['channels'] == 1
         assert dataset['sample_rate'] == 44100
+
+
+def test_scan_audio_files(tmp_path, monkeypatch):
+    """Test scanning a folder of audio files through the probe cache."""
+    np = pytest.importorskip("numpy")
+    sf = pytest.importorskip("soundfile")
+    from rave import audio
+    
+    cache = audio.ProbeCache(str(tmp_path / "cache"))
+    monkeypatch.setattr(audio, "_probe_cache", cache)
+    
+    (tmp_path / "input" / "sub").mkdir(parents=True)
+    sf.write(tmp_path / "input" / "a.wav", np.zeros((44100, 2)), 44100)
+    sf.write(tmp_path / "input" / "sub" / "b.WAV", np.zeros(24000), 48000)
+    (tmp_path / "input" / "broken.wav").write_bytes(b"not audio")
+    (tmp_path / "input" / "notes.txt").write_text("not audio")
+    
+    stats = DatasetManager.scan_audio_files(tmp_path / "input")
+    
+    assert stats['num_files'] == 3
+    assert stats['num_failed'] == 1
+    assert stats['duration_seconds'] == pytest.approx(1.5)
+    assert stats['max_channels'] == 2
+    assert stats['sample_rates'] == [44100, 48000]
+    assert cache.get(str(tmp_path / "input" / "a.wav")).channels == 2
+    
+    # an interrupted scan stops probing files
+    stats = DatasetManager.scan_audio_files(tmp_path / "input",
+                                            interrupted=lambda: True)
+    assert stats['num_files'] == 3
+    assert stats['duration_seconds'] == 0
+
+
+def test_get_dataset_stats_with_chunk_stats(dataset_manager, tmp_path):
+    """Test that chunk statistics stored by preprocess are summarized."""
+    np = pytest.importorskip("numpy")
+    from rave.dataset import STATS_DTYPE
+    
+    chunks = np.zeros(4, dtype=STATS_DTYPE)
+    chunks['peak'] = [.1, .2, .9, .3]
+    chunks['rms'] = .1
+    chunks['centroid'] = [500, 1000, 1500, 2000]
+    chunks['silence'] = [0, 0, 0, 1]
+    np.save(tmp_path / "stats.npy", chunks)
+    
+    dataset_id = dataset_manager.create_dataset({
+        'name': 'Test Dataset',
+        'path': tmp_path
+    })
+    stats = dataset_manager.get_dataset_stats(dataset_id)
+    
+    assert stats['num_chunks'] == 4
+    assert stats['peak'] == pytest.approx(.9)
+    assert stats['rms_db'] == pytest.approx(-20)
+    assert stats['centroid'] == pytest.approx(1250)
+    assert stats['silence_ratio'] == pytest.approx(.25)
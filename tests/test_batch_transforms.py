@@ -0,0 +1,108 @@
+import numpy as np
+import pytest
+import torch
+from scipy.signal import lfilter
+
+from rave import batch_transforms, transforms
+from rave.dataset import get_dataset, normalize_signal
+from rave.filters import pole_to_z_filter
+
+
+def test_random_crop():
+    x = torch.arange(40.).reshape(1, 1, 40).repeat(16, 2, 1)
+    y = batch_transforms.RandomCrop(8)(x)
+    assert y.shape == (16, 2, 8)
+    # every example is a contiguous window, shared by its channels
+    assert torch.equal(y[..., 1:] - y[..., :-1], torch.ones(16, 2, 7))
+    assert torch.equal(y[:, 0], y[:, 1])
+    assert len(set(y[:, 0, 0].tolist())) > 1
+
+
+def test_random_pitch():
+    torch.manual_seed(0)
+    x = torch.randn(32, 2, 2048)
+    y = batch_transforms.RandomPitch(1024, [.7, 1.3], prob=.5)(x)
+    assert y.shape == (32, 2, 1024)
+    # unpitched examples are plain crops of the input
+    cropped = [
+        any(
+            torch.equal(y[i], x[i, :, j:j + 1024])
+            for j in range(0, 1025)) for i in range(4)
+    ]
+    assert any(cropped)
+
+
+def test_biquad():
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((4, 2, 500))
+    coefficients = [pole_to_z_filter(w, .99) for w in rng.uniform(.01, 1, 4)]
+    b = torch.tensor([c[0] for c in coefficients])
+    a = torch.tensor([c[1] for c in coefficients])
+    y = batch_transforms.biquad(torch.from_numpy(x), b, a)
+    for i, (b_i, a_i) in enumerate(coefficients):
+        np.testing.assert_allclose(y[i], lfilter(b_i, a_i, x[i]), atol=1e-8)
+
+
+def test_phase_mangle():
+    x = torch.randn(8, 1, 4096, dtype=torch.float64)
+    y = batch_transforms.PhaseMangle(20, 2000, .99, 44100)(x)
+    assert y.shape == x.shape and not torch.allclose(x, y)
+
+
+def test_filter():
+    x = np.random.randn(3, 2, 100)
+    y = batch_transforms.Filter([.5, -.5], [1])(torch.from_numpy(x))
+    np.testing.assert_allclose(y, lfilter([.5, -.5], [1], x), atol=1e-10)
+
+
+def test_normalize():
+    x = torch.randn(3, 2, 100) * torch.tensor([.1, .0001, 0])[:, None, None]
+    y = batch_transforms.Normalize()(x)
+    for i in range(3):
+        np.testing.assert_allclose(y[i],
+                                   normalize_signal(x[i].numpy()),
+                                   rtol=1e-5)
+
+
+def test_random_apply():
+    x = torch.zeros(1000, 1, 4)
+    y = batch_transforms.RandomApply(lambda x: x + 1, p=.3)(x)
+    assert x.abs().sum() == 0
+    assert .2 < y[:, 0, 0].mean() < .4
+
+
+def test_gain_and_mute():
+    x = torch.full((100, 1, 10), .5)
+    y = batch_transforms.RandomGain([-6, 3], prob=1.)(x)
+    assert y.abs().max() <= 1 and not torch.allclose(y, x)
+    y = batch_transforms.RandomMute(.5)(x)
+    assert set(y[:, 0, 0].tolist()) == {0., .5}
+
+    # the per item counterpart applies its gain as well
+    x = np.full((1, 10), .5)
+    y = transforms.RandomGain([-6, -3], prob=1.)(x)
+    assert np.all(y < .5 * 10**(-3 / 20) + 1e-6) and np.all(y > .25)
+
+
+@pytest.mark.parametrize("batch_augment", ["worker", "device"])
+def test_get_dataset(tmp_path, batch_augment):
+    from tests.test_dataset import make_chunks, write_database
+    write_database(tmp_path, make_chunks(8, n_signal=512), sr=16000)
+    dataset = get_dataset(str(tmp_path),
+                          8000,
+                          128,
+                          derivative=True,
+                          batch_augment=batch_augment)
+    assert dataset.batch_augment == batch_augment
+    assert dataset[0].shape == (1, 512)
+
+    loader = torch.utils.data.DataLoader(
+        dataset,
+        4,
+        collate_fn=batch_transforms.CollateTransform(dataset.batch_transform))
+    batch = next(iter(loader))
+    # cropped, then resampled to 8kHz
+    assert batch.shape == (4, 1, 64) and batch.dtype == torch.float32
+
+    with pytest.raises(ValueError):
+        get_dataset(str(tmp_path), 16000, 128, batch_augment='gpu')
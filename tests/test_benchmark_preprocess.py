@@ -0,0 +1,38 @@
+import os
+
+import soundfile as sf
+
+from scripts import benchmark_preprocess
+
+
+def test_make_corpus(tmp_path):
+    corpus = benchmark_preprocess.Corpus(4, 1.5, 2, [16000, 48000])
+    benchmark_preprocess.make_corpus(str(tmp_path), corpus, scale=.5)
+
+    files = sorted(f for f in os.listdir(tmp_path) if f.endswith('.wav'))
+    assert files == ['00000.wav', '00001.wav']
+    infos = [sf.info(str(tmp_path / f)) for f in files]
+    assert [i.samplerate for i in infos] == [16000, 48000]
+    assert all(i.channels == 2 and abs(i.duration - 1.5) < 1e-3
+               for i in infos)
+
+    # completed corpora are reused as is
+    os.remove(tmp_path / files[0])
+    benchmark_preprocess.make_corpus(str(tmp_path), corpus, scale=.5)
+    assert not os.path.exists(tmp_path / files[0])
+
+
+def test_run_benchmark(tmp_path):
+    results = benchmark_preprocess.run_benchmark(
+        str(tmp_path), ['multichannel'], ['full'],
+        scale=.05,
+        extra_flags=['--decoder=soundfile', '--channels=2'])
+
+    run, = results['runs']
+    assert (run['corpus'], run['mode']) == ('multichannel', 'full')
+    assert run['files'] == 1
+    assert run['bytes'] > 0 and run['audio_seconds'] > 0
+    assert set(run['stages']) == {
+        'discover', 'probe', 'decode', 'serialize', 'commit'
+    }
+    assert run['stages']['decode'] > 0
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from rave.codecs import CODECS, get_codec
+
+
+@pytest.mark.parametrize("name", list(CODECS))
+@pytest.mark.parametrize("channels", [1, 2])
+def test_codec_roundtrip(name, channels):
+    if name == 'zstd':
+        pytest.importorskip('zstandard')
+    codec = get_codec(name)
+    rng = np.random.default_rng(0)
+    x = rng.integers(-2**15, 2**15, (channels, 4096)).astype(np.int16)
+    x[:, :10] = [-2**15, 2**15 - 1] * 5
+
+    y = codec.decode(codec.encode(x, 44100))
+    assert y.dtype == np.int16
+    np.testing.assert_array_equal(y, x.reshape(-1))
+
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        get_codec('mp3')
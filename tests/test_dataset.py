@@ -0,0 +1,290 @@
+import os
+
+import lmdb
+import numpy as np
+import pytest
+import torch
+import yaml
+from udls.generated import AudioExample
+
+from rave.codecs import get_codec
+from rave.dataset import (KEY_INDEX_FILE, STATS_DTYPE, AudioDataset,
+                          LazyAudioDataset, get_chunk_weights,
+                          get_source_fingerprint, get_variant,
+                          get_variant_path, get_weighted_sampler,
+                          load_key_index, write_key_index, write_shard_index)
+
+
+def write_database(path,
+                   chunks,
+                   sr=16000,
+                   channels=1,
+                   start_key=0,
+                   codec='pcm'):
+    env = lmdb.open(str(path), map_size=2**26)
+    with env.begin(write=True) as txn:
+        for i, chunk in enumerate(chunks):
+            if codec == 'pcm':
+                buffer = AudioExample.AudioBuffer(
+                    shape=chunk.shape,
+                    sampling_rate=sr,
+                    data=chunk.tobytes(),
+                    precision=AudioExample.Precision.INT16,
+                )
+            else:
+                buffer = AudioExample.AudioBuffer(
+                    shape=chunk.shape,
+                    sampling_rate=sr,
+                    data=get_codec(codec).encode(chunk, sr),
+                    precision=AudioExample.Precision.RAW,
+                    format=codec,
+                )
+            ae = AudioExample(buffers={'waveform': buffer})
+            txn.put(f'{start_key + i:08d}'.encode(), ae.SerializeToString())
+    env.close()
+    with open(os.path.join(path, 'metadata.yaml'), 'w') as f:
+        yaml.safe_dump(
+            {
+                'lazy': False,
+                'channels': channels,
+                'sr': sr,
+                'n_seconds': len(chunks) * chunks[0].shape[-1] / sr,
+            }, f)
+
+
+def make_chunks(n, offset=0, n_signal=256, channels=1):
+    return [
+        np.full((channels, n_signal), offset + i, dtype=np.int16)
+        for i in range(n)
+    ]
+
+
+def test_sharded_dataset(tmp_path):
+    write_database(tmp_path / 'a_0000', make_chunks(3, 0))
+    write_database(tmp_path / 'a_0001', make_chunks(2, 10), start_key=5)
+    write_database(tmp_path / 'b_0000', make_chunks(4, 20))
+
+    metadata = write_shard_index(str(tmp_path))
+    assert metadata['shards'] == ['a_0000', 'a_0001', 'b_0000']
+    assert metadata['n_seconds'] == pytest.approx(9 * 256 / 16000)
+
+    dataset = AudioDataset(str(tmp_path), shards=metadata['shards'])
+    assert len(dataset) == 9
+    values = [int(np.round(dataset[i][0, 0] * (2**15 - 1))) for i in range(9)]
+    assert values == [0, 1, 2, 10, 11, 20, 21, 22, 23]
+
+
+def test_key_index(tmp_path):
+    write_database(tmp_path, make_chunks(3, 0), start_key=4)
+    assert load_key_index(str(tmp_path)) is None
+
+    index = write_key_index(str(tmp_path))
+    assert index['key'].tolist() == [4, 5, 6]
+    np.testing.assert_allclose(index['length'], 256 / 16000)
+
+    dataset = AudioDataset(str(tmp_path))
+    assert dataset._key_index is not None
+    values = [int(np.round(dataset[i][0, 0] * (2**15 - 1))) for i in range(3)]
+    assert values == [0, 1, 2]
+    assert dataset._keys is None
+
+    # an index older than the database is ignored
+    dataset.env.close()
+    env = lmdb.open(str(tmp_path))
+    with env.begin(write=True) as txn:
+        txn.delete(b'00000005')
+    env.close()
+    mtime = os.path.getmtime(tmp_path / KEY_INDEX_FILE)
+    os.utime(tmp_path / 'data.mdb', (mtime + 1, mtime + 1))
+    assert load_key_index(str(tmp_path)) is None
+    assert len(AudioDataset(str(tmp_path))) == 2
+
+
+@pytest.mark.parametrize("indexed", [False, True])
+def test_dataset_workers(tmp_path, indexed):
+    import pickle
+    write_database(tmp_path, make_chunks(8))
+    if indexed:
+        write_key_index(str(tmp_path))
+    dataset = AudioDataset(str(tmp_path))
+    # the parent opens the environment before the workers are forked
+    assert dataset[3][0, 0] == pytest.approx(3 / (2**15 - 1))
+    if not indexed:
+        assert dataset.keys.dtype == np.dtype('S8')
+
+    loader = torch.utils.data.DataLoader(dataset,
+                                         batch_size=2,
+                                         num_workers=2,
+                                         multiprocessing_context='fork')
+    values = torch.cat([batch[:, 0, 0] for batch in loader])
+    np.testing.assert_allclose(values * (2**15 - 1), np.arange(8), atol=1e-3)
+
+    copy = pickle.loads(pickle.dumps(dataset))
+    assert copy._env is None
+    dataset.close()
+    assert copy[5][0, 0] == pytest.approx(5 / (2**15 - 1))
+
+
+def test_lazy_key_index(tmp_path):
+    env = lmdb.open(str(tmp_path), map_size=2**26)
+    with env.begin(write=True) as txn:
+        for i, length in enumerate([1., 2.5, .2]):
+            ae = AudioExample(metadata={'path': f'{i}.wav',
+                                        'length': str(length)})
+            txn.put(f'{i:08d}'.encode(), ae.SerializeToString())
+    env.close()
+    with open(os.path.join(tmp_path, 'metadata.yaml'), 'w') as f:
+        yaml.safe_dump({'lazy': True, 'channels': 1, 'n_seconds': 3.7}, f)
+
+    # the first load scans the database and saves its index
+    scanned = LazyAudioDataset(str(tmp_path), 1000, 4000)
+    assert os.path.exists(os.path.join(tmp_path, KEY_INDEX_FILE))
+    indexed = LazyAudioDataset(str(tmp_path), 1000, 4000)
+    assert indexed.items.tolist() == scanned.items.tolist() == [4, 14, 14]
+    assert indexed.get_key(1) == scanned.get_key(1) == b'00000001'
+    assert len(indexed) == 14
+
+    # items are looked up by binary search, skipping files with no item
+    paths = []
+    indexed.cache.read = lambda path, start, n: paths.append(
+        (path, start)) or np.zeros((1, 0), dtype=np.int16)
+    for i in [0, 3, 4, 13]:
+        indexed[i]
+    assert paths == [('0.wav', 0), ('0.wav', 3000), ('1.wav', 0),
+                     ('1.wav', 9000)]
+
+
+@pytest.mark.parametrize("transcode", [False, True])
+def test_lazy_dataset(tmp_path, monkeypatch, transcode):
+    sf = pytest.importorskip('soundfile')
+    monkeypatch.setenv('RAVE_CACHE_DIR', str(tmp_path / 'cache'))
+    path = str(tmp_path / 'audio.wav')
+    sf.write(path, np.random.uniform(-.5, .5, 5000), 4000, subtype='PCM_16')
+    reference = sf.read(path, dtype='int16')[0] / 2**15
+
+    db_path = tmp_path / 'db'
+    env = lmdb.open(str(db_path), map_size=2**26)
+    with env.begin(write=True) as txn:
+        ae = AudioExample(metadata={'path': path, 'length': '1.25'})
+        txn.put(b'00000000', ae.SerializeToString())
+    env.close()
+
+    dataset = LazyAudioDataset(str(db_path),
+                               1000,
+                               4000,
+                               n_channels=2,
+                               decoder='soundfile',
+                               transcode_dir=str(tmp_path / 'pcm')
+                               if transcode else None)
+    assert len(dataset) == 5
+    for i in [0, 1, 4]:
+        item = dataset[i]
+        assert item.shape == (2, 2000)
+        expected = reference[i * 1000:(i + 2) * 1000]
+        np.testing.assert_allclose(item[1, :len(expected)], expected)
+    # the last item is padded with zeros
+    assert not item[:, 1000:].any()
+    if transcode:
+        assert len(os.listdir(tmp_path / 'pcm')) == 1
+    else:
+        assert dataset.cache.hits > 0
+
+
+def test_incompatible_shards(tmp_path):
+    write_database(tmp_path / 'shard_0000', make_chunks(2), sr=16000)
+    write_database(tmp_path / 'shard_0001', make_chunks(2), sr=44100)
+    with pytest.raises(RuntimeError):
+        write_shard_index(str(tmp_path))
+
+
+@pytest.mark.parametrize("codec", ["pcm", "flac", "zstd"])
+def test_compressed_dataset(tmp_path, codec):
+    if codec == 'zstd':
+        pytest.importorskip('zstandard')
+    rng = np.random.default_rng(0)
+    chunks = [
+        rng.integers(-2**15, 2**15, (2, 256)).astype(np.int16)
+        for _ in range(3)
+    ]
+    write_database(tmp_path, chunks, channels=2, codec=codec)
+
+    dataset = AudioDataset(str(tmp_path), n_channels=2)
+    for chunk, item in zip(chunks, dataset):
+        np.testing.assert_allclose(item, chunk / (2**15 - 1), rtol=1e-6)
+
+
+def test_get_variant(tmp_path):
+    metadata = {'lazy': False, 'channels': 1, 'sr': 48000, 'n_seconds': 10.}
+    assert get_variant(str(tmp_path), metadata, 44100) is None
+
+    variant_path = get_variant_path(str(tmp_path), 44100)
+    os.makedirs(variant_path)
+    write_database(variant_path, make_chunks(4), sr=44100)
+    with open(os.path.join(variant_path, 'metadata.yaml'), 'r') as f:
+        variant = yaml.safe_load(f)
+    with open(tmp_path / 'manifest.json', 'w') as f:
+        f.write('{"files": {}}')
+    variant['source'] = {
+        'path': str(tmp_path),
+        'sr': 48000,
+        'channels': 1,
+        'n_seconds': 10.,
+        'fingerprint': get_source_fingerprint(str(tmp_path), metadata),
+    }
+    with open(os.path.join(variant_path, 'metadata.yaml'), 'w') as f:
+        yaml.safe_dump(variant, f)
+
+    path, variant = get_variant(str(tmp_path), metadata, 44100)
+    assert path == variant_path and variant['sr'] == 44100
+    assert get_variant(str(tmp_path), metadata, 22050) is None
+    # the dataset changed since it was resampled
+    for changes in [{'n_seconds': 12.}, {'sr': 44100}, {'channels': 2}]:
+        assert get_variant(str(tmp_path), dict(metadata, **changes),
+                           44100) is None
+    with open(tmp_path / 'manifest.json', 'w') as f:
+        f.write('{"files": {"a.wav": {}}}')
+    assert get_variant(str(tmp_path), metadata, 44100) is None
+
+
+def make_stats(rms, silence):
+    stats = np.zeros(len(rms), dtype=STATS_DTYPE)
+    stats['key'] = np.arange(len(rms))
+    stats['peak'] = .5
+    stats['rms'] = rms
+    stats['silence'] = silence
+    return stats
+
+
+def test_chunk_weights():
+    stats = make_stats([0., 1e-4, .01, .1, .1], [1., 0., 0., 0., .5])
+    weights = get_chunk_weights(stats, min_db=-60., max_db=-20.)
+    np.testing.assert_allclose(weights, [.05, .05, .5, 1., .5], rtol=1e-6)
+
+
+def test_weighted_sampler(tmp_path):
+    write_database(tmp_path, make_chunks(4))
+    stats = make_stats([0., .1, .1, .1], [0., 0., 0., 0.])
+
+    dataset = AudioDataset(str(tmp_path), stats=stats)
+    assert get_weighted_sampler(AudioDataset(str(tmp_path))) is None
+    subset = torch.utils.data.Subset(dataset, [3, 0])
+    sampler = get_weighted_sampler(subset)
+    assert len(sampler) == 2
+    np.testing.assert_allclose(sampler.weights.numpy(), [1., .05])
+
+
+    # mismatching statistics are ignored
+    write_database(tmp_path / 'other', make_chunks(3))
+    assert AudioDataset(str(tmp_path / 'other'), stats=stats).stats is None
+
+
+def test_normalize_from_stats(tmp_path):
+    write_database(tmp_path, make_chunks(2, offset=100))
+    stats = make_stats([.1, .1], [0., 0.])
+    stats['peak'] = [.01, 0.]
+
+    dataset = AudioDataset(str(tmp_path), stats=stats, normalize=True)
+    # the stored peak is used instead of the actual one
+    np.testing.assert_allclose(dataset[0], 100 / (2**15 - 1) * 10**1.5,
+                               rtol=1e-5)
+    np.testing.assert_allclose(dataset[1], 101 / (2**15 - 1), rtol=1e-5)
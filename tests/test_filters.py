@@ -0,0 +1,83 @@
+import random
+
+import numpy as np
+import pytest
+from scipy.signal import lfilter
+
+from rave import filters
+from rave.dataset import get_derivator_integrator
+
+
+def random_coefficients(rng, n):
+    coefficients = [
+        filters.pole_to_z_filter(w, .99) for w in rng.uniform(.01, 3, n)
+    ]
+    b = np.array([c[0] for c in coefficients])
+    a = np.array([c[1] for c in coefficients])
+    return b, a
+
+
+@pytest.mark.parametrize("kernel", ["jit", "lfilter"])
+def test_biquad(monkeypatch, kernel):
+    if kernel == "lfilter":
+        monkeypatch.setattr(filters, "numba", None)
+    rng = np.random.default_rng(0)
+    x = rng.standard_normal((6, 2, 1000))
+    b, a = random_coefficients(rng, 6)
+    y = filters.biquad(x, b[:, None], a[:, None])
+    for i in range(6):
+        np.testing.assert_allclose(y[i], lfilter(b[i], a[i], x[i]), atol=1e-10)
+
+
+def test_biquad_fallback(monkeypatch):
+    # the lfilter fallback used without numba matches the compiled kernel
+    rng = np.random.default_rng(4)
+    x = rng.standard_normal((8, 2, 500)).astype(np.float32)
+    b, a = random_coefficients(rng, 8)
+    y = filters.biquad(x, b[:, None], a[:, None])
+    monkeypatch.setattr(filters, "numba", None)
+    np.testing.assert_allclose(filters.biquad(x, b[:, None], a[:, None]),
+                               y,
+                               atol=1e-5)
+
+
+def test_biquad_broadcast():
+    rng = np.random.default_rng(1)
+    x = rng.standard_normal((3, 4, 200)).astype(np.float32)
+    b, a = random_coefficients(rng, 4)
+    # unnormalized denominator, one filter per channel
+    y = filters.biquad(x, 2 * b, 2 * a)
+    assert y.dtype == np.float32 and y.shape == x.shape
+    for j in range(4):
+        np.testing.assert_allclose(y[:, j],
+                                   lfilter(b[j], a[j], x[:, j]),
+                                   atol=1e-4)
+
+    # a single filter for every signal
+    np.testing.assert_allclose(filters.biquad(x[0], b[0], a[0]),
+                               lfilter(b[0], a[0], x[0]),
+                               atol=1e-4)
+
+    with pytest.raises(ValueError):
+        filters.biquad(x, [1, 2, 3, 4], [1])
+
+
+def test_derivator_integrator():
+    x = np.random.default_rng(2).standard_normal((2, 500))
+    derivator, integrator = get_derivator_integrator(44100)
+    np.testing.assert_allclose(derivator(x), lfilter([.5, -.5], [1], x))
+    alpha = 1 / (1 + 1 / 44100 * 2 * np.pi * 10)
+    np.testing.assert_allclose(
+        integrator(x),
+        lfilter([alpha**2, -alpha**2], [1, -2 * alpha, alpha**2], x),
+        atol=1e-10)
+
+
+def test_random_phase_mangle():
+    x = np.random.default_rng(3).standard_normal((2, 500))
+    random.seed(0)
+    y = filters.random_phase_mangle(x, 20, 2000, .99, 44100)
+    random.seed(0)
+    b, a = filters.pole_to_z_filter(filters.random_angle(20, 2000, 44100),
+                                    .99)
+    np.testing.assert_allclose(y, lfilter(b, a, x), atol=1e-10)
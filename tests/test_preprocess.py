@@ -0,0 +1,404 @@
+import lmdb
+import numpy as np
+import pytest
+import yaml
+from udls.generated import AudioExample
+
+import rave.dataset
+from rave.dataset import MemmapAudioDataset
+from scripts import preprocess
+
+
+@pytest.mark.parametrize("commit_items,commit_bytes,n_commits",
+                         [(10, 2**30, 5), (1000, 2**30, 1), (1000, 1, 45)])
+def test_lmdb_writer(tmp_path, commit_items, commit_bytes, n_commits):
+    env = lmdb.open(str(tmp_path / "db"), map_size=2**26)
+    writer = preprocess.LMDBWriter(env,
+                                   commit_items=commit_items,
+                                   commit_bytes=commit_bytes,
+                                   queue_depth=4)
+    writer.start()
+    for i in range(45):
+        writer.put(f'{i:08d}'.encode(), np.full(16, i, np.int16).tobytes())
+    writer.close()
+
+    assert writer.n_commits == n_commits
+    assert writer.n_items == 45
+    assert writer.n_bytes == 45 * 32
+    with env.begin() as txn:
+        assert txn.stat()['entries'] == 45
+        value = np.frombuffer(txn.get(b'00000012'), np.int16)
+        assert (value == 12).all()
+
+
+def test_process_audio_array():
+    x = np.arange(2 * 64, dtype=np.int16)
+    ae = AudioExample.FromString(
+        preprocess.process_audio_array(x.tobytes(), 16000, 2))
+    buffer = ae.buffers['waveform']
+    assert buffer.precision == AudioExample.Precision.INT16
+    assert buffer.sampling_rate == 16000
+    np.testing.assert_array_equal(np.frombuffer(buffer.data, np.int16), x)
+
+
+def test_manifest(tmp_path):
+    config = {'lazy': False, 'channels': 1, 'sr': 44100, 'num_signal': 1024}
+    manifest = preprocess.Manifest(config)
+    assert manifest.add('a.wav', {'size': 10, 'mtime': 1}, 4, 2.) == (0, 4)
+    assert manifest.add('b.wav', {'size': 20, 'mtime': 1}, 0, 0.) == (4, 4)
+    assert manifest.add('c.wav', {'size': 30, 'mtime': 1}, 2, 1.) == (4, 6)
+    manifest.save(str(tmp_path))
+
+    manifest = preprocess.Manifest.load(str(tmp_path))
+    assert manifest.config == config
+    assert manifest.next_key == 6
+    assert manifest.n_seconds == 3.
+    assert manifest.is_up_to_date('a.wav', {'size': 10, 'mtime': 1})
+    assert not manifest.is_up_to_date('a.wav', {'size': 10, 'mtime': 2})
+    assert not manifest.is_up_to_date('d.wav', {'size': 10, 'mtime': 1})
+
+    assert manifest.remove('a.wav').tolist() == [0, 1, 2, 3]
+    assert manifest.remove('b.wav').tolist() == []
+    assert manifest.tombstones == [[0, 4]]
+    assert manifest.add('a.wav', {'size': 10, 'mtime': 2}, 1, .5) == (6, 7)
+
+
+def test_manifest_partial(tmp_path):
+    manifest = preprocess.Manifest({})
+    # chunks of files decoded concurrently interleave
+    for path in ['a.wav', 'b.wav', 'a.wav', 'a.wav', 'b.wav']:
+        manifest.allocate(path)
+    manifest.complete('a.wav', {'size': 10, 'mtime': 1}, 3.)
+    assert manifest.files['a.wav']['keys'] == [[0, 1], [2, 4]]
+    assert preprocess.get_file_keys(manifest.files['a.wav']).tolist() == [
+        0, 2, 3
+    ]
+    manifest.save(str(tmp_path))
+
+    # b.wav was interrupted, its keys are dropped by the next run
+    manifest = preprocess.Manifest.load(str(tmp_path))
+    assert list(manifest.files) == ['a.wav']
+    assert manifest.discard('b.wav').tolist() == [1, 4]
+    assert manifest.tombstones == [[1, 2], [4, 5]] and not manifest.partial
+
+    # manifests holding a single range per file
+    manifest = preprocess.Manifest({}, {'a.wav': {'keys': [0, 2]}}, 2)
+    assert manifest.remove('a.wav').tolist() == [0, 1]
+
+
+def test_signature_matches():
+    old = {'size': 10, 'mtime': 1, 'hash': 'abc'}
+    assert preprocess.signature_matches(old, {'size': 10, 'mtime': 2,
+                                              'hash': 'abc'})
+    assert not preprocess.signature_matches(old, {'size': 10, 'mtime': 1,
+                                                  'hash': 'abd'})
+    assert preprocess.signature_matches(old, {'size': 10, 'mtime': 1})
+    assert not preprocess.signature_matches(old, {'size': 11, 'mtime': 1})
+
+
+def test_delete_keys_from(tmp_path):
+    env = lmdb.open(str(tmp_path / "db"), map_size=2**24)
+    with env.begin(write=True) as txn:
+        for i in range(10):
+            txn.put(f'{i:08d}'.encode(), b'x')
+    assert preprocess.delete_keys_from(env, 7) == 3
+    assert preprocess.delete_keys_from(env, 7) == 0
+    with env.begin() as txn:
+        keys = list(txn.cursor().iternext(values=False))
+    assert keys == [f'{i:08d}'.encode() for i in range(7)]
+
+
+def test_memmap_writer(tmp_path):
+    writer = preprocess.MemmapWriter(str(tmp_path))
+    for i in range(6):
+        writer.put(f'{i:08d}'.encode(), np.full((2, 64), i, np.int16).tobytes())
+    writer.truncate(5 * 128)
+    assert writer.position == 5 * 128
+    writer.close()
+
+    writer = preprocess.MemmapWriter(str(tmp_path))
+    assert writer.position == 5 * 128
+    # chunk 2 was tombstoned, chunk 5 truncated
+    offsets = preprocess.get_memmap_offsets([[3 * 128, 5 * 128], [0, 256]],
+                                            chunk_samples=128)
+    np.testing.assert_array_equal(offsets[:, 0], [0, 128, 384, 512])
+    writer.write_offsets(offsets)
+    writer.close()
+
+    dataset = MemmapAudioDataset(str(tmp_path), n_channels=2)
+    assert len(dataset) == 4
+    for item, key in zip(dataset, [0, 1, 3, 4]):
+        assert item.shape == (2, 64)
+        np.testing.assert_allclose(item, key / (2**15 - 1))
+
+
+def test_windowed_memmap(tmp_path):
+    writer = preprocess.MemmapWriter(str(tmp_path))
+    segments = []
+    for length in [100, 10, 64]:
+        start = writer.position
+        x = np.arange(length, dtype=np.int16)
+        writer.put(b'', np.stack([x, -x], -1).tobytes())
+        segments.append([start, writer.position])
+    writer.write_offsets(preprocess.get_memmap_offsets(segments))
+    writer.close()
+
+    dataset = MemmapAudioDataset(str(tmp_path), n_channels=2, window=32)
+    assert len(dataset) == 3 + 0 + 2
+    for item in dataset:
+        assert item.shape == (2, 32)
+        item = np.round(item * (2**15 - 1))
+        np.testing.assert_array_equal(np.diff(item[0]), 1)
+        np.testing.assert_array_equal(item[1], -item[0])
+
+    dataset = MemmapAudioDataset(str(tmp_path),
+                                 n_channels=2,
+                                 window=32,
+                                 hop=16,
+                                 random_offset=False)
+    starts = [np.round(item[0, 0] * (2**15 - 1)) for item in dataset]
+    assert starts == [0, 16, 32, 48, 64, 0, 16, 32]
+
+
+def test_get_metadata():
+    rng = np.random.default_rng(0)
+    x = np.zeros((2, 4096), dtype=np.int16)
+    x[:, :1024] = rng.integers(-2**14, 2**14, (2, 1024))
+
+    stats = preprocess.get_metadata(x.tobytes(), 2, threshold_db=-60.)
+    assert stats['active_ratio'] == .25
+    assert 0 < stats['rms_amplitude'] < stats['peak'] <= .5
+
+    stats = preprocess.get_metadata(np.zeros(4096, np.int16).tobytes())
+    assert stats == {
+        'peak': 0.,
+        'rms_amplitude': 0.,
+        'active_ratio': 0.,
+        'centroid': 0.
+    }
+
+    t = np.arange(4096) / 16000
+    x = (np.sin(2 * np.pi * 1000 * t) * 2**14).astype(np.int16)
+    stats = preprocess.get_metadata(x.tobytes(), sr=16000)
+    assert 900 < stats['centroid'] < 1100
+
+
+@pytest.mark.parametrize("silence", ["flag", "drop"])
+def test_silent_chunks(tmp_path, silence):
+    sf = pytest.importorskip("soundfile")
+    rng = np.random.default_rng(0)
+    x = np.zeros(4 * 2048, dtype=np.float32)
+    x[2048:4096] = rng.uniform(-.5, .5, 2048)
+    sf.write(tmp_path / "a.wav", x, 16000)
+
+    items = list(
+        preprocess.load_audio_examples(str(tmp_path / "a.wav"),
+                                       1024,
+                                       16000,
+                                       decoder='soundfile',
+                                       silence=silence))
+    assert items[-1] == (str(tmp_path / "a.wav"), True)
+    examples = [ae for _, ae in items[:-1]]
+    if silence == 'drop':
+        assert [ae is None for ae in examples] == [True, False, True, True]
+    else:
+        silent = [
+            AudioExample.FromString(ae).metadata['silent']
+            for ae, _, _ in examples
+        ]
+        assert silent == ['1', '0', '1', '1']
+        assert [stats['active_ratio'] > 0 for _, stats, _ in examples] == [
+            False, True, False, False
+        ]
+
+
+def test_save_chunk_array(tmp_path):
+    manifest = preprocess.Manifest({})
+    manifest.add('a.wav', {'size': 1, 'mtime': 1}, 2, 1.)
+    manifest.add('b.wav', {'size': 1, 'mtime': 1}, 2, 1.)
+    stats = [
+        np.array([(2, .5, .1, 1000., 0.), (3, .5, .1, 1000., 0.)],
+                 dtype=rave.dataset.STATS_DTYPE),
+        np.array([(1, .5, .1, 1000., 0.), (0, .5, .1, 1000., 0.)],
+                 dtype=rave.dataset.STATS_DTYPE),
+        # left over by an interrupted run
+        np.array([(4, .5, .1, 1000., 0.)], dtype=rave.dataset.STATS_DTYPE),
+    ]
+    manifest.remove('a.wav')
+    preprocess.save_chunk_array(str(tmp_path / 'stats.npy'), manifest, stats,
+                                rave.dataset.STATS_DTYPE)
+    assert rave.dataset.load_stats(str(tmp_path))['key'].tolist() == [2, 3]
+
+
+def test_get_chunk_hash():
+    rng = np.random.default_rng(0)
+    t = np.arange(2**15) / 44100
+    x = np.sin(2 * np.pi * 440 * t * (1 + t)) + .1 * rng.standard_normal(
+        len(t))
+    a = (x * 2**13).astype(np.int16)
+    b = (x * 2**12).astype(np.int16)
+    c = (rng.standard_normal(len(t)) * 2**13).astype(np.int16)
+
+    hash = preprocess.get_chunk_hash
+    assert hash(a.tobytes()) == hash(a.copy().tobytes())
+    assert hash(a.tobytes()) != hash(b.tobytes())
+    assert hash(a.tobytes(), fingerprint=True) == hash(b.tobytes(),
+                                                       fingerprint=True)
+    assert hash(a.tobytes(), fingerprint=True) != hash(c.tobytes(),
+                                                       fingerprint=True)
+
+
+def emit_chunks(path):
+    for i in range(20):
+        yield path, (bytes([len(path), i]) * 64, {'index': i}, i)
+    # larger than a slot
+    yield path, (bytes(256), {'index': 20}, 20)
+    yield path, True
+
+
+@pytest.mark.parametrize("n_slots", [0, 2, 4096])
+def test_chunk_transport(n_slots):
+    import multiprocessing
+
+    # files have more chunks than there are slots
+    transport = preprocess.ChunkTransport(128, n_slots)
+    pool = multiprocessing.Pool(2, initializer=preprocess.init_worker,
+                                initargs=(transport, None))
+    paths = ['a', 'bb', 'ccc']
+    received = {}
+    for path, payload in preprocess.flatmap(pool, emit_chunks, paths,
+                                            transport):
+        if isinstance(payload, bool):
+            continue
+        data, stats, digest = payload
+        received.setdefault(path, []).append((data, stats['index'], digest))
+    pool.close()
+    pool.join()
+    transport.close()
+
+    assert sorted(received) == paths
+    for path, chunks in received.items():
+        assert chunks == [(bytes([len(path), i]) * 64, i, i)
+                          for i in range(20)] + [(bytes(256), 20, 20)]
+
+
+def test_transport_slots():
+    assert preprocess.get_transport_slots(1024, 2**20) <= 1024
+    assert preprocess.get_transport_slots(1024, 2**20, 4) <= 256
+
+
+def write_tones(path, lengths, sr=16000):
+    sf = pytest.importorskip("soundfile")
+    path.mkdir()
+    files = {}
+    for i, length in enumerate(lengths):
+        t = np.arange(length) / sr
+        x = .5 * np.sin(2 * np.pi * 100 * (i + 1) * t)
+        sf.write(path / f"{i}.wav", x, sr, subtype='PCM_16')
+        files[str(path / f"{i}.wav")] = x
+    return files
+
+
+@pytest.fixture
+def run_preprocess():
+
+    def run(input_path, output_path, *args):
+        preprocess.FLAGS.unparse_flags()
+        preprocess.FLAGS([
+            'preprocess', f'--input_path={input_path}',
+            f'--output_path={output_path}', '--decoder=soundfile',
+            '--sampling_rate=16000', '--num_signal=1024', *args
+        ])
+        preprocess.main(['preprocess'])
+        return preprocess.Manifest.load(str(output_path))
+
+    yield run
+    preprocess.FLAGS.unparse_flags()
+
+
+def read_chunk(env, key):
+    with env.begin() as txn:
+        ae = AudioExample.FromString(txn.get(f'{key:08d}'.encode()))
+    return np.frombuffer(ae.buffers['waveform'].data, np.int16) / 2**15
+
+
+def test_preprocess_database(tmp_path, run_preprocess):
+    files = write_tones(tmp_path / "audio", [5 * 2048 + 10, 3 * 2048, 100])
+    # files listed twice are processed once
+    manifest = run_preprocess(tmp_path / "audio", tmp_path / "db",
+                              f'--input_path={tmp_path / "audio"}')
+    assert not manifest.partial
+    assert len(rave.dataset.load_key_index(str(tmp_path / "db"))) == 8
+
+    def check(manifest):
+        env = lmdb.open(str(tmp_path / "db"), readonly=True, lock=False)
+        for path, entry in manifest.files.items():
+            keys = preprocess.get_file_keys(entry)
+            assert len(keys) == len(files[path]) // 2048
+            for i, key in enumerate(keys):
+                np.testing.assert_allclose(read_chunk(env, key),
+                                           files[path][i * 2048:(i + 1) *
+                                                       2048],
+                                           atol=1e-3)
+        with env.begin() as txn:
+            assert txn.stat()['entries'] == 8
+        env.close()
+
+    check(manifest)
+
+    # a run interrupted while writing 0.wav
+    path = str(tmp_path / "audio" / "0.wav")
+    entry = manifest.files.pop(path)
+    manifest.partial[path] = {'keys': entry['keys']}
+    manifest.save(str(tmp_path / "db"))
+    manifest = run_preprocess(tmp_path / "audio", tmp_path / "db")
+    assert manifest.next_key == 13
+    assert preprocess.get_file_keys(manifest.files[path]).min() == 8
+    check(manifest)
+
+
+def test_preprocess_windowed(tmp_path, run_preprocess):
+    files = write_tones(tmp_path / "audio", [5000, 70000])
+    run_preprocess(tmp_path / "audio", tmp_path / "db", '--format=memmap',
+                   '--windowed')
+    audio = np.fromfile(tmp_path / "db" / "audio.raw", np.int16) / 2**15
+    offsets = np.load(tmp_path / "db" / "offsets.npy")
+    segments = sorted((audio[start:stop] for start, stop in offsets),
+                      key=len)
+    for segment, x in zip(segments, files.values()):
+        np.testing.assert_allclose(segment, x[:len(segment)], atol=1e-3)
+    assert [len(segment) for segment in segments] == [5000, 70000]
+
+
+
+def test_preprocess_fewer_shards(tmp_path, run_preprocess):
+    write_tones(tmp_path / "audio", [3 * 2048] * 6)
+    run_preprocess(tmp_path / "audio", tmp_path / "db", '--shards=3')
+    (tmp_path / "db" / "other_0000").mkdir()
+    for name in ['metadata.yaml', 'data.mdb']:
+        (tmp_path / "db" / "other_0000" / name).write_bytes(
+            (tmp_path / "db" / "shard_0000" / name).read_bytes())
+
+    run_preprocess(tmp_path / "audio", tmp_path / "db", '--shards=2')
+    with open(tmp_path / "db" / "metadata.yaml") as f:
+        metadata = yaml.safe_load(f)
+    assert metadata['shards'] == ['other_0000', 'shard_0000', 'shard_0001']
+    assert not (tmp_path / "db" / "shard_0002").exists()
+
+
+@pytest.mark.parametrize("silence", ["flag", "drop"])
+def test_preprocess_silence_summary(tmp_path, run_preprocess, silence):
+    sf = pytest.importorskip("soundfile")
+    (tmp_path / "audio").mkdir()
+    x = np.zeros(5 * 2048)
+    x[2048:4096] = np.random.default_rng(0).uniform(-.5, .5, 2048)
+    sf.write(tmp_path / "audio" / "a.wav", x, 16000, subtype='PCM_16')
+    run_preprocess(tmp_path / "audio", tmp_path / "db", f'--silence={silence}')
+
+    with open(tmp_path / "db" / "metadata.yaml") as f:
+        summary = yaml.safe_load(f)['silence']
+    action = 'dropped' if silence == 'drop' else 'flagged'
+    assert summary['mode'] == silence
+    assert summary['threshold_db'] == -60.
+    assert summary[f'{action}_chunks'] == 4
+    assert summary[f'{action}_seconds'] == 4 * 2048 / 16000
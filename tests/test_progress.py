@@ -0,0 +1,109 @@
+import json
+import os
+from types import SimpleNamespace
+
+import torch
+from absl import flags
+
+from rave import progress
+
+
+def read_events(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_reporter_throttles_updates(tmp_path, monkeypatch):
+    clock = [100.]
+    monkeypatch.setattr(progress.time, 'monotonic', lambda: clock[0])
+    path = str(tmp_path / 'events.jsonl')
+    reporter = progress.ProgressReporter(path=path, interval=1., shard=2)
+
+    reporter.emit('start', script='test', unused=None)
+    for i in range(10):
+        reporter.update('work', i, 10, metrics={'loss': .5})
+        clock[0] += .25
+    reporter.update('work', 10, 10)
+    reporter.close()
+
+    events = read_events(path)
+    assert events[0]['event'] == 'start' and 'unused' not in events[0]
+    assert all(e['shard'] == 2 for e in events)
+    updates = [e for e in events if e['event'] == 'progress']
+    # first update, one per second, and the final one
+    assert [e['done'] for e in updates] == [0, 4, 8, 10]
+    assert updates[1]['rate'] == 4.
+    assert updates[1]['eta'] == 1.5
+    assert updates[1]['metrics'] == {'loss': .5}
+
+
+def test_reporter_fd():
+    read_fd, write_fd = os.pipe()
+    reporter = progress.ProgressReporter(fd=write_fd)
+    assert reporter.enabled
+    reporter.update('work', 1, 2)
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        event, = map(json.loads, f)
+    assert (event['stage'], event['done'], event['total']) == ('work', 1, 2)
+
+    # the reader is gone, reporting stops without failing
+    reporter.update('work', 2, 2)
+    assert not reporter.enabled
+
+
+def test_disabled_reporter():
+    reporter = progress.ProgressReporter()
+    assert not reporter.enabled and not reporter.due('work')
+    reporter.update('work', 1, 2)
+    reporter.emit('end')
+
+
+def test_from_flags(tmp_path):
+    flag_values = flags.FlagValues()
+    progress.define_flags(flag_values)
+    progress.define_flags(flag_values)
+    path = str(tmp_path / 'events.jsonl')
+    flag_values(['script', f'--progress_jsonl={path}'])
+
+    reporter = progress.from_flags(flag_values)
+    reporter.emit('end', success=True)
+    reporter.close()
+    assert read_events(path)[0]['success']
+
+
+def test_describe():
+    assert progress.describe({'event': 'end'}) == 'end'
+    assert progress.describe({
+        'event': 'progress',
+        'stage': 'train',
+        'done': 100,
+        'total': 1000,
+        'eta': 3725.5,
+    }) == 'train 100/1000 (ETA 1:02:05)'
+
+
+def test_progress_callback(tmp_path):
+    from rave.core import ProgressCallback
+
+    path = str(tmp_path / 'events.jsonl')
+    reporter = progress.ProgressReporter(path=path, interval=0)
+    callback = ProgressCallback(reporter)
+    trainer = SimpleNamespace(global_step=10,
+                              max_steps=100,
+                              current_epoch=1,
+                              sanity_checking=False,
+                              callback_metrics={
+                                  'loss': torch.tensor(.25),
+                                  'spectrum': torch.zeros(4),
+                              })
+    callback.on_train_batch_end(trainer, None, None, None, 0)
+    trainer.callback_metrics['validation'] = torch.tensor(1.5)
+    callback.on_validation_end(trainer, None)
+    reporter.close()
+
+    update, validation = read_events(path)
+    assert update['stage'] == 'train' and update['done'] == 10
+    assert update['metrics'] == {'loss': .25}
+    assert validation['event'] == 'metrics'
+    assert validation['metrics'] == {'loss': .25, 'validation': 1.5}
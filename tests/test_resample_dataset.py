@@ -0,0 +1,96 @@
+import json
+import os
+import subprocess
+import sys
+
+import lmdb
+import numpy as np
+import yaml
+from udls.generated import AudioExample
+
+from rave.audio import float_to_int16, resample_poly
+from rave.dataset import (STATS_DTYPE, STATS_FILE, AudioDataset, get_variant,
+                          get_variant_path)
+from tests.test_dataset import write_database
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def resample_dataset(*args):
+    # run apart, its flags would clash with the ones of preprocess
+    subprocess.run(
+        [sys.executable, '-m', 'scripts.resample_dataset', *args],
+        cwd=ROOT,
+        check=True,
+    )
+
+
+def read_records(path):
+    env = lmdb.open(str(path), lock=False, readonly=True)
+    with env.begin() as txn:
+        examples = [AudioExample.FromString(v) for v in txn.cursor().iternext(
+            keys=False)]
+    env.close()
+    return [
+        np.frombuffer(ae.buffers['waveform'].data,
+                      dtype=np.int16).reshape(ae.buffers['waveform'].shape)
+        for ae in examples
+    ]
+
+
+def test_resample_dataset(tmp_path):
+    n_signal, sr = 1024, 16000
+    t = np.arange(8 * n_signal) / sr
+    tones = [
+        float_to_int16(.5 * np.sin(2 * np.pi * f * t)[None])
+        for f in [440, 1000]
+    ]
+    # chunks of both files are interleaved, as written on arrival, and the
+    # second file only fills three chunks
+    keys = {'a.wav': [[0, 2], [3, 6]], 'b.wav': [[2, 3], [6, 8]]}
+    chunks = [None] * 8
+    for tone, ranges in zip(tones, keys.values()):
+        file_keys = np.concatenate([np.arange(*r) for r in ranges])
+        for i, key in enumerate(file_keys):
+            chunks[key] = tone[:, i * n_signal:(i + 1) * n_signal]
+    write_database(tmp_path, chunks, sr=sr)
+    with open(tmp_path / 'manifest.json', 'w') as f:
+        json.dump({'files': {k: {'keys': v} for k, v in keys.items()}}, f)
+    stats = np.zeros(8, dtype=STATS_DTYPE)
+    stats['key'] = np.arange(8)
+    stats['peak'] = np.arange(8) / 8
+    stats['rms'] = .1
+    np.save(tmp_path / STATS_FILE, stats)
+
+    resample_dataset('--db_path', str(tmp_path), '--sampling_rate', '8000')
+
+    with open(tmp_path / 'metadata.yaml', 'r') as f:
+        metadata = yaml.safe_load(f)
+    path, variant = get_variant(str(tmp_path), metadata, 8000)
+    assert path == get_variant_path(str(tmp_path), 8000)
+    assert variant['sr'] == 8000
+    assert variant['source']['sr'] == sr
+
+    # chunks keep their length, the files being resampled as a whole
+    records = read_records(path)
+    assert len(records) == 3
+    assert all(r.shape == (1, n_signal) for r in records)
+    for record, (tone, start) in zip(records, [(0, 0), (0, n_signal),
+                                               (1, 0)]):
+        reference = float_to_int16(
+            resample_poly(tones[tone][:, :5 * n_signal] / (2**15 - 1), sr,
+                          8000))
+        np.testing.assert_allclose(record,
+                                   reference[:, start:start + n_signal],
+                                   atol=2)
+    assert len(AudioDataset(path)) == 3
+
+    # statistics of the source chunks every chunk covers are merged
+    variant_stats = np.load(os.path.join(path, STATS_FILE))
+    np.testing.assert_allclose(variant_stats['peak'], [1 / 8, 4 / 8, 6 / 8])
+    np.testing.assert_allclose(variant_stats['rms'], .1)
+
+    # updating the dataset outdates the variant
+    with open(tmp_path / 'manifest.json', 'w') as f:
+        json.dump({'files': {'a.wav': {'keys': keys['a.wav']}}}, f)
+    assert get_variant(str(tmp_path), metadata, 8000) is None
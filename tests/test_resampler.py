@@ -1,9 +1,11 @@
 import cached_conv as cc
 import gin
+import numpy as np
 import pytest
 import torch
+import torchaudio
 
-from rave.resampler import Resampler
+from rave.resampler import Resampler, get_resampler, resample
 
 configs = [(44100, 22050), (48000, 16000)]
 
@@ -36,3 +38,33 @@ def test_resampler(target_sr, model_sr):
 
     except ValueError:
         pass
+
+
+@pytest.mark.parametrize("orig_sr,target_sr", [(48000, 44100),
+                                               (16000, 44100)])
+def test_resample(orig_sr, target_sr):
+    x = np.random.randn(2, 3, 4000).astype(np.float32)
+    y = resample(x, orig_sr, target_sr)
+    expected = torchaudio.functional.resample(torch.from_numpy(x), orig_sr,
+                                              target_sr)
+    assert isinstance(y, np.ndarray) and y.dtype == np.float32
+    np.testing.assert_allclose(y, expected.numpy(), atol=1e-6)
+
+    x = torch.from_numpy(x).double()
+    y = resample(x, orig_sr, target_sr)
+    assert y.dtype == torch.float64
+    np.testing.assert_allclose(
+        y, torchaudio.functional.resample(x, orig_sr, target_sr))
+
+    assert resample(np.zeros(10, np.int16), orig_sr,
+                    orig_sr).dtype == np.float32
+
+
+def test_resampler_cache():
+    get_resampler.cache_clear()
+    x = np.random.randn(1000).astype(np.float32)
+    resample(x, 44100, 22050)
+    resample(x, 88200, 44100)
+    resample(x[None], 44100, 22050)
+    info = get_resampler.cache_info()
+    assert info.misses == 1 and info.hits == 2